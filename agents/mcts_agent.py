@@ -0,0 +1,206 @@
+import time
+
+import numpy as np
+
+from minichess.chess.fastchess import Chess
+from minichess.chess.fastchess_utils import get_best_child, legal_moves_to_illegal_move_mask, prior_math
+from minichess.chess.move_utils import calculate_all_moves, index_to_move
+from .base_agent import BaseAgent
+
+# Node states
+_UNEXPANDED = 0
+_EXPANDED = 1
+_TERMINAL = 2
+
+# Simulations per second the node pool is sized for when no size is given, comfortably above the ~3000/s reached on 5x4
+POOL_SIMULATION_RATE = 5000
+
+# Scale of the material evaluation in HeuristicEvaluator: a lead of this many centipawns is worth a value of about 0.76
+VALUE_SCALE = 400
+
+
+def move_slots(board: Chess, all_moves, move_cap: int):
+    """
+    Flat index into the (rows, cols, move_cap) node arrays of every legal move, in the order of board.legal_move_array().
+    Moves are indexed like move_to_index does: by origin square, and by the move's deltas seen from the side to move.
+    """
+    moves = board.legal_move_array()
+    origin, target, promotion = moves & 63, (moves >> 6) & 63, (moves >> 12) & 7
+    i, j = origin // 8, origin % 8
+    dx, dy = target // 8 - i, target % 8 - j
+    if board.turn == 0:
+        dx, dy = -dx, -dy
+    # The packed promotion field is the piece type + 1, move_to_index indexes promotions by the piece type and uses 0 for none
+    promotion = np.where(promotion > 0, promotion - 1, 0)
+    return (i * board.dims[1] + j) * move_cap + all_moves[dx + 8, dy + 8, promotion] - 1
+
+
+class UniformEvaluator:
+    """Same prior for every legal move and a value of 0 for every position, so the search is driven by terminal positions alone."""
+
+    def __call__(self, board: Chess, slots):
+        return None, 0.0
+
+
+class HeuristicEvaluator:
+    """
+    Material (with the board's piece values) squashed into [-1, 1] as value, and priors favouring captures of valuable pieces and promotions.
+    """
+
+    def __call__(self, board: Chess, slots):
+        moves = board.legal_move_array()
+        weights = 1.0 + ((moves >> 15) & 7) + 2.0 * (((moves >> 12) & 7) != 0)
+        return weights / weights.sum(), float(np.tanh(board.evaluation() / VALUE_SCALE))
+
+
+class ModelEvaluator:
+    """
+    Priors and value from a model, e.g. a neural network trained on agent_board_state encodings.
+
+    The model is called with board.agent_board_state() and has to return (policy, value): policy with one entry per
+    (rows, cols, move_cap) slot (see move_slots), value in [-1, 1] from white's point of view.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, board: Chess, slots):
+        policy, value = self.model(board.agent_board_state())
+        logits = np.asarray(policy, dtype=np.float64).ravel()[slots]
+        # Softmax over the legal moves, shifted by the largest logit so that large logits can't overflow
+        priors = np.exp(logits - logits.max())
+        return priors / priors.sum(), float(value)
+
+
+class MCTSAgent(BaseAgent):
+    """
+    Monte Carlo tree search with PUCT selection (fastchess_utils.get_best_child), under a per-move time budget.
+
+    All nodes live in preallocated arrays: for node n, child_visits[n], child_values[n], child_priors[n] and illegal[n] hold one entry
+    per move slot of the (rows, cols, move_cap) move encoding of move_utils.calculate_all_moves, flattened. Values are summed from
+    white's point of view, which is what get_best_child expects. When the pool is full, leaves are still evaluated but no longer expanded.
+
+    The evaluator is called as evaluator(board, slots), slots being the move_slots of the legal moves, and returns (priors, value):
+    priors over those moves (None for uniform priors) and the value of the position in [-1, 1] from white's point of view.
+    """
+
+    def __init__(self, name: str = "MCTSAgent", time_budget: float = 0.1, evaluator=None, cpuct: float = 1.5, cnoise: float = 0.0,
+                 max_nodes: int = None, max_simulations: int = None):
+        """
+        :param evaluator: UniformEvaluator, HeuristicEvaluator (the default), ModelEvaluator or any callable like them.
+        :param float cpuct: Exploration constant of the PUCT formula.
+        :param float cnoise: Share of random noise mixed into the root priors (see fastchess_utils.prior_math), 0 for none.
+        :param int max_nodes: Size of the node pool. Each node takes about 20 bytes per move slot, e.g. 20 kB on 5x4.
+            None to fit the simulations of one move: max_simulations, or time_budget at POOL_SIMULATION_RATE.
+        :param int max_simulations: Stop after this many simulations even if time is left, None to use the whole budget.
+        """
+        super().__init__(name)
+        self.time_budget = time_budget
+        self.evaluator = evaluator if evaluator is not None else HeuristicEvaluator()
+        self.cpuct = cpuct
+        self.cnoise = cnoise
+        if max_nodes is None:
+            # Every simulation expands at most one node, on top of the root
+            max_nodes = (max_simulations if max_simulations is not None else int(time_budget * POOL_SIMULATION_RATE)) + 1
+        self.max_nodes = max_nodes
+        self.max_simulations = max_simulations
+        self.dims = None
+
+    def _allocate_pools(self, dims):
+        self.dims = tuple(dims)
+        self.all_moves, self.all_moves_inv = calculate_all_moves(dims)
+        self.move_cap = self.all_moves_inv.shape[0]
+        slots = dims[0] * dims[1] * self.move_cap
+        self.child_visits = np.zeros((self.max_nodes, slots), dtype=np.float32)
+        self.child_values = np.zeros((self.max_nodes, slots), dtype=np.float32)
+        self.child_priors = np.zeros((self.max_nodes, slots), dtype=np.float32)
+        self.illegal = np.ones((self.max_nodes, slots), dtype=np.float32)
+        self.children = np.full((self.max_nodes, slots), -1, dtype=np.int32)
+        self.visits = np.zeros(self.max_nodes, dtype=np.float32)
+        self.terminal_values = np.zeros(self.max_nodes, dtype=np.float32)
+        self.state = np.zeros(self.max_nodes, dtype=np.int8)
+        self.node_count = 0
+
+    def _new_node(self):
+        """Index of a fresh node, -1 if the pool is full. Only the rows of a node are cleared, when it is handed out."""
+        if self.node_count == self.max_nodes:
+            return -1
+        node = self.node_count
+        self.node_count += 1
+        self.child_visits[node] = 0
+        self.child_values[node] = 0
+        self.children[node] = -1
+        self.visits[node] = 0
+        self.state[node] = _UNEXPANDED
+        return node
+
+    def _evaluate(self, board: Chess, node: int):
+        """Value of a leaf from white's point of view. Expands it (sets priors and legal moves) if it has a node."""
+        result = board.game_result()
+        if result is not None:
+            if node != -1:
+                self.state[node] = _TERMINAL
+                self.terminal_values[node] = result
+            return float(result)
+        slots = move_slots(board, self.all_moves, self.move_cap)
+        priors, value = self.evaluator(board, slots)
+        if node != -1:
+            self.illegal[node] = legal_moves_to_illegal_move_mask(*board.legal_moves(), (self.dims[0], self.dims[1], self.move_cap),
+                                                                  self.all_moves, board.turn).ravel()
+            self.child_priors[node] = 0
+            self.child_priors[node, slots] = 1.0 / len(slots) if priors is None else priors
+            self.state[node] = _EXPANDED
+        return value
+
+    def _simulate(self, board: Chess):
+        """One selection, evaluation and backup, starting from the root. The board is restored before returning."""
+        node, path, undos = 0, [], []
+        while node != -1 and self.state[node] == _EXPANDED:
+            slot = get_best_child(board.turn, self.child_values[node], self.child_visits[node], self.cpuct, self.visits[node],
+                                  self.child_priors[node], self.illegal[node])
+            square, index = divmod(int(slot), self.move_cap)
+            dx, dy, promotion = index_to_move(self.all_moves_inv, index, board.turn)
+            undos.append(board.make_move(square // self.dims[1], square % self.dims[1], dx, dy, promotion))
+            path.append((node, slot))
+            if self.children[node, slot] == -1:
+                self.children[node, slot] = self._new_node()
+            node = self.children[node, slot]
+
+        if node != -1 and self.state[node] == _TERMINAL:
+            value = float(self.terminal_values[node])
+        else:
+            value = self._evaluate(board, node)
+
+        for parent, slot in path:
+            self.child_values[parent, slot] += value
+            self.child_visits[parent, slot] += 1
+            self.visits[parent] += 1
+        for undo in reversed(undos):
+            board.unmake_move(undo)
+
+    def move(self, board: Chess):
+        if len(board.legal_move_array()) == 0:
+            return None
+        deadline = time.perf_counter() + self.time_budget
+        if self.dims != tuple(board.dims):
+            self._allocate_pools(board.dims)
+        self.node_count = 0
+
+        root = board.copy()
+        self._evaluate(root, self._new_node())
+        if self.cnoise > 0:
+            priors = prior_math(self.illegal[0].reshape(self.dims[0], self.dims[1], self.move_cap), self.dims,
+                                self.child_priors[0].astype(np.float64), self.move_cap, self.cnoise, 0.0, root.turn)
+            self.child_priors[0] = priors.ravel()
+
+        simulations = 0
+        while time.perf_counter() < deadline and (self.max_simulations is None or simulations < self.max_simulations):
+            self._simulate(root)
+            simulations += 1
+        self.simulations = simulations
+
+        # Most visited move, ties (e.g. no simulation at all) broken by the prior
+        scores = self.child_visits[0] + self.child_priors[0] * 1e-3 - self.illegal[0] * 1e9
+        square, index = divmod(int(np.argmax(scores)), self.move_cap)
+        dx, dy, promotion = index_to_move(self.all_moves_inv, index, root.turn)
+        return (square // self.dims[1], square % self.dims[1]), (int(dx), int(dy)), int(promotion)
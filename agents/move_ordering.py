@@ -0,0 +1,69 @@
+"""
+Move ordering tables that learn from the search itself: killer moves and the history heuristic.
+
+Both remember quiet moves (neither captures nor promotions) that caused a beta cutoff. Killer moves are kept per ply,
+as they tend to refute the sibling positions of the one they were found in. The history table scores moves by their
+origin and target square, over the whole search tree.
+"""
+import numpy as np
+
+from minichess.chess.fastchess_utils import MOVE_KEY_MASK
+
+# History scores are halved when any reaches this, so they keep fitting in int32 and old cutoffs weigh less
+HISTORY_LIMIT = 1 << 24
+
+
+class KillerTable:
+    """The last quiet moves that caused a beta cutoff at every ply, most recent first, as packed move keys (0 if empty)."""
+
+    def __init__(self, max_ply: int = 64, slots: int = 2):
+        self.moves = np.zeros((max_ply, slots), dtype=np.int32)
+
+    def clear(self):
+        self.moves[:] = 0
+
+    def store(self, ply: int, move: int):
+        """Makes the (packed) move the first killer of the ply, unless it already is one."""
+        if ply >= len(self.moves):
+            return
+        key = move & MOVE_KEY_MASK
+        killers = self.moves[ply]
+        if key in killers:
+            return
+        killers[1:] = killers[:-1]
+        killers[0] = key
+
+    def mask(self, ply: int, moves):
+        """Boolean mask of the packed moves that are killers of the ply."""
+        if ply is None or ply >= len(self.moves):
+            return np.zeros(len(moves), dtype=bool)
+        keys = moves & MOVE_KEY_MASK
+        mask = keys == self.moves[ply, 0]
+        for killer in self.moves[ply, 1:]:
+            mask |= keys == killer
+        return mask
+
+
+class HistoryTable:
+    """Cutoff scores of quiet moves by (color, origin square, target square), squares flattened as 8 * i + j."""
+
+    def __init__(self):
+        self.scores = np.zeros((2, 64, 64), dtype=np.int32)
+
+    def clear(self):
+        self.scores[:] = 0
+
+    def age(self):
+        """Halves all scores, so that moves which were good in earlier searches give way to the current ones."""
+        self.scores >>= 1
+
+    def update(self, color: int, move: int, depth: int):
+        """Rewards a quiet move that caused a cutoff at the given remaining depth, deeper cutoffs much more."""
+        origin, target = move & 63, (move >> 6) & 63
+        self.scores[color, origin, target] += depth * depth
+        if self.scores[color, origin, target] >= HISTORY_LIMIT:
+            self.age()
+
+    def lookup(self, color: int, moves):
+        """Scores of the packed moves for the given color."""
+        return self.scores[color, moves & 63, (moves >> 6) & 63]
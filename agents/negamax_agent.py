@@ -0,0 +1,508 @@
+import copy
+import multiprocessing
+import time
+
+import numpy as np
+
+from minichess.chess.fastchess import Chess
+from minichess.chess.fastchess_utils import DEFAULT_PIECE_VALUES, piece_matrix_to_legal_moves, pack_move, unpack_move, MOVE_KEY_MASK
+from .base_agent import BaseAgent
+from .move_ordering import HISTORY_LIMIT, HistoryTable, KillerTable
+from .transposition import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
+
+# Material value by piece type, shared by the agents built on NegamaxAgent
+PIECE_VALUES = dict(enumerate(DEFAULT_PIECE_VALUES.tolist()))
+
+# Ordering value of the captured piece, indexed by the captured field of a packed move (piece type + 1, 0 if none)
+CAPTURE_ORDER_VALUES = np.array([0] + [PIECE_VALUES[t] for t in range(6)])
+
+# Ordering value of a killer move: after all captures and promotions, before the other quiet moves
+KILLER_ORDER_VALUE = 50
+
+# Largest positional swing a capture is assumed to bring on top of the captured material, for delta pruning in _quiescence
+DELTA_MARGIN = 200
+
+# Depth the null-move search is reduced by, on top of the ply passed
+NULL_MOVE_REDUCTION = 2
+
+# Moves searched to full depth at every node before late-move reductions start, and the least remaining depth they apply at
+LMR_FULL_MOVES = 3
+LMR_MIN_DEPTH = 3
+
+# Depth of the search a book move is checked with, and how much worse than the best move it may score there and still be played
+BOOK_CHECK_DEPTH = 3
+BOOK_MARGIN = 50
+
+INF = 10**9
+
+# Score of a position the tablebase has as won, minus the number of plies until the win
+TABLEBASE_WIN = 10000
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the time budget for the current move has run out."""
+
+
+def iterative_deepening(search, time_budget: float, max_depth: int):
+    """
+    Calls search(depth, deadline) for depth = 1, 2, ... until max_depth is reached or the time budget runs out.
+    An iteration still running at the deadline is aborted, and the result of the last completed depth is returned.
+
+    :param search: Function searching to a fixed depth. Has to raise SearchTimeout once the deadline has passed.
+    :param float time_budget: Seconds available for the whole search.
+    :param int max_depth: Deepest iteration to run.
+    :return: Result of the deepest completed iteration, None if not even depth 1 completed.
+    """
+    start = time.perf_counter()
+    deadline = start + time_budget
+    result = None
+    for depth in range(1, max_depth + 1):
+        try:
+            result = search(depth, deadline)
+        except SearchTimeout:
+            break
+        # The next iteration takes several times as long as this one, don't start it if it can't finish anyway
+        if time.perf_counter() - start > time_budget / 2:
+            break
+    return result
+
+
+class NegamaxAgent(BaseAgent):
+    """
+    Alpha-beta negamax with a transposition table, searched with iterative deepening under a per-move time budget.
+    Subclasses provide the evaluation.
+    """
+
+    # Whether leaves are resolved by _quiescence instead of being evaluated as they are
+    quiescence = False
+    # Whether quiet moves are ordered by the killer and history tables (see agents/move_ordering.py)
+    history_ordering = False
+    # Whether nodes are cut off by null-move pruning, see _null_move_cutoff
+    null_move = False
+    # Whether late quiet moves are searched to a reduced depth first, see _reduction
+    late_move_reductions = False
+    # Whether moves after the first are searched with a null window first (principal variation search)
+    pvs = False
+    # Half-width of the window around the previous iteration's score each root search starts with, None for a full window
+    aspiration_window = None
+
+    def __init__(self, name: str = "NegamaxAgent", time_budget: float = 0.1, max_depth: int = 20, tablebase=None, book=None,
+                 workers: int = 1, variant: str = "5x4microchess"):
+        """
+        :param Tablebase tablebase: Endgame tablebase. Positions it covers are scored exactly instead of searched,
+            and in a covered root position the agent plays the table's best move right away.
+        :param OpeningBook book: Opening book, its moves are played without a full search if a shallow one doesn't find them bad.
+        :param int workers: Number of processes the root moves are split among (see agents/parallel_search.py).
+            With 1, or when the agent itself runs in a daemonic process (e.g. autograder.py --workers), it searches
+            on its own process only, and its moves are deterministic.
+        :param str variant: Variant the agent plays, the workers rebuild positions of it from FENs.
+        """
+        super().__init__(name)
+        self.time_budget = time_budget
+        self.max_depth = max_depth
+        self.tablebase = tablebase
+        self.book = book
+        self.workers = workers
+        self.variant = variant
+        self.pool = None
+        self.tt = TranspositionTable()
+        self.killers = KillerTable()
+        self.history = HistoryTable()
+        self.deadline = None
+
+    def __getstate__(self):
+        # Worker processes can't be sent to other processes, a copy of the agent starts its own when it needs them
+        state = self.__dict__.copy()
+        state["pool"] = None
+        return state
+
+    def reset(self):
+        self.tt.clear()
+        self.killers.clear()
+        self.history.clear()
+
+    def start_workers(self):
+        """
+        Starts the worker processes, if the agent searches on more than one and they haven't been started yet.
+        move calls this itself, and searches on its own process until all workers are up.
+        """
+        if self.pool is not None or self.workers <= 1 or multiprocessing.current_process().daemon:
+            return
+        from .parallel_search import RootSplitPool
+        worker_agent = copy.copy(self)
+        worker_agent.workers = 1
+        worker_agent.pool = None
+        worker_agent.book = None
+        worker_agent.tt = TranspositionTable()
+        worker_agent.killers = KillerTable()
+        worker_agent.history = HistoryTable()
+        self.pool = RootSplitPool(worker_agent, self.workers, self.variant)
+
+    def close(self):
+        """Stops the worker processes, if any. The agent keeps working, it starts them again on its next move."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def _list_moves(self, board: Chess):
+        pm, promo = board.legal_moves()
+        return piece_matrix_to_legal_moves(pm, promo)
+
+    def _piece_at(self, board, i, j):
+        try:
+            p = board.any_piece_at(i, j)
+            if p is None or p == -1 or p[0] == -1:
+                return None
+            return p
+        except Exception:
+            return None
+
+    def _make(self, board, move):
+        """Makes a packed move on the board, returns the undo record."""
+        (i, j), (dx, dy), promo = unpack_move(move)
+        return board.make_move(i, j, dx, dy, promo)
+
+    def _eval(self, board):
+        """Static evaluation from white's point of view."""
+        raise NotImplementedError("Agent must implement _eval(board)")
+
+    def _evaluation_tables(self, dims):
+        """
+        Piece values and piece-square tables the board should score positions with (see Chess.set_evaluation_tables),
+        so _eval can read the incrementally updated scores. None keeps the board's defaults.
+        """
+        return None
+
+    def _order_moves(self, board, moves, ply=None):
+        """
+        Move ordering: captures of valuable pieces and promotions first. With history_ordering, the killer moves of the ply
+        follow, and the remaining quiet moves are ordered by their history scores.
+
+        :param NDArray[int32] moves: Packed moves, from Chess.legal_move_array.
+        :param int ply: Distance of the node from the root, None where killer moves don't apply.
+        :return list: The packed moves as ints, best first. Equally good moves keep their order.
+        """
+        scores = CAPTURE_ORDER_VALUES[(moves >> 15) & 7] + 900 * (((moves >> 12) & 7) != 0)
+        if not self.history_ordering:
+            return moves[np.argsort(-scores, kind="stable")].tolist()
+        scores[(scores == 0) & self.killers.mask(ply, moves)] = KILLER_ORDER_VALUE
+        # History scores stay below HISTORY_LIMIT, so they only break ties between equal ordering values
+        keys = scores.astype(np.int64) * HISTORY_LIMIT + self.history.lookup(board.turn, moves)
+        return moves[np.argsort(-keys, kind="stable")].tolist()
+
+    def _null_move_cutoff(self, board, depth, beta, color, ply):
+        """
+        Null-move pruning: if the side to move could pass and still reach beta in a search reduced by NULL_MOVE_REDUCTION,
+        the node is taken to fail high. Small boards are full of zugzwang, so passing is only tried with a knight, bishop, rook
+        or queen on the board, never in check or against a mate or tablebase score, and every cutoff is verified by a reduced
+        search of the node itself with null moves disabled.
+
+        :return: The score to fail high with, None if the node has to be searched.
+        """
+        if (depth <= NULL_MOVE_REDUCTION or board.any_checkers or abs(beta) >= TABLEBASE_WIN // 2
+                or not board.bitboards[board.turn, 1:5].any() or color * self._eval(board) < beta):
+            return None
+        undo = board.make_null_move()
+        val = -self._negamax(board, depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + 1, -color, ply + 1, False)
+        board.unmake_null_move(undo)
+        if val < beta:
+            return None
+        val = self._negamax(board, depth - NULL_MOVE_REDUCTION, beta - 1, beta, color, ply, False)
+        return val if val >= beta else None
+
+    def _reduction(self, board, move, index, depth, in_check):
+        """
+        Late-move reduction of a move, called with the move made on the board: quiet moves ordered after the first LMR_FULL_MOVES
+        are searched 1 ply shallower, and 2 plies from twice as far down the list, unless either side is in check.
+        """
+        if (index < LMR_FULL_MOVES or depth < LMR_MIN_DEPTH or in_check or (move >> 12) & 63 != 0
+                or len(board.legal_move_array()) == 0 or board.any_checkers):
+            return 0
+        return min(1 if index < 2 * LMR_FULL_MOVES else 2, depth - 2)
+
+    def _negamax(self, board, depth, alpha, beta, color, ply=1, allow_null=True):
+        if time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+        gr = board.game_result()
+        if gr is not None:
+            return gr * 20000 * color
+
+        if self.tablebase is not None:
+            probe = self.tablebase.probe(board)
+            if probe is not None:
+                result, plies = probe
+                # Below a mate found by the search, above any evaluation, and preferring quick wins and slow losses
+                return 0 if result == 0 else result * (TABLEBASE_WIN - plies)
+
+        alpha_orig = alpha
+        tt_move = None
+        entry = self.tt.probe(board.hash)
+        if entry is not None:
+            tt_depth, tt_flag, tt_score, tt_move = entry
+            if tt_depth >= depth:
+                if tt_flag == EXACT:
+                    return tt_score
+                if tt_flag == LOWER_BOUND:
+                    alpha = max(alpha, tt_score)
+                elif tt_flag == UPPER_BOUND:
+                    beta = min(beta, tt_score)
+                if alpha >= beta:
+                    return tt_score
+
+        if depth == 0:
+            if self.quiescence:
+                return self._quiescence(board, alpha, beta, color)
+            # Leaves are transposed into just as often, so cache their evaluation as well
+            score = color * self._eval(board)
+            self.tt.store(board.hash, 0, EXACT, score, 0)
+            return score
+
+        moves = board.legal_move_array()
+        if len(moves) == 0:
+            return color * self._eval(board)
+        in_check = board.any_checkers
+
+        if self.null_move and allow_null:
+            cutoff = self._null_move_cutoff(board, depth, beta, color, ply)
+            # The verification search has stored its result for this position already
+            if cutoff is not None:
+                return cutoff
+
+        moves = self._order_moves(board, moves, ply)
+        # Search the best move from an earlier visit of this position first
+        if tt_move is not None:
+            for k, m in enumerate(moves):
+                if m & MOVE_KEY_MASK == tt_move:
+                    moves.insert(0, moves.pop(k))
+                    break
+
+        best, best_move = -INF, moves[0]
+        for k, m in enumerate(moves):
+            undo = self._make(board, m)
+            reduction = self._reduction(board, m, k, depth, in_check) if self.late_move_reductions else 0
+            if k > 0 and (self.pvs or reduction > 0):
+                # Scout with a null window: only whether the move beats alpha matters
+                val = -self._negamax(board, depth - 1 - reduction, -alpha - 1, -alpha, -color, ply + 1)
+                if self.pvs and reduction > 0 and val > alpha:
+                    val = -self._negamax(board, depth - 1, -alpha - 1, -alpha, -color, ply + 1)
+                    reduction = 0
+                # A move that beats alpha is searched again, to full depth and with the full window
+                research = val > alpha and (reduction > 0 or val < beta)
+            else:
+                research = True
+            if research:
+                val = -self._negamax(board, depth - 1, -beta, -alpha, -color, ply + 1)
+            board.unmake_move(undo)
+            if val > best:
+                best, best_move = val, m
+            if best > alpha:
+                alpha = best
+            if alpha >= beta:
+                # Quiet moves refuting the position are likely to refute its siblings too
+                if self.history_ordering and (m >> 12) & 63 == 0:
+                    self.killers.store(ply, m)
+                    self.history.update(board.turn, m, depth)
+                break
+
+        if best <= alpha_orig:
+            flag = UPPER_BOUND
+        elif best >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self.tt.store(board.hash, depth, flag, best, best_move & MOVE_KEY_MASK)
+        return best
+
+    def _order_captures(self, board, moves):
+        """
+        MVV-LVA ordering of captures and promotions: the most valuable victim first, and of the moves taking the same victim,
+        the one with the least valuable piece first.
+
+        :param NDArray[int32] moves: Packed captures and promotions.
+        :return list: The packed moves as ints, best first.
+        """
+        attackers = board.piece_lookup[board.turn, (moves & 63) // 8, (moves & 63) % 8]
+        gains = CAPTURE_ORDER_VALUES[(moves >> 15) & 7] + 800 * (((moves >> 12) & 7) != 0)
+        return moves[np.argsort(-(gains * 8 - attackers), kind="stable")].tolist()
+
+    def _quiescence(self, board, alpha, beta, color):
+        """
+        Searches captures and promotions only, until the position is quiet, so that leaves aren't evaluated in the middle of an exchange.
+        The side to move can stand pat on the static evaluation unless it is in check, in which case all evasions are searched.
+        Captures that can't raise the score to alpha even with DELTA_MARGIN on top of the captured material are skipped, and so are
+        captures losing material according to Chess.see.
+        """
+        if time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+        gr = board.game_result()
+        if gr is not None:
+            return gr * 20000 * color
+
+        moves = board.legal_move_array()
+        in_check = board.any_checkers
+        if in_check:
+            best = -INF
+            moves = self._order_moves(board, moves)
+        else:
+            best = color * self._eval(board)
+            if best >= beta:
+                return best
+            alpha = max(alpha, best)
+            moves = moves[((moves >> 12) & 63) != 0]
+            if len(moves) == 0:
+                return best
+            moves = self._order_captures(board, moves)
+
+        for m in moves:
+            if not in_check:
+                promotion = (m >> 12) & 7
+                gain = CAPTURE_ORDER_VALUES[(m >> 15) & 7] + (CAPTURE_ORDER_VALUES[promotion] - PIECE_VALUES[0] if promotion else 0)
+                if best + gain + DELTA_MARGIN <= alpha:
+                    continue
+                # Captures that lose material in the exchange they start can't improve on standing pat
+                if not promotion and board.see(m) < 0:
+                    continue
+            undo = self._make(board, m)
+            val = -self._quiescence(board, -beta, -alpha, -color)
+            board.unmake_move(undo)
+            if val > best:
+                best = val
+            if best > alpha:
+                alpha = best
+            if alpha >= beta:
+                break
+        return best
+
+    def _search_root(self, board, moves, depth, color, alpha=-INF, beta=INF):
+        """
+        Searches the root moves to the given depth within the window (alpha, beta).
+
+        :return: The best move and its score. A score at or below alpha, or at or above beta, is only a bound,
+            and the move not necessarily the best.
+        """
+        best_move, best_val = moves[0], -INF
+        for k, m in enumerate(moves):
+            undo = self._make(board, m)
+            research = True
+            if self.pvs and k > 0:
+                val = -self._negamax(board, depth - 1, -alpha - 1, -alpha, -color)
+                research = alpha < val < beta
+            if research:
+                val = -self._negamax(board, depth - 1, -beta, -alpha, -color)
+            board.unmake_move(undo)
+            if val > best_val:
+                best_val, best_move = val, m
+            if val > alpha:
+                alpha = val
+            if alpha >= beta:
+                break
+        return best_move, best_val
+
+    def _checked_book_move(self, root: Chess, moves):
+        """
+        The book move of the root, if a BOOK_CHECK_DEPTH search scores it at most BOOK_MARGIN below the best move.
+        The book only knows how games went, so this keeps it from playing a move that loses material right away.
+
+        :param list moves: Packed root moves, ordered.
+        :return: The packed book move, None if the book has none or it failed the check.
+        """
+        book_move = self.book.move(root)
+        if book_move is None:
+            return None
+        (i, j), (dx, dy), promotion = book_move
+        key = pack_move(i, j, dx, dy, promotion)
+        book_move = next(m for m in moves if m & MOVE_KEY_MASK == key)
+        color = 1 if root.turn == 1 else -1
+        self.killers.clear()
+        self.deadline = time.perf_counter() + self.time_budget / 2
+        try:
+            _, book_val = self._search_root(root, [book_move], BOOK_CHECK_DEPTH, color)
+            others = [m for m in moves if m != book_move]
+            if others:
+                # Only whether some move beats the book move by more than the margin matters
+                _, best_val = self._search_root(root, others, BOOK_CHECK_DEPTH, color, book_val + BOOK_MARGIN, book_val + BOOK_MARGIN + 1)
+                if best_val > book_val + BOOK_MARGIN:
+                    return None
+        except SearchTimeout:
+            return None
+        return book_move
+
+    def root_position(self, board: Chess):
+        """Copy of the board to search from, set up with the agent's evaluation tables."""
+        # An aborted iteration leaves the board it searched mid-line, so search on a copy
+        root = board.copy()
+        tables = self._evaluation_tables(root.dims)
+        if tables is not None:
+            root.set_evaluation_tables(*tables)
+        return root
+
+    def search_iteratively(self, root: Chess, moves, time_budget: float):
+        """
+        Iterative deepening over the given root moves.
+
+        :param Chess root: Position from root_position. It is searched on, and left in an undefined state.
+        :param list moves: Packed root moves, ordered. The list is reordered in place, best move of the last iteration first.
+        :param float time_budget: Seconds available.
+        :return list: (depth, best move, score) of every completed iteration, deepest last.
+        """
+        color = 1 if root.turn == 1 else -1
+        # Killers are indexed by the distance from the root, which has moved on since the last search
+        self.killers.clear()
+        self.history.age()
+        completed = []
+
+        def search(depth, deadline):
+            self.deadline = deadline
+            alpha, beta = -INF, INF
+            if self.aspiration_window is not None and completed:
+                alpha, beta = completed[-1][2] - self.aspiration_window, completed[-1][2] + self.aspiration_window
+            while True:
+                best_move, best_val = self._search_root(root, moves, depth, color, alpha, beta)
+                # Outside the window the score is only a bound, search again with that side of the window opened
+                if best_val <= alpha:
+                    alpha = -INF
+                elif best_val >= beta:
+                    beta = INF
+                else:
+                    break
+            # Search the best move of this iteration first in the next one
+            moves.remove(best_move)
+            moves.insert(0, best_move)
+            completed.append((depth, best_move, best_val))
+            return best_move
+
+        iterative_deepening(search, time_budget, self.max_depth)
+        return completed
+
+    def move(self, board: Chess):
+        try:
+            if not board.has_legal_moves:
+                return None
+        except Exception:
+            pass
+
+        deadline = time.time() + self.time_budget
+        moves = board.legal_move_array()
+        if len(moves) == 0:
+            return None
+        if self.tablebase is not None:
+            tablebase_move = self.tablebase.best_move(board)
+            if tablebase_move is not None:
+                return tablebase_move
+        self.tt.new_search()
+
+        root = self.root_position(board)
+        moves = self._order_moves(root, moves)
+        if self.book is not None:
+            book_move = self._checked_book_move(root, moves)
+            if book_move is not None:
+                return unpack_move(book_move)
+        self.start_workers()
+        if self.pool is not None and self.pool.is_ready and len(moves) > 1:
+            best_move = self.pool.search(root, moves, deadline)
+        else:
+            completed = self.search_iteratively(root, moves, deadline - time.time())
+            best_move = completed[-1][1] if completed else None
+        return unpack_move(best_move if best_move is not None else moves[0])
@@ -0,0 +1,161 @@
+"""
+Opening book built from saved games: for every position of the first plies of a game, how often each move was played
+from it and how those games ended.
+
+Games are read from FEN files as written by autograder.py --save_fens (one FEN per position, the result last), or from
+binary game logs (autograder.py --save_games), so autograder or self-play games can be ingested as they are:
+
+    python -m agents.opening_book fens/ games/Task3Agent_vs_RationalAgent.mcgl --max_plies 12
+
+No book is shipped. Task3Agent loads the one at DEFAULT_PATH if it exists, so build it there from games of the agent, e.g.
+
+    python autograder.py --task 3 --num_games 1000 --save_games
+    python -m agents.opening_book games/Task3Agent_vs_RationalAgent.mcgl
+"""
+import os
+from argparse import ArgumentParser
+
+import numpy as np
+
+from minichess.chess.chess_helpers import game_from_fens, get_initial_chess_object
+from minichess.chess.fastchess import Chess
+from minichess.chess.fastchess_utils import pack_move, unpack_move, MOVE_KEY_MASK
+from minichess.chess.game_log import GAME_LOG_EXTENSION, fen_files, read_fen_game, read_games
+
+DEFAULT_PATH = "agents/books/5x4microchess.npz"
+
+# Number of games a move needs in the book before it is played from it
+DEFAULT_MIN_GAMES = 5
+
+# Books loaded by OpeningBook.load_default, by path
+_LOADED = {}
+
+
+class OpeningBook:
+    """
+    Move statistics by position, keyed by Chess.hash. For every move played from a position it keeps the number of wins,
+    draws and losses of the side that played it.
+    """
+
+    def __init__(self, entries: dict = None):
+        """:param dict entries: {position hash: {move key: [wins, draws, losses]}}, move keys as given by pack_move."""
+        self.entries = entries if entries is not None else {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add_game(self, moves, result: int, start: Chess, max_plies: int):
+        """
+        Adds the first max_plies moves of a game.
+
+        :param list moves: Moves in the ((i, j), (dx, dy), promotion) format of the agents.
+        :param int result: 1 if white won, -1 if black won, 0 for a draw.
+        :param Chess start: Position the game started from. It isn't modified.
+        """
+        chess = start.copy()
+        for (i, j), (dx, dy), promotion in moves[:max_plies]:
+            mover_result = result if chess.turn == 1 else -result
+            counts = self.entries.setdefault(int(chess.hash), {}).setdefault(pack_move(i, j, dx, dy, promotion), [0, 0, 0])
+            counts[1 - mover_result] += 1
+            chess.make_move(i, j, dx, dy, promotion)
+
+    def add_fen_files(self, paths, variant: str = "5x4microchess", max_plies: int = 12):
+        """
+        Adds games saved by autograder.py --save_fens, given as files or directories searched for .fen files.
+
+        :return int: Number of games added.
+        """
+        start = get_initial_chess_object(variant)
+        files = fen_files(paths)
+        for file in files:
+            fens, result = read_fen_game(file)
+            self.add_game(game_from_fens(variant, fens[:max_plies + 1]), result, start, max_plies)
+        return len(files)
+
+    def add_game_logs(self, paths, max_plies: int = 12):
+        """
+        Adds all games of binary game logs (see minichess.chess.game_log), which don't need their moves recovered from FENs.
+
+        :return int: Number of games added.
+        """
+        starts = {}
+        games = 0
+        for path in paths:
+            for record in read_games(path):
+                if record.variant not in starts:
+                    starts[record.variant] = get_initial_chess_object(record.variant)
+                self.add_game(record.agent_moves()[:max_plies], record.result, starts[record.variant], max_plies)
+                games += 1
+        return games
+
+    def stats(self, chess: Chess):
+        """Statistics of the position, {move key: [wins, draws, losses]}, None if it isn't in the book."""
+        return self.entries.get(int(chess.hash))
+
+    def move(self, chess: Chess, min_games: int = DEFAULT_MIN_GAMES):
+        """
+        The book move of a position: the legal move with the best score for the side to move, counting draws as half a win.
+        Scores are smoothed towards 1/2, so a move played once and won isn't preferred over one that won most of many games.
+        Moves that didn't score better than a draw are never played from the book.
+
+        :param int min_games: Moves played less often than this aren't considered.
+        :return: The move in the ((i, j), (dx, dy), promotion) format of the agents, None if the book has no move for the position.
+        """
+        stats = self.stats(chess)
+        if stats is None:
+            return None
+        # A hash collision with a position from another game must not give an illegal move
+        legal = set((chess.legal_move_array() & MOVE_KEY_MASK).tolist())
+        best, best_score = None, None
+        for move, (wins, draws, losses) in stats.items():
+            games = wins + draws + losses
+            if games < min_games or move not in legal:
+                continue
+            score = ((wins + draws / 2 + 1) / (games + 2), games)
+            if score[0] <= 0.5:
+                continue
+            if best_score is None or score > best_score:
+                best, best_score = move, score
+        return None if best is None else unpack_move(best)
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH):
+        data = np.load(path)
+        entries = {}
+        for position_hash, move, counts in zip(data["hashes"].tolist(), data["moves"].tolist(), data["counts"].tolist()):
+            entries.setdefault(position_hash, {})[move] = counts
+        return cls(entries)
+
+    @classmethod
+    def load_default(cls):
+        """The book at DEFAULT_PATH, loaded once per process. None if it hasn't been built."""
+        if DEFAULT_PATH not in _LOADED:
+            _LOADED[DEFAULT_PATH] = cls.load(DEFAULT_PATH) if os.path.exists(DEFAULT_PATH) else None
+        return _LOADED[DEFAULT_PATH]
+
+    def save(self, path=DEFAULT_PATH):
+        """Saves the book as flat arrays, one row per (position, move), sorted by position hash."""
+        rows = sorted((position_hash, move, counts) for position_hash, moves in self.entries.items() for move, counts in moves.items())
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(
+            path,
+            hashes=np.array([row[0] for row in rows], dtype=np.uint64),
+            moves=np.array([row[1] for row in rows], dtype=np.int16),
+            counts=np.array([row[2] for row in rows], dtype=np.uint32).reshape(-1, 3))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("paths", nargs="+", help="Game logs, and directories (searched recursively) or files of games saved by autograder.py --save_fens.")
+    parser.add_argument("--variant", default="5x4microchess", help="Variant the games were played in. Default 5x4microchess.")
+    parser.add_argument("--max_plies", default=12, type=int, help="Number of plies of every game that go into the book. Default 12.")
+    parser.add_argument("--output", default=DEFAULT_PATH, help="Where to save the book.")
+    parser.add_argument("--append", action="store_true", help="Add the games to the book already at --output instead of starting a new one.")
+    args = parser.parse_args()
+
+    book = OpeningBook.load(args.output) if args.append and os.path.exists(args.output) else OpeningBook()
+    logs = [path for path in args.paths if path.endswith(GAME_LOG_EXTENSION)]
+    games = book.add_game_logs(logs, args.max_plies)
+    games += book.add_fen_files([path for path in args.paths if path not in logs], args.variant, args.max_plies)
+    book.save(args.output)
+    print("Added {} games, {} positions in {}".format(games, len(book), args.output))
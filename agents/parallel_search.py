@@ -0,0 +1,102 @@
+"""
+Root-split search on a pool of processes: the root moves are dealt out to the workers, every worker searches its share of
+them with iterative deepening until the common deadline, and the best move of the deepest iteration all workers completed
+is played.
+
+Workers rebuild the root position from its FEN (Chess.from_fen), so only the FEN and a few packed moves are sent per move.
+Every worker keeps its own copy of the agent, with its own transposition table that lives across moves.
+"""
+import multiprocessing
+import time
+
+from minichess.chess.chess_helpers import get_initial_chess_object
+from minichess.chess.fastchess import Chess
+
+# Seconds before the deadline the workers stop searching, so their results are back in time
+RESULT_MARGIN = 0.005
+# Seconds past the deadline a late worker is waited for before its share of the moves is left out
+RESULT_GRACE = 0.02
+
+# The agent of a worker process, set by _init_worker
+_AGENT = None
+
+
+def _init_worker(agent, variant: str, ready):
+    global _AGENT
+    _AGENT = agent
+    # Load the compiled functions with a short search, so the first real move doesn't pay for it
+    root = get_initial_chess_object(variant)
+    _search_share(root.fen(), variant, root.legal_move_array().tolist(), time.time() + 0.05)
+    with ready.get_lock():
+        ready.value += 1
+
+
+def _search_share(fen: str, variant: str, moves, deadline: float):
+    """Searches some of the root moves until deadline (a time.time() value), see NegamaxAgent.search_iteratively."""
+    root = _AGENT.root_position(Chess.from_fen(fen, variant))
+    _AGENT.tt.new_search()
+    return _AGENT.search_iteratively(root, list(moves), deadline - time.time())
+
+
+def combine_results(results):
+    """
+    Best move of the deepest iteration every share of the root moves completed. Shares are searched with full windows,
+    so the best scores of different shares at the same depth are exact and can be compared.
+
+    :param list results: Per share, the list of (depth, best move, score) returned by NegamaxAgent.search_iteratively.
+    :return: The packed best move, None if no share completed an iteration.
+    """
+    results = [completed for completed in results if completed]
+    if not results:
+        return None
+    depth = min(completed[-1][0] for completed in results)
+    best_move, best_score = None, None
+    for completed in results:
+        _, move, score = next(entry for entry in completed if entry[0] == depth)
+        if best_score is None or score > best_score:
+            best_move, best_score = move, score
+    return best_move
+
+
+class RootSplitPool:
+    """Worker processes searching shares of the root moves for one agent. Create it with NegamaxAgent.start_workers."""
+
+    def __init__(self, agent, workers: int, variant: str):
+        """
+        :param NegamaxAgent agent: Agent the workers search with, copied into every worker.
+        :param int workers: Number of processes.
+        :param str variant: Variant the agent plays, to rebuild positions from FENs.
+        """
+        self.workers = workers
+        self.variant = variant
+        self.ready = multiprocessing.Value("i", 0)
+        self.pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(agent, variant, self.ready))
+
+    @property
+    def is_ready(self):
+        """Whether all workers have started. Until then the agent searches on its own process."""
+        return self.ready.value == self.workers
+
+    def search(self, root: Chess, moves, deadline: float):
+        """
+        Splits the root moves among the workers, dealing them out in order so every share gets some of the best-ordered ones.
+
+        :param list moves: Packed root moves, ordered.
+        :param float deadline: time.time() at which the move has to be ready.
+        :return: The packed best move, None if no worker completed an iteration in time.
+        """
+        shares = min(self.workers, len(moves))
+        fen = root.fen()
+        pending = [self.pool.apply_async(_search_share, (fen, self.variant, moves[k::shares], deadline - RESULT_MARGIN)) for k in range(shares)]
+        results = []
+        cutoff = deadline + RESULT_GRACE
+        for result in pending:
+            try:
+                results.append(result.get(timeout=max(0.0, cutoff - time.time())))
+            except multiprocessing.TimeoutError:
+                continue
+        return combine_results(results)
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
@@ -1,3 +1,5 @@
+import numpy as np
+
 from minichess.chess.fastchess import Chess
 from .base_agent import BaseAgent
 import random
@@ -29,15 +31,8 @@ class Task1Agent(BaseAgent):
         return p
 
     def _eval(self, board: Chess):
-        score = 0
-        for i in range(5):
-            for j in range(4):
-                p = self._piece_at(board, i, j)
-                if not p:
-                    continue
-                t, c = p
-                score += PIECE_VALUES[t] if c == 1 else -PIECE_VALUES[t]
-        return score
+        # The board keeps the material up to date itself, scored with PIECE_VALUES (set in move)
+        return board.material[1] - board.material[0]
 
     def move(self, board: Chess):
         try:
@@ -50,6 +45,9 @@ class Task1Agent(BaseAgent):
         if not moves:
             return None
 
+        board = board.copy()
+        board.set_evaluation_tables(np.array([PIECE_VALUES[t] for t in range(6)]))
+
         color = 1 if board.turn == 1 else -1
         best_val = -10**9
         best_move = random.choice(moves)
@@ -71,28 +69,28 @@ class Task1Agent(BaseAgent):
 
         for m in moves:
             (i, j), (dx, dy), promo = m
-            child = board.copy()
-            child.make_move(i, j, dx, dy, promo)
-            if child.game_result() is not None:
-                val = child.game_result() * 20000 * color
+            undo = board.make_move(i, j, dx, dy, promo)
+            if board.game_result() is not None:
+                val = board.game_result() * 20000 * color
             else:
                 val = -10**9
-                replies = self._legal_moves(child)
+                replies = self._legal_moves(board)
           
                 replies.sort(key=move_value, reverse=True)
                 replies = replies[:2]
                 for r in replies:
                     (ii, jj), (ddx, ddy), pp = r
-                    gc = child.copy()
-                    gc.make_move(ii, jj, ddx, ddy, pp)
-                    res = gc.game_result()
+                    reply_undo = board.make_move(ii, jj, ddx, ddy, pp)
+                    res = board.game_result()
                     if res is not None:
                         leaf = res * 20000 * color
                     else:
-                        leaf = -self._eval(gc) * color
+                        leaf = -self._eval(board) * color
+                    board.unmake_move(reply_undo)
                     if leaf > val:
                         val = leaf
                 val = -val 
+            board.unmake_move(undo)
 
             if val > best_val:
                 best_val = val
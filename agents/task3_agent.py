@@ -1,166 +1,44 @@
-from minichess.chess.fastchess import Chess
-from .base_agent import BaseAgent
-import random
-from minichess.chess.fastchess_utils import piece_matrix_to_legal_moves
-
-PIECE_VALUES = {
-    0: 100, 1: 320, 2: 330, 3: 500, 4: 900, 5: 20000
-}
-
-class Task3Agent(BaseAgent):
-    def __init__(self, name="Task3Agent"):
-        super().__init__(name)
-
-    def reset(self): ...
+import numpy as np
 
-    def _list_moves(self, board: Chess):
-        pm, promo = board.legal_moves()
-        return piece_matrix_to_legal_moves(pm, promo)
-
-    def _piece_at(self, board, i, j):
-        try:
-            p = board.any_piece_at(i, j)
-            if p is None or p == -1 or p[0] == -1:
-                return None
-            return p
-        except Exception:
-            return None
-
-    def _make_child(self, board, move):
-        (i, j), (dx, dy), promo = move
-        b = board.copy()
-        b.make_move(i, j, dx, dy, promo)
-        return b
+from minichess.chess.fastchess import Chess
+from minichess.chess.tablebase import Tablebase
+from .negamax_agent import NegamaxAgent, PIECE_VALUES
+from .opening_book import OpeningBook
+
+
+def piece_square_tables(dims):
+    """
+    Piece-square tables for Chess.set_evaluation_tables: pawns get 8 per rank advanced,
+    all other pieces 4 per step (in Manhattan distance) closer to the centre of the board.
+    """
+    pst = np.zeros((2, 6, dims[0], dims[1]), dtype=np.int32)
+    ranks = np.arange(dims[0])[:, None]
+    pst[1, 0] = (dims[0] - 1 - ranks) * 8
+    pst[0, 0] = ranks * 8
+    i, j = np.indices(dims)
+    center_bonus = 6 - (np.abs((dims[0] - 1) / 2 - i) + np.abs((dims[1] - 1) / 2 - j))
+    pst[:, 1:] = np.rint(center_bonus * 4).astype(np.int32)
+    return pst
+
+
+class Task3Agent(NegamaxAgent):
+    # Exchanges at the leaves are played out, instead of extending the whole search on every capture and promotion
+    quiescence = True
+    # Quiet moves are ordered by the killer and history tables, so that late-move reductions hit the right ones
+    history_ordering = True
+    # All moves are searched, made affordable by null-move pruning and late-move reductions instead of cutting each node to its first few moves
+    null_move = True
+    late_move_reductions = True
+    # Moves after the first are scouted with null windows, and every iteration starts with a window of half a pawn around the last score
+    pvs = True
+    aspiration_window = 50
+
+    def __init__(self, name="Task3Agent", time_budget=0.16, workers=1):
+        super().__init__(name, time_budget, tablebase=Tablebase.load_default(), book=OpeningBook.load_default(), workers=workers)
+
+    def _evaluation_tables(self, dims):
+        return np.array([PIECE_VALUES[t] for t in range(6)]), piece_square_tables(dims)
 
     def _eval(self, board):
-        s = 0
-        for i in range(5):
-            for j in range(4):
-                pc = self._piece_at(board, i, j)
-                if not pc:
-                    continue
-                t, c = pc
-                v = PIECE_VALUES.get(t, 0)
-                s += v if c == 1 else -v
-
-                if t == 0:
-                    s += (4 - i) * 8 if c == 1 else -i * 8
-
-                if t != 0:
-                    center_bonus = 6 - (abs(2 - i) + abs(1.5 - j))
-                    s += (center_bonus * 4 if c == 1 else -center_bonus * 4)
-
-        try:
-            s += 5 * len(self._list_moves(board))
-        except Exception:
-            pass
-        return s
-
-    def _is_capture(self, board, move):
-        (i, j), (dx, dy), _ = move
-        ti, tj = i + dx, j + dy
-        dest = self._piece_at(board, ti, tj)
-        return dest is not None
-
-    def _immediate_danger(self, child, our_color):
-        try:
-            replies = self._list_moves(child)
-        except Exception:
-            return 0
-        caps = [r for r in replies if self._is_capture(child, r)]
-        if not caps:
-            return 0
-        worst = 0
-        for r in caps[:6]:
-            cc = self._make_child(child, r)
-            d = self._eval(cc) - self._eval(child)
-            if our_color == 1:
-                worst = min(worst, d)
-            else:
-                worst = max(worst, d)
-        return abs(worst) if abs(worst) > 150 else 0
-
-    def _negamax(self, board, depth, alpha, beta, color):
-        gr = board.game_result()
-        if gr is not None:
-            return gr * 20000 * color
-        if depth == 0:
-            return color * self._eval(board)
-
-        moves = self._list_moves(board)
-        if not moves:
-            return color * self._eval(board)
-
-        def k(m):
-            (i, j), (dx, dy), promo = m
-            ti, tj = i + dx, j + dy
-            dest = self._piece_at(board, ti, tj)
-            v = 0
-            if dest:
-                v += PIECE_VALUES.get(dest[0], 0)
-            if promo != -1:
-                v += 900
-            return v
-
-        moves = sorted(moves, key=k, reverse=True)
-
-        if depth >= 3:
-            moves = moves[:6]
-        elif depth == 2:
-            moves = moves[:8]
-
-        best = -10**9
-        for m in moves:
-            child = self._make_child(board, m)
-            next_depth = depth - 1
-         
-            if self._is_capture(board, m) or m[2] != -1:
-                next_depth = depth
-            val = -self._negamax(child, next_depth, -beta, -alpha, -color)
-            if val > best:
-                best = val
-            if best > alpha:
-                alpha = best
-            if alpha >= beta:
-                break
-        return best
-
-    def move(self, board: Chess):
-        try:
-            if not board.has_legal_moves:
-                return None
-        except Exception:
-            pass
-
-        moves = self._list_moves(board)
-        if not moves:
-            return None
-
-        color = 1 if board.turn == 1 else -1
-
-        def rk(m):
-            (i, j), (dx, dy), promo = m
-            ti, tj = i + dx, j + dy
-            dest = self._piece_at(board, ti, tj)
-            v = 0
-            if dest:
-                v += PIECE_VALUES.get(dest[0], 0)
-            if promo != -1:
-                v += 900
-            return v
-
-        moves = sorted(moves, key=rk, reverse=True)[:10]
-
-        best_move, best_val = random.choice(moves), -10**9
-        alpha, beta = -10**9, 10**9
-
-        for m in moves:
-            child = self._make_child(board, m)
-            penalty = self._immediate_danger(child, color)
-            val = -self._negamax(child, 2, -beta, -alpha, -color) - penalty
-            if val > best_val:
-                best_val, best_move = val, m
-            if val > alpha:
-                alpha = val
-
-        return best_move
+        # Material, pawn advancement and centralisation are kept up to date by the board, see piece_square_tables
+        return board.evaluation() + 5 * len(board.legal_move_array())
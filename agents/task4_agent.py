@@ -26,11 +26,9 @@ class Task4Agent(BaseAgent):
         except Exception:
             return None
 
-    def _make_child(self, board, move):
+    def _make(self, board, move):
         (i, j), (dx, dy), promo = move
-        b = board.copy()
-        b.make_move(i, j, dx, dy, promo)
-        return b
+        return board.make_move(i, j, dx, dy, promo)
 
     def _eval(self, board):
         s = 0
@@ -71,9 +69,11 @@ class Task4Agent(BaseAgent):
         if not caps:
             return 0
         worst = 0
+        base = self._eval(child)
         for r in caps[:6]:
-            cc = self._make_child(child, r)
-            d = self._eval(cc) - self._eval(child)
+            undo = self._make(child, r)
+            d = self._eval(child) - base
+            child.unmake_move(undo)
             if our_color == 1:
                 worst = min(worst, d)
             else:
@@ -111,12 +111,13 @@ class Task4Agent(BaseAgent):
 
         best = -10**9
         for m in moves:
-            child = self._make_child(board, m)
             next_depth = depth - 1
          
             if self._is_capture(board, m) or m[2] != -1:
                 next_depth = depth
-            val = -self._negamax(child, next_depth, -beta, -alpha, -color)
+            undo = self._make(board, m)
+            val = -self._negamax(board, next_depth, -beta, -alpha, -color)
+            board.unmake_move(undo)
             if val > best:
                 best = val
             if best > alpha:
@@ -155,9 +156,10 @@ class Task4Agent(BaseAgent):
         alpha, beta = -10**9, 10**9
 
         for m in moves:
-            child = self._make_child(board, m)
-            penalty = self._immediate_danger(child, color)
-            val = -self._negamax(child, 2, -beta, -alpha, -color) - penalty
+            undo = self._make(board, m)
+            penalty = self._immediate_danger(board, color)
+            val = -self._negamax(board, 2, -beta, -alpha, -color) - penalty
+            board.unmake_move(undo)
             if val > best_val:
                 best_val, best_move = val, m
             if val > alpha:
@@ -0,0 +1,68 @@
+import numpy as np
+
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+
+class TranspositionTable:
+    """
+    Fixed-size transposition table indexed by the low bits of Chess.hash.
+    Every slot holds (key, depth, bound type, score, best move) in flat numpy arrays, so the table never allocates during search.
+
+    Replacement policy: a slot is overwritten when it belongs to the same position, when it was written during an earlier
+    search (see new_search), or when the new entry is searched at least as deep as the one already stored.
+    """
+
+    def __init__(self, size_log2: int = 16):
+        self.size = 1 << size_log2
+        self.mask = np.uint64(self.size - 1)
+        self.keys = np.zeros(self.size, dtype=np.uint64)
+        self.depths = np.zeros(self.size, dtype=np.int8)
+        self.flags = np.zeros(self.size, dtype=np.int8)
+        self.scores = np.zeros(self.size, dtype=np.int32)
+        self.moves = np.zeros(self.size, dtype=np.int32)
+        self.generations = np.zeros(self.size, dtype=np.uint8)
+        # Generation 0 marks an empty slot
+        self.generation = 1
+
+    def clear(self):
+        self.keys[:] = 0
+        self.generations[:] = 0
+        self.generation = 1
+
+    def new_search(self):
+        """Ages all stored entries, so that they are replaced before anything written by the coming search."""
+        self.generation = self.generation % 255 + 1
+
+    def probe(self, key: np.uint64):
+        """
+        Looks up a position.
+
+        :param uint64 key: Hash of the position, Chess.hash.
+        :return tuple: (depth, bound type, score, packed best move) or None if the position is not stored.
+        """
+        index = int(key & self.mask)
+        if self.generations[index] == 0 or self.keys[index] != key:
+            return None
+        return int(self.depths[index]), int(self.flags[index]), int(self.scores[index]), int(self.moves[index])
+
+    def store(self, key: np.uint64, depth: int, flag: int, score: int, move: int):
+        """
+        Stores the result of a search, subject to the replacement policy.
+
+        :param uint64 key: Hash of the position, Chess.hash.
+        :param int depth: Remaining depth the position was searched to.
+        :param int flag: EXACT, LOWER_BOUND (fail-high) or UPPER_BOUND (fail-low).
+        :param int score: Score from the perspective of the player to move.
+        :param int move: Best move found, packed with pack_move.
+        """
+        index = int(key & self.mask)
+        if self.generations[index] == self.generation and self.keys[index] != key and depth < self.depths[index]:
+            return
+        self.keys[index] = key
+        self.depths[index] = depth
+        self.flags[index] = flag
+        self.scores[index] = score
+        self.moves[index] = move
+        self.generations[index] = self.generation
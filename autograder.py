@@ -3,11 +3,13 @@ import random
 import numpy as np
 from typing import Tuple
 from minichess.chess.chess_helpers import get_initial_chess_object
-from minichess.chess.fastchess_utils import piece_matrix_to_legal_moves
+from minichess.chess.fastchess_utils import pack_move, piece_matrix_to_legal_moves
+from minichess.chess.game_log import GAME_LOG_EXTENSION, GameLogWriter, GameRecord
 import os
 import json
 from tqdm import tqdm
 from argparse import ArgumentParser
+from multiprocessing import Pool
 
 from agents.random import RandomAgent
 from agents.task1_agent import Task1Agent
@@ -24,11 +26,93 @@ random.seed(RANDOM_SEED)
 np.random.seed(RANDOM_SEED)
 
 NUM_GAMES = 100
+WORKERS = 0
 BOARD_TYPE = '5x4microchess' 
 
 TIME_THRESHOLDS = [0.005, 0.1, 0.2]
 POINT_THRESHOLDS = [27, 20, 50]
 
+def game_colors(g, agent1, agent2):
+    """Agents alternate colors: agent1 plays white in even games, black in odd ones. Returns (white_agent, black_agent)."""
+    if g % 2 == 0 :
+        return agent1, agent2
+    return agent2, agent1
+
+def play_game(white_agent, black_agent) -> dict:
+    """
+    Plays a single game from the initial position.
+
+    :return dict: Result (1 white won, -1 black won, 0 draw), number of plies, the FEN of every position, every move (packed)
+        with the time it took, and thinking time and number of moves for both colors, indexed by color.
+    """
+    global BOARD_TYPE
+    if hasattr(white_agent, 'reset') and callable(white_agent.reset):
+        white_agent.reset()
+    if hasattr(black_agent, 'reset') and callable(black_agent.reset):
+        black_agent.reset()
+
+    chess = get_initial_chess_object(BOARD_TYPE)
+    move_count = 0
+
+    times, num_moves = [0.0, 0.0], [0, 0]
+    game_fens = [chess.fen()]
+    played, move_times = [], []
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', r'overflow encountered in ulong_scalars')
+        noviol = True
+        while chess.game_result() is None:
+            current_agent = white_agent if chess.turn == 1 else black_agent
+
+            start = time.perf_counter()
+            mv = current_agent.move(chess.copy())
+            elapsed = time.perf_counter() - start
+
+            moves, proms = chess.legal_moves()
+            legal_moves = piece_matrix_to_legal_moves(moves, proms)
+            if mv is None or mv not in legal_moves:
+                print("     \033[2;31;41m ILLEGAL MOVE ATTEMPTED. \033[0;0m Player looses the game. ")
+                noviol = False
+                violres = -1 if chess.turn == 1 else 1
+                break
+
+            times[chess.turn] += elapsed
+            num_moves[chess.turn] += 1
+
+            (i, j), (dx, dy), promo = mv
+            chess.make_move(i, j, dx, dy, promo)
+            played.append(pack_move(i, j, dx, dy, promo))
+            move_times.append(elapsed)
+
+            move_count += 1
+            game_fens.append(chess.fen())
+
+    result = chess.game_result() if noviol else violres
+    game_fens.append(str(result))
+    return {"result": result, "plies": move_count, "fens": game_fens, "played": played, "move_times": move_times,
+            "times": times, "moves": num_moves}
+
+_worker_agents = None
+
+def _init_worker(agent1, agent2):
+    global _worker_agents
+    _worker_agents = (agent1, agent2)
+    # Load the compiled move generators now, so it isn't counted as thinking time of the first move
+    chess = get_initial_chess_object(BOARD_TYPE)
+    piece_matrix_to_legal_moves(*chess.legal_moves())
+    chess.legal_move_array()
+
+def _play_worker_game(g):
+    """Plays game g in a pool worker. The game is seeded with RANDOM_SEED + g, so results don't depend on the number of workers."""
+    white_agent, black_agent = game_colors(g, *_worker_agents)
+    seed = RANDOM_SEED + g
+    random.seed(seed)
+    np.random.seed(seed)
+    for agent in (white_agent, black_agent):
+        if isinstance(getattr(agent, 'rng', None), np.random.Generator):
+            agent.rng = np.random.default_rng(seed)
+    return play_game(white_agent, black_agent)
+
 def play_matches(agent1, agent2) -> Tuple[dict, dict]:
     stats = {
         agent1.name: {"wins_white": 0, "wins_black": 0, "total_wins": 0, "total_time": 0.0, "moves": 0, "avg_time":0.0},
@@ -36,66 +120,26 @@ def play_matches(agent1, agent2) -> Tuple[dict, dict]:
         "draws": 0,
         "avg_game_length": 0.0,
     }
-    global NUM_GAMES, BOARD_TYPE
+    global NUM_GAMES, WORKERS
 
     total_moves_all_games = 0
-    
-    all_game_fens = []
-    for g in tqdm(range(1, NUM_GAMES + 1), desc=f"Playing {agent1.name} vs {agent2.name}.", total=NUM_GAMES):
-        
-        game_fens = []
-        if g % 2 == 0 :
-            white_agent, black_agent = agent1, agent2
-        else:
-            white_agent, black_agent = agent2, agent1
-        if hasattr(white_agent, 'reset') and callable(white_agent.reset):
-            white_agent.reset()
-        if hasattr(black_agent, 'reset') and callable(black_agent.reset):
-            black_agent.reset()
-        
-        chess = get_initial_chess_object(BOARD_TYPE)
-        move_count = 0
-       
-        time_white, time_black = 0.0, 0.0
-        num_white_moves, num_black_moves = 0, 0
-        game_fens.append(chess.fen())
-        
-        with warnings.catch_warnings():
-            warnings.filterwarnings('ignore', r'overflow encountered in ulong_scalars')
-            noviol = True
-            while chess.game_result() is None:
-                current_agent = white_agent if chess.turn == 1 else black_agent
-
-                start = time.perf_counter()
-                mv = current_agent.move(chess.copy())
-                elapsed = time.perf_counter() - start
-
-                moves, proms = chess.legal_moves()
-                legal_moves = piece_matrix_to_legal_moves(moves, proms)
-                if mv is None or mv not in legal_moves:
-                    print("     \033[2;31;41m ILLEGAL MOVE ATTEMPTED. \033[0;0m Player looses the game. ")
-                    noviol = False
-                    violres = -1 if chess.turn == 1 else 1
-                    break
-
-                if chess.turn == 1:
-                    time_white += elapsed
-                    num_white_moves += 1
-                else:
-                    time_black += elapsed
-                    num_black_moves += 1
-
-                (i, j), (dx, dy), promo = mv
-                chess.make_move(i, j, dx, dy, promo)
-
-                move_count += 1
-                game_fens.append(chess.fen())
-
-        game_fens.append(str(chess.game_result() if noviol else violres))
-        all_game_fens.append(game_fens)
-        
-        result = chess.game_result() if noviol else violres
-        total_moves_all_games += move_count
+
+    desc = f"Playing {agent1.name} vs {agent2.name}."
+    # One log per match, every game appended as soon as it is done
+    game_log = GameLogWriter(f"games/{agent1.name}_vs_{agent2.name}{GAME_LOG_EXTENSION}") if save_games else None
+    pool = None
+    if WORKERS > 0:
+        # Every worker gets its own copy of the agents, games come back in order
+        pool = Pool(WORKERS, initializer=_init_worker, initargs=(agent1, agent2))
+        games = pool.imap(_play_worker_game, range(1, NUM_GAMES + 1))
+    else:
+        games = (play_game(*game_colors(g, agent1, agent2)) for g in range(1, NUM_GAMES + 1))
+
+    for g, game in enumerate(tqdm(games, desc=desc, total=NUM_GAMES), start=1):
+        white_agent, black_agent = game_colors(g, agent1, agent2)
+        game_fens = game["fens"]
+        result = game["result"]
+        total_moves_all_games += game["plies"]
         if result == 1:  # white wins
             stats[white_agent.name]["total_wins"] += 1
             stats[white_agent.name]["wins_white"] += 1
@@ -108,12 +152,10 @@ def play_matches(agent1, agent2) -> Tuple[dict, dict]:
             stats["draws"] += 1
             res = 'draw'
 
-        if num_white_moves > 0:
-            stats[white_agent.name]["total_time"] += time_white
-            stats[white_agent.name]["moves"] += num_white_moves
-        if num_black_moves > 0:
-            stats[black_agent.name]["total_time"] += time_black
-            stats[black_agent.name]["moves"] += num_black_moves
+        for color, agent in [(1, white_agent), (0, black_agent)]:
+            if game["moves"][color] > 0:
+                stats[agent.name]["total_time"] += game["times"][color]
+                stats[agent.name]["moves"] += game["moves"][color]
 
         if save_fens:
             if res=='black' or res=='white' or res=='draw':
@@ -124,6 +166,17 @@ def play_matches(agent1, agent2) -> Tuple[dict, dict]:
                     for fen in game_fens:
                         f.write(fen + "\n")
 
+        if game_log is not None:
+            # Pool workers seed every game with RANDOM_SEED + g, played in this process all games share the seed set at startup
+            seed = RANDOM_SEED + g if pool is not None else RANDOM_SEED
+            game_log.write(GameRecord(BOARD_TYPE, white_agent.name, black_agent.name, result, game["played"], game["move_times"], g, seed))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if game_log is not None:
+        game_log.close()
+
     avg_game_len = total_moves_all_games /NUM_GAMES if NUM_GAMES > 0 else 0
     stats["avg_game_length"] = avg_game_len//2
     stats["avg_game_length_plies"] = avg_game_len
@@ -151,12 +204,17 @@ if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--task", default=0, type=int, help="Give the task number which you want to test {1,2,3}. If all tasks then 0.")
     parser.add_argument("--save_fens", action='store_true', help="To save all the game plays as fen files. For later visualization")
+    parser.add_argument("--save_games", action='store_true', help="Save all games of a match into one compact binary log under games/, see minichess/chess/game_log.py")
     parser.add_argument("--num_games", default=100, help="Number of games to play. Default 100")
+    parser.add_argument("--workers", default=0, type=int, help="Play the games in parallel on this many processes, each game seeded with its number. Default 0, play them one after the other in this process.")
+    parser.add_argument("--search_workers", default=1, type=int, help="Processes Task3Agent splits its search among, see agents/parallel_search.py. Ignored with --workers, whose processes can't start their own. Default 1.")
     
     args = parser.parse_args()
     task_no = args.task
     save_fens= args.save_fens
+    save_games = args.save_games
     NUM_GAMES = int(args.num_games)
+    WORKERS = args.workers
 
     rand = RandomAgent()
     rational1 = RationalAgent()
@@ -191,7 +249,7 @@ if __name__ == "__main__":
         
         rational1.reset()
 
-        test_agent_3 = Task3Agent()
+        test_agent_3 = Task3Agent(workers=args.search_workers)
         result_3 = play_matches(test_agent_3, rational2)
         task_3_score = result_3[test_agent_3.name]["total_wins"] - result_3[rational2.name]["total_wins"]
         print(f"TASK-1 score: {task_3_score}")
@@ -214,7 +272,7 @@ if __name__ == "__main__":
             test_agent = Task2Agent()
             result = play_matches(test_agent, rational1)
         elif task_no == 3:
-            test_agent = Task3Agent()
+            test_agent = Task3Agent(workers=args.search_workers)
             result = play_matches(test_agent, rational2)
             
         if result[test_agent.name]["avg_time"] > TIME_THRESHOLDS[task_no-1]:
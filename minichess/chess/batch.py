@@ -0,0 +1,310 @@
+"""
+N positions of the same variant stepped in lockstep, for self-play data generation and mass evaluation.
+
+The positions are stored as stacked arrays with the batch on the first axis, and every operation is a single compiled
+loop over the batch, so stepping thousands of games costs one Python call instead of thousands:
+
+    batch = BatchChess.initial("5x4microchess", 10000)
+    rng = np.random.default_rng(0)
+    while True:
+        results = batch.game_result()
+        if (results != ONGOING).all():
+            break
+        # Finished games get no move (-1), so they stay at their final position
+        batch.make_move(np.where(results == ONGOING, batch.random_moves(rng), -1))
+"""
+from typing import List
+
+import numpy as np
+from numba import njit
+
+from .chess_helpers import get_initial_chess_object
+from .encoding import AGENT_STATE_PLANES, ply_divisor
+from .fastchess import Chess
+from .fastchess_utils import ZOBRIST_PIECES, ZOBRIST_CASTLING, ZOBRIST_EN_PASSANT, ZOBRIST_BLACK_TO_MOVE, write_agent_states
+from .movegen import U_0, U_1, bit, packed_moves_kernel
+
+# Value of BatchChess.game_result for games that haven't ended, the others are 1 (white won), -1 (black won) and 0 (draw)
+ONGOING = 2
+
+# Room for moves per position in BatchChess.legal_moves, enough for any reachable position on boards up to 8x8
+MAX_MOVES = 256
+
+
+@njit(cache=True)
+def batch_legal_moves_kernel(bitboards, piece_lookup, turn, castling_rights, has_en_passant, en_passant, moves, counts, has_legal_moves, any_checkers, tables):
+    """
+    Generates the packed legal moves (see fastchess_utils.pack_move) of every position in the batch.
+
+    :param NDArray[int32] moves: (N, max_moves) output, row n gets the moves of position n in its first counts[n] entries.
+    :param NDArray[int32] counts: (N,) output, number of legal moves per position.
+    :param NDArray[bool] has_legal_moves: (N,) output.
+    :param NDArray[bool] any_checkers: (N,) output, if the player to move is in check.
+    """
+    for n in range(bitboards.shape[0]):
+        packed, _, _, has_legal, checkers = packed_moves_kernel(
+            bitboards[n], piece_lookup[n], turn[n], castling_rights[n], has_en_passant[n], en_passant[n, 0], en_passant[n, 1], tables)
+        if len(packed) > moves.shape[1]:
+            raise ValueError("More legal moves than fit in the move buffer")
+        moves[n, :len(packed)] = packed
+        counts[n] = len(packed)
+        has_legal_moves[n] = has_legal
+        any_checkers[n] = checkers
+
+
+@njit(cache=True)
+def batch_legal_moves(bitboards, piece_lookup, turn, castling_rights, has_en_passant, en_passant, moves, counts, has_legal_moves, any_checkers,
+                      diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+                      pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+                      diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks):
+    """See batch_legal_moves_kernel. Takes the tables of Chess.move_tables as separate arguments, like movegen.generate_legal_moves."""
+    tables = (diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+              pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+              diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks)
+    batch_legal_moves_kernel(bitboards, piece_lookup, turn, castling_rights, has_en_passant, en_passant, moves, counts, has_legal_moves, any_checkers, tables)
+
+
+@njit(cache=True)
+def _move_piece(bitboards, piece_lookup, color, piece_type, new_piece_type, i, j, ti, tj):
+    """Same as Chess.move_pieces for one position of the batch, returns the change to its hash."""
+    f_from, f_to = 8 * i + j, 8 * ti + tj
+    bitboards[color, piece_type] &= ~bit(i, j)
+    bitboards[color, new_piece_type] |= bit(ti, tj)
+    piece_lookup[color, i, j] = -1
+    piece_lookup[color, ti, tj] = new_piece_type
+    return ZOBRIST_PIECES[color, piece_type, f_from] ^ ZOBRIST_PIECES[color, new_piece_type, f_to]
+
+
+@njit(cache=True)
+def batch_make_move(bitboards, piece_lookup, turn, castling_rights, has_en_passant, en_passant, ply_count_without_adv, half_move_count, hashes, moves):
+    """
+    Makes one packed move in every position of the batch, following the rules of Chess.make_move.
+
+    :param NDArray[int32] moves: (N,) packed moves, only the origin, target and promotion fields are used. Positions with a negative move are left as they are.
+    """
+    rows, cols = piece_lookup.shape[2], piece_lookup.shape[3]
+    for n in range(bitboards.shape[0]):
+        move = moves[n]
+        if move < 0:
+            continue
+        color = turn[n]
+        enemy = 1 - color
+        i, j = (move & 63) // 8, (move & 63) % 8
+        ti, tj = ((move >> 6) & 63) // 8, ((move >> 6) & 63) % 8
+        promotion = ((move >> 12) & 7) - 1
+        dx, dy = ti - i, tj - j
+
+        piece_at = piece_lookup[n, color, i, j]
+        piece_to = piece_lookup[n, enemy, ti, tj]
+        is_en_passant = piece_at == 0 and has_en_passant[n] and en_passant[n, 0] == ti and en_passant[n, 1] == tj
+        captured = 0 if is_en_passant else piece_to
+        h = hashes[n]
+
+        h ^= _move_piece(bitboards[n], piece_lookup[n], color, piece_at, piece_at if promotion == -1 else promotion, i, j, ti, tj)
+        if piece_at == 5 and abs(dy) == 2:
+            # Castling, move the rook as well
+            if dy < 0:
+                h ^= _move_piece(bitboards[n], piece_lookup[n], color, 3, 3, i, 0, i, tj + 1)
+            else:
+                h ^= _move_piece(bitboards[n], piece_lookup[n], color, 3, 3, i, cols - 1, i, tj - 1)
+
+        if piece_at == 5 or piece_at == 3 or piece_to == 3:
+            for c in range(2):
+                for side in range(2):
+                    if castling_rights[n, c, side]:
+                        h ^= ZOBRIST_CASTLING[c, side]
+            if piece_at == 5:
+                castling_rights[n, color, 0] = 0
+                castling_rights[n, color, 1] = 0
+            if piece_at == 3 and i == (0 if color == 0 else rows - 1) and (j == 0 or j == cols - 1):
+                castling_rights[n, color, 0 if j == 0 else 1] = 0
+            if piece_to == 3 and ti == (0 if enemy == 0 else rows - 1) and (tj == 0 or tj == cols - 1):
+                castling_rights[n, enemy, 0 if tj == 0 else 1] = 0
+            for c in range(2):
+                for side in range(2):
+                    if castling_rights[n, c, side]:
+                        h ^= ZOBRIST_CASTLING[c, side]
+
+        if captured != -1:
+            ci = i if is_en_passant else ti
+            bitboards[n, enemy, captured] &= ~bit(ci, tj)
+            piece_lookup[n, enemy, ci, tj] = -1
+            h ^= ZOBRIST_PIECES[enemy, captured, 8 * ci + tj]
+
+        if piece_at == 0 or captured != -1:
+            ply_count_without_adv[n] = 0
+        else:
+            ply_count_without_adv[n] += 1
+        half_move_count[n] += 1
+
+        if has_en_passant[n]:
+            h ^= ZOBRIST_EN_PASSANT[en_passant[n, 1]]
+        if piece_at == 0 and abs(dx) == 2:
+            has_en_passant[n] = True
+            en_passant[n, 0] = i + (1 if dx > 0 else -1)
+            en_passant[n, 1] = j
+            h ^= ZOBRIST_EN_PASSANT[j]
+        else:
+            has_en_passant[n] = False
+            en_passant[n, 0] = -1
+            en_passant[n, 1] = -1
+
+        turn[n] = enemy
+        hashes[n] = h ^ ZOBRIST_BLACK_TO_MOVE
+
+
+@njit(cache=True)
+def _insufficient_material(bitboards):
+    """Same as Chess.insufficient_material."""
+    for color in range(2):
+        if (bitboards[color, 0] | bitboards[color, 3] | bitboards[color, 4]) != U_0:
+            return False
+        minors = bitboards[color, 1] | bitboards[color, 2]
+        if minors & (minors - U_1):
+            return False
+    return True
+
+
+@njit(cache=True)
+def batch_game_result(bitboards, turn, ply_count_without_adv, has_legal_moves, any_checkers, results):
+    """Same as Chess.game_result for every position of the batch, writing ONGOING into results where the game goes on."""
+    for n in range(bitboards.shape[0]):
+        if ply_count_without_adv[n] > 20 or _insufficient_material(bitboards[n]):
+            results[n] = 0
+        elif not has_legal_moves[n]:
+            if any_checkers[n]:
+                results[n] = -1 if turn[n] == 1 else 1
+            else:
+                results[n] = 0
+        else:
+            results[n] = ONGOING
+
+
+class BatchChess:
+    """
+    A batch of positions of one variant, stepped together. Holds the same state as Chess, stacked on a first batch axis:
+    bitboards (N, 2, 6), piece_lookup (N, 2, rows, cols), castling_rights (N, 2, 2), en_passant (N, 2),
+    and turn, has_en_passant, ply_count_without_adv, half_move_count and hashes of shape (N,).
+    Moves are passed around packed, as in Chess.legal_move_array.
+    """
+
+    def __init__(self, boards: List[Chess], max_moves: int = MAX_MOVES):
+        """
+        :param list boards: Positions to start from, all of the same variant. They are copied, not modified.
+        :param int max_moves: Most legal moves a position can have, the width of the array legal_moves returns.
+        """
+        self.template = boards[0].copy()
+        self.dims = self.template.dims
+        self.move_tables = self.template.move_tables
+        self.max_moves = max_moves
+
+        self.bitboards = np.stack([b.bitboards for b in boards])
+        self.piece_lookup = np.stack([b.piece_lookup for b in boards])
+        self.turn = np.array([b.turn for b in boards], dtype=np.int64)
+        self.castling_rights = np.stack([b.castling_rights for b in boards]).astype(np.uint8)
+        self.has_en_passant = np.array([bool(b.has_en_passant) for b in boards])
+        self.en_passant = np.stack([np.asarray(b.en_passant, dtype=np.int64) for b in boards])
+        self.ply_count_without_adv = np.array([b.ply_count_without_adv for b in boards], dtype=np.int64)
+        self.half_move_count = np.array([b.half_move_count for b in boards], dtype=np.int64)
+        self.hashes = np.array([b.hash for b in boards], dtype=np.uint64)
+
+        self._initial = {name: value.copy() for name, value in self._state().items()}
+        self._moves_valid = False
+        self.moves = np.zeros((len(boards), max_moves), dtype=np.int32)
+        self.move_counts = np.zeros(len(boards), dtype=np.int32)
+        self.has_legal_moves = np.zeros(len(boards), dtype=np.bool_)
+        self.any_checkers = np.zeros(len(boards), dtype=np.bool_)
+
+    @classmethod
+    def initial(cls, variant: str, n: int, max_moves: int = MAX_MOVES):
+        """A batch of n games at the initial position of the given variant (e.g. 5x4microchess)."""
+        return cls([get_initial_chess_object(variant)] * n, max_moves)
+
+    def __len__(self):
+        return self.bitboards.shape[0]
+
+    def _state(self):
+        return {
+            "bitboards": self.bitboards, "piece_lookup": self.piece_lookup, "turn": self.turn, "castling_rights": self.castling_rights,
+            "has_en_passant": self.has_en_passant, "en_passant": self.en_passant, "ply_count_without_adv": self.ply_count_without_adv,
+            "half_move_count": self.half_move_count, "hashes": self.hashes,
+        }
+
+    def legal_moves(self):
+        """
+        Finds the legal moves of every position, cached until the next make_move.
+
+        :return: (moves, counts): (N, max_moves) int32 packed moves, of which only the first counts[n] in row n are valid, and the (N,) counts.
+        """
+        if not self._moves_valid:
+            batch_legal_moves(self.bitboards, self.piece_lookup, self.turn, self.castling_rights, self.has_en_passant, self.en_passant,
+                              self.moves, self.move_counts, self.has_legal_moves, self.any_checkers, *self.move_tables)
+            self._moves_valid = True
+        return self.moves, self.move_counts
+
+    def random_moves(self, rng: np.random.Generator):
+        """A uniformly random legal move per position, -1 for finished games (including draws by the ply count rule, which still have legal moves)."""
+        moves, counts = self.legal_moves()
+        picks = (rng.random(len(self)) * counts).astype(np.int64)
+        chosen = moves[np.arange(len(self)), np.minimum(picks, self.max_moves - 1)]
+        return np.where(self.game_result() == ONGOING, chosen, -1).astype(np.int32)
+
+    def make_move(self, moves):
+        """
+        Makes a move in every position.
+
+        :param NDArray[int32] moves: (N,) packed moves, e.g. picked from legal_moves. Finished games, and positions given a negative move, are skipped,
+            so a game ended by the ply count rule can't be resumed by a capture or pawn move resetting the count.
+        """
+        moves = np.where(self.game_result() == ONGOING, np.asarray(moves, dtype=np.int32), -1).astype(np.int32)
+        batch_make_move(self.bitboards, self.piece_lookup, self.turn, self.castling_rights, self.has_en_passant, self.en_passant,
+                        self.ply_count_without_adv, self.half_move_count, self.hashes, moves)
+        self._moves_valid = False
+
+    def game_result(self):
+        """
+        Result of every game, like Chess.game_result.
+
+        :return NDArray[int8]: 1 if white has won, -1 if black has won, 0 for a draw and ONGOING if the game isn't over.
+        """
+        self.legal_moves()
+        results = np.empty(len(self), dtype=np.int8)
+        batch_game_result(self.bitboards, self.turn, self.ply_count_without_adv, self.has_legal_moves, self.any_checkers, results)
+        return results
+
+    def agent_board_state(self, out=None, dtype=np.float32):
+        """
+        agent_board_state of every position, written into one (N, rows, cols, 19) buffer (see the encoding module for integer dtypes).
+
+        :param NDArray out: Buffer to write into, allocated if None.
+        :param dtype: dtype of the buffer if it has to be allocated.
+        """
+        if out is None:
+            out = np.empty((len(self), self.dims[0], self.dims[1], AGENT_STATE_PLANES), dtype=dtype)
+        write_agent_states(out, self.bitboards, self.castling_rights, self.turn, self.en_passant, self.has_en_passant,
+                           self.ply_count_without_adv, ply_divisor(out.dtype))
+        return out
+
+    def reset(self, mask=None):
+        """Puts the positions selected by the boolean mask (all of them by default) back to where the batch started."""
+        if mask is None:
+            mask = np.ones(len(self), dtype=np.bool_)
+        for name, value in self._state().items():
+            value[mask] = self._initial[name][mask]
+        self._moves_valid = False
+
+    def to_chess(self, n: int):
+        """Position n of the batch as a Chess object."""
+        chess = self.template.copy()
+        chess.bitboards[:] = self.bitboards[n]
+        chess.piece_lookup[:] = self.piece_lookup[n]
+        chess.turn = int(self.turn[n])
+        chess.castling_rights = self.castling_rights[n].copy()
+        chess.has_en_passant = bool(self.has_en_passant[n])
+        chess.en_passant = self.en_passant[n].astype(np.int8)
+        chess.ply_count_without_adv = int(self.ply_count_without_adv[n])
+        chess.half_move_count = int(self.half_move_count[n])
+        chess.hash = self.hashes[n]
+        chess.legal_move_cache = chess.promotion_move_cache = chess.packed_move_cache = None
+        chess.set_evaluation_tables(chess.piece_values, chess.piece_square_tables)
+        return chess
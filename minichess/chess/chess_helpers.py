@@ -12,6 +12,7 @@ from minichess.chess.fastchess_utils import (B_0, B_1, castling_attack_mask,
                                      has_bit, inv_color, king_moves,
                                      knight_moves, load_board, pawn_attacks,
                                      pawn_moves_double, pawn_moves_single,
+                                     piece_matrix_to_legal_moves,
                                      print_bitboard, promotion_masks, set_bit,
                                      straight_line_moves, true_bits, unflat,
                                      unset_bit, visualize_board)
@@ -27,50 +28,118 @@ def get_settings(config_file_path: str):
         return json.load(f)
 
 
-def get_initial_chess_object(full_name: str):
-    """Takes the name of the variant to play (e.g. 8x8standard) and returns a fully initialized Chess-object."""
-    minichess_path =  os.path.join(os.getcwd(), "minichess")
+# Names of the move tables in a variant's table bundle, in the order Chess takes them
+TABLE_NAMES = [
+    "diagonal_hash_table", "diagonal_magics", "diagonal_shift",
+    "straight_hash_table", "straight_magics", "straight_shift",
+    "PAWN_MOVES_SINGLE", "PAWN_MOVES_DOUBLE", "PAWN_ATTACKS", "KNIGHT_MOVES", "KING_MOVES",
+    "DIAGONAL_MOVES", "STRAIGHT_MOVES", "CASTLING_EMPTY_MASKS", "CASTLING_ATTACK_MASKS", "PROMOTION_MASKS",
+]
+
+# Everything get_initial_chess_object needs per variant, loaded once per process. The tables are never written to, so all Chess objects share them.
+_VARIANT_CACHE = {}
+
+
+def variant_tables_path(minichess_path: str, full_name: str, dims):
+    return "{}/chess/magics/{}x{}/{}.npz".format(minichess_path, *dims, full_name)
+
+
+def save_variant_tables(full_name: str, minichess_path: str = None):
+    """
+    Computes all move tables of a variant and saves them as a single bundle next to its magics, which get_initial_chess_object loads from then on.
+    The magics are calculated first if they don't exist yet.
+
+    :param str full_name: Name of the variant, e.g. 5x4microchess.
+    :param str minichess_path: Path of the minichess package, defaults to minichess in the working directory.
+    :return dict: The tables, keyed by their name in TABLE_NAMES, plus the initial CASTLING_RIGHTS.
+    """
+    if minichess_path is None:
+        minichess_path = os.path.join(os.getcwd(), "minichess")
     board_path = "{}/boards/{}".format(minichess_path, full_name)
-    bitboards, piece_lookup, dims = load_board(board_path)
+    _, _, dims = load_board(board_path)
 
     if not os.path.exists("{}/chess/magics/{}x{}/diagonals.npz".format(minichess_path, *dims)):
         print("Need to calculate magics for this board dimension variant.")
         print("This only needs to be done once, but it can take a couple of minutes for large boards.")
         save_magic_bitboards(dims, minichess_path)
 
+    tables = {}
     data = np.load("{}/chess/magics/{}x{}/diagonals.npz".format(minichess_path, *dims))
-    diagonal_hash_table, diagonal_magics, diag_shift = data["hash_table"], data["magics"], data["shift"]
+    tables["diagonal_hash_table"], tables["diagonal_magics"], tables["diagonal_shift"] = data["hash_table"], data["magics"], data["shift"]
 
     data = np.load("{}/chess/magics/{}x{}/straights.npz".format(minichess_path, *dims))
-    straight_hash_table, straight_magics, straight_shift = data["hash_table"], data["magics"], data["shift"]
-    PAWN_MOVES_SINGLE = pawn_moves_single(dims)
-    PAWN_MOVES_DOUBLE = pawn_moves_double(dims)
-    PAWN_ATTACKS = pawn_attacks(dims)
-    KNIGHT_MOVES = knight_moves(dims)
-    KING_MOVES = king_moves(dims)
-    DIAGONAL_MOVES = diagonal_line_moves(dims)
-    STRAIGHT_MOVES = straight_line_moves(dims)
-    CASTLING_EMPTY_MASKS, CASTLING_ATTACK_MASKS, CASTLING_RIGHTS = castling_masks(dims, board_path)
-    PROMOTION_MASKS = promotion_masks(dims)
+    tables["straight_hash_table"], tables["straight_magics"], tables["straight_shift"] = data["hash_table"], data["magics"], data["shift"]
+    tables["PAWN_MOVES_SINGLE"] = pawn_moves_single(dims)
+    tables["PAWN_MOVES_DOUBLE"] = pawn_moves_double(dims)
+    tables["PAWN_ATTACKS"] = pawn_attacks(dims)
+    tables["KNIGHT_MOVES"] = knight_moves(dims)
+    tables["KING_MOVES"] = king_moves(dims)
+    tables["DIAGONAL_MOVES"] = diagonal_line_moves(dims)
+    tables["STRAIGHT_MOVES"] = straight_line_moves(dims)
+    tables["CASTLING_EMPTY_MASKS"], tables["CASTLING_ATTACK_MASKS"], tables["CASTLING_RIGHTS"] = castling_masks(dims, board_path)
+    tables["PROMOTION_MASKS"] = promotion_masks(dims)
+
+    np.savez(variant_tables_path(minichess_path, full_name, dims), **tables)
+    return tables
+
+
+def load_variant(full_name: str):
+    """
+    Initial position and move tables of a variant. They are read from the variant's table bundle (created with save_variant_tables
+    if it doesn't exist yet) on the first call, and come from a per-process cache after that.
+
+    :return tuple: bitboards, piece lookup and dimensions of the initial position, the tables in the order of TABLE_NAMES, and the initial castling rights.
+        None of these should be modified, get_initial_chess_object copies what a Chess object changes.
+    """
+    if full_name in _VARIANT_CACHE:
+        return _VARIANT_CACHE[full_name]
+
+    minichess_path = os.path.join(os.getcwd(), "minichess")
+    bitboards, piece_lookup, dims = load_board("{}/boards/{}".format(minichess_path, full_name))
+    path = variant_tables_path(minichess_path, full_name, dims)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            tables = {name: data[name] for name in data.files}
+    else:
+        tables = save_variant_tables(full_name, minichess_path)
+
+    variant = (bitboards, piece_lookup, dims, [tables[name] for name in TABLE_NAMES], tables["CASTLING_RIGHTS"])
+    _VARIANT_CACHE[full_name] = variant
+    return variant
+
+
+def get_initial_chess_object(full_name: str):
+    """Takes the name of the variant to play (e.g. 8x8standard) and returns a fully initialized Chess-object."""
+    bitboards, piece_lookup, dims, tables, castling_rights = load_variant(full_name)
     return Chess(
         bitboards.copy(),
         piece_lookup.copy(),
         dims,
-        diagonal_hash_table,
-        diagonal_magics,
-        diag_shift,
-        straight_hash_table,
-        straight_magics,
-        straight_shift,
-        PAWN_MOVES_SINGLE,
-        PAWN_MOVES_DOUBLE,
-        PAWN_ATTACKS,
-        KNIGHT_MOVES,
-        KING_MOVES,
-        DIAGONAL_MOVES,
-        STRAIGHT_MOVES,
-        CASTLING_EMPTY_MASKS,
-        CASTLING_ATTACK_MASKS,
-        PROMOTION_MASKS,
-        CASTLING_RIGHTS
+        *tables,
+        castling_rights.copy()
     )
+
+
+def game_from_fens(full_name: str, fens):
+    """
+    Recovers the moves of a game from the FEN of every position in it, as saved by the autograder with --save_fens.
+    Each move is found by trying the legal moves of a position until one leads to the next FEN.
+
+    :param str full_name: Variant the game was played in, the game has to start from its initial position.
+    :param list fens: FEN strings of the positions in order. Lines that aren't FENs (like the result at the end of a saved game) are skipped.
+    :return list: The moves, in the ((i, j), (dx, dy), promotion) format of the agents.
+    """
+    fens = [fen.strip() for fen in fens if "/" in fen]
+    chess = get_initial_chess_object(full_name)
+    moves = []
+    for fen in fens[1:]:
+        for move in piece_matrix_to_legal_moves(*chess.legal_moves()):
+            (i, j), (dx, dy), promotion = move
+            undo = chess.make_move(i, j, dx, dy, promotion)
+            if chess.fen() == fen:
+                moves.append(move)
+                break
+            chess.unmake_move(undo)
+        else:
+            raise ValueError("No legal move leads from {} to {}".format(chess.fen(), fen))
+    return moves
@@ -0,0 +1,114 @@
+"""
+Encoding positions as agent_board_state tensors in bulk, for training neural networks.
+
+All encoders write into one (N, rows, cols, 19) buffer, which is allocated once if not given, instead of building an array per position.
+Float buffers get exactly what Chess.agent_board_state gives. Integer buffers (e.g. uint8) hold the ply count plane as the count itself
+instead of the count / 20, so they can be stored compactly and turned into floats later with agent_states_to_float.
+"""
+from typing import List
+
+import numpy as np
+
+from .chess_helpers import game_from_fens, get_initial_chess_object
+from .fastchess import Chess
+from .fastchess_utils import write_agent_state, write_agent_states
+
+AGENT_STATE_PLANES = 19
+# Plane holding the number of plies without a capture or pawn move, the only one that isn't 0/1
+PLY_PLANE = 17
+
+
+def ply_divisor(dtype):
+    """What the ply count is divided by in a buffer of the given dtype, see the module docstring."""
+    return 20 if np.issubdtype(dtype, np.floating) else 1
+
+
+def _buffer(out, n: int, dims, dtype):
+    if out is None:
+        return np.empty((n, dims[0], dims[1], AGENT_STATE_PLANES), dtype=dtype)
+    if out.shape[0] < n or out.shape[1:] != (dims[0], dims[1], AGENT_STATE_PLANES):
+        raise ValueError("Buffer of shape {} can't hold {} positions of a {}x{} board".format(out.shape, n, *dims))
+    return out
+
+
+def _write(out, chess: Chess, divisor):
+    write_agent_state(out, chess.bitboards, chess.castling_rights, chess.turn, chess.en_passant, chess.has_en_passant, chess.ply_count_without_adv, divisor)
+
+
+def encode_positions(boards: List[Chess], out=None, dtype=np.float32):
+    """
+    Encodes a list of positions.
+
+    :param list boards: Positions, all of the same board size.
+    :param NDArray out: Buffer of shape (N, rows, cols, 19) with N >= len(boards), allocated if None.
+    :param dtype: dtype of the buffer if it has to be allocated.
+    :return NDArray: out, with row n holding the encoding of boards[n].
+    """
+    out = _buffer(out, len(boards), boards[0].dims, dtype)
+    # One compiled call for all positions, only the small per-position state is gathered
+    write_agent_states(
+        out,
+        np.stack([chess.bitboards for chess in boards]),
+        np.stack([chess.castling_rights for chess in boards]),
+        np.array([chess.turn for chess in boards], dtype=np.int64),
+        np.array([(int(chess.en_passant[0]), int(chess.en_passant[1])) if chess.has_en_passant else (0, 0) for chess in boards], dtype=np.int64),
+        np.array([bool(chess.has_en_passant) for chess in boards]),
+        np.array([chess.ply_count_without_adv for chess in boards], dtype=np.int64),
+        ply_divisor(out.dtype))
+    return out
+
+
+def encode_game(start: Chess, moves, out=None, dtype=np.float32):
+    """
+    Encodes every position of a game: the start position and the position after each move, len(moves) + 1 in total.
+
+    :param Chess start: Position the game starts from. It isn't modified.
+    :param list moves: Moves in the ((i, j), (dx, dy), promotion) format of the agents.
+    :param NDArray out: Buffer of shape (N, rows, cols, 19) with N > len(moves), allocated if None.
+    :return NDArray: out.
+    """
+    out = _buffer(out, len(moves) + 1, start.dims, dtype)
+    divisor = ply_divisor(out.dtype)
+    chess = start.copy()
+    _write(out[0], chess, divisor)
+    for n, ((i, j), (dx, dy), promotion) in enumerate(moves, start=1):
+        chess.make_move(i, j, dx, dy, promotion)
+        _write(out[n], chess, divisor)
+    return out
+
+
+def encode_fen_game(variant: str, fens, out=None, dtype=np.float32):
+    """
+    Encodes a game saved as one FEN per position (like the autograder's --save_fens files), by replaying its moves from the initial position.
+
+    :param str variant: Variant the game was played in, e.g. 5x4microchess.
+    :param list fens: Lines of the saved game.
+    :return NDArray: out, with one row per position of the game.
+    """
+    return encode_game(get_initial_chess_object(variant), game_from_fens(variant, fens), out, dtype)
+
+
+def pack_agent_states(states):
+    """
+    Bit-packs integer encodings: the 18 planes that are 0/1 go into 3 bytes per square, the ply count is kept as one byte per position.
+
+    :param NDArray states: (N, rows, cols, 19) integer encodings.
+    :return: (bits, ply_counts) of shapes (N, rows, cols, 3) and (N,), both uint8.
+    """
+    binary = np.delete(states, PLY_PLANE, axis=-1)
+    return np.packbits(binary.astype(np.uint8), axis=-1), states[:, 0, 0, PLY_PLANE].astype(np.uint8)
+
+
+def unpack_agent_states(bits, ply_counts, dtype=np.float32):
+    """Inverse of pack_agent_states, giving the encodings in the given dtype (with the ply count plane scaled as described in the module docstring)."""
+    binary = np.unpackbits(bits, axis=-1, count=AGENT_STATE_PLANES - 1).astype(dtype)
+    ply = (ply_counts / ply_divisor(dtype)).astype(dtype)
+    ply = np.broadcast_to(ply[:, None, None, None], binary.shape[:3] + (1,))
+    return np.concatenate([binary[..., :PLY_PLANE], ply, binary[..., PLY_PLANE:]], axis=-1)
+
+
+def agent_states_to_float(states, dtype=np.float32):
+    """Turns integer encodings into what Chess.agent_board_state gives."""
+    result = states.astype(dtype)
+    result[..., PLY_PLANE] /= 20
+    return result
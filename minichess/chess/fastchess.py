@@ -1,7 +1,28 @@
 from typing import Tuple
 import numpy as np
 
-from .fastchess_utils import B_0, B_1, flat, has_bit, inv_color, set_bit, true_bits, unflat, unset_bit, more_than_one_bit_set, agent_state, INVERSE_PIECE_LOOKUP
+from .fastchess_utils import B_0, B_1, flat, inv_color, set_bit, true_bits, unflat, unset_bit, more_than_one_bit_set, agent_state, INVERSE_PIECE_LOOKUP, PIECE_LOOKUP
+from .fastchess_utils import FEN_PIECE_CODES, write_fen_placement
+from .fastchess_utils import ZOBRIST_PIECES, ZOBRIST_CASTLING, ZOBRIST_EN_PASSANT, ZOBRIST_BLACK_TO_MOVE, zobrist_hash
+from .fastchess_utils import DEFAULT_PIECE_VALUES, evaluation_scores, pack_move
+from .movegen import generate_attack_maps, generate_legal_moves, generate_packed_moves, static_exchange
+
+# Plain python versions of the tables from_fen needs, which are a lot quicker to index one element at a time
+_ZOBRIST_PIECE_LIST = ZOBRIST_PIECES.tolist()
+_DEFAULT_VALUE_LIST = DEFAULT_PIECE_VALUES.tolist()
+# What en_passant is set to when there is no en-passant square, en-passant squares are int8 as well
+_NO_EN_PASSANT = np.array([-1, -1], dtype=np.int8)
+# Square names by board dimensions, see _square_names
+_SQUARE_NAMES = {}
+# Default (all zero) piece-square tables, as array and nested list, by board dimensions
+_ZERO_PIECE_SQUARE_TABLES = {}
+
+
+def _square_names(dims):
+    """Names of all squares (e.g. a5 for the top left one on a 5x4 board), indexed [i][j]."""
+    if dims not in _SQUARE_NAMES:
+        _SQUARE_NAMES[dims] = [["abcdefghi"[j] + str(dims[0] - i) for j in range(dims[1])] for i in range(dims[0])]
+    return _SQUARE_NAMES[dims]
 
 
 class Chess:
@@ -31,7 +52,9 @@ class Chess:
         en_passant=None,
         ply_count=0,
         half_move_count=0,
-        turn=1
+        turn=1,
+        position_hash=None,
+        evaluation=None
     ):
         self.bitboards = bitboards
         self.piece_lookup = piece_lookup
@@ -58,12 +81,19 @@ class Chess:
 
         self.PROMOTION_MASKS = PROMOTION_MASKS
 
+        # All the variant's tables, in the order the compiled move generators in movegen expect them
+        self.move_tables = (
+            diagonal_hash, diagonal_magics, int(diagonal_shift), straight_hash, straight_magics, int(straight_shift),
+            PAWN_MOVES_SINGLE, PAWN_MOVES_DOUBLE, PAWN_ATTACKS, KNIGHT_MOVES, KING_MOVES,
+            DIAGONAL_MOVES, STRAIGHT_MOVES, CASTLING_EMPTY_MASKS, CASTLING_ATTACK_MASKS, PROMOTION_MASKS
+        )
+
         self.has_legal_moves = -1
         self.any_checkers = -1
 
         if has_en_passant is None:
             self.has_en_passant = False
-            self.en_passant = np.array([-1, -1], dtype=np.uint8)
+            self.en_passant = _NO_EN_PASSANT.copy()
         else:
             self.has_en_passant = has_en_passant
             self.en_passant = en_passant
@@ -74,44 +104,135 @@ class Chess:
 
         self.legal_move_cache = None
         self.promotion_move_cache = None
+        self.packed_move_cache = None
+
+        # Zobrist hash of the position, kept up to date incrementally by make_move and make_null_move
+        if position_hash is None:
+            position_hash = zobrist_hash(self.bitboards, self.castling_rights, self.turn, self.has_en_passant, self.en_passant)
+        self.hash = position_hash
+
+        # Material and piece-square scores per color, kept up to date incrementally by make_move
+        if evaluation is None:
+            self.set_evaluation_tables()
+        else:
+            (self.piece_values, self.piece_square_tables, self._value_list, self._pst_list, material, positional) = evaluation
+            self.material = list(material)
+            self.positional = list(positional)
+
+    def set_evaluation_tables(self, piece_values=None, piece_square_tables=None):
+        """
+        Sets the tables the incrementally updated evaluation scores are made of, and recomputes the scores for the current position.
+
+        :param NDArray piece_values: Value per piece type, defaults to DEFAULT_PIECE_VALUES.
+        :param NDArray piece_square_tables: Bonus per color, piece type and square, shape (2, 6, rows, cols). Defaults to no bonus at all.
+        """
+        if piece_values is None:
+            piece_values = DEFAULT_PIECE_VALUES
+        if piece_square_tables is None:
+            piece_square_tables = np.zeros((2, 6, self.dims[0], self.dims[1]), dtype=np.int32)
+        self.piece_values = piece_values
+        self.piece_square_tables = piece_square_tables
+        # Plain python lists are a lot quicker to index one element at a time than numpy arrays
+        self._value_list = [int(v) for v in piece_values]
+        self._pst_list = np.asarray(piece_square_tables).tolist()
+        self.material, self.positional = evaluation_scores(self.bitboards, self.dims, self._value_list, self._pst_list)
+
+    def evaluation(self):
+        """
+        Material and piece-square score of the position from white's point of view, using the tables set with set_evaluation_tables.
+
+        :return int: Score of white minus score of black.
+        """
+        return self.material[1] + self.positional[1] - self.material[0] - self.positional[0]
+
+    @classmethod
+    def from_fen(cls, fen: str, variant: str):
+        """
+        Inverse of fen: the position described by a FEN string. The move tables come from the per-process cache of load_variant,
+        so no files are read after the first position of a variant.
+
+        :param str fen: FEN as written by fen(). The counters may be left out, they default to 0 and 1.
+        :param str variant: Variant the position belongs to, e.g. 5x4microchess. Its board has to have as many ranks and files as the FEN.
+        :return Chess:
+        """
+        from .chess_helpers import load_variant
+        _, _, dims, tables, initial_castling_rights = load_variant(variant)
+        fields = fen.split()
+        placement, turn = fields[0], fields[1]
+        castling, en_passant_square = (fields[2], fields[3]) if len(fields) > 3 else ("-", "-")
+        ply_count = int(fields[4]) if len(fields) > 4 else 0
+        full_moves = int(fields[5]) if len(fields) > 5 else 1
+
+        ranks = placement.split("/")
+        if len(ranks) != dims[0]:
+            raise ValueError("FEN {} has {} ranks, the {} board has {}".format(fen, len(ranks), variant, dims[0]))
+        # The hash and the default material scores are computed while parsing, instead of from the bitboards afterwards
+        boards = [[0] * 6, [0] * 6]
+        material = [0, 0]
+        position_hash = 0
+        piece_lookup = np.full((2, dims[0], dims[1]), -1, dtype=np.int8)
+        for i, rank in enumerate(ranks):
+            j = 0
+            for c in rank:
+                if c.isdigit():
+                    j += int(c)
+                    continue
+                color = 1 if c.isupper() else 0
+                piece_type = PIECE_LOOKUP[c.lower()]
+                boards[color][piece_type] |= 1 << (8 * i + j)
+                piece_lookup[color, i, j] = piece_type
+                material[color] += _DEFAULT_VALUE_LIST[piece_type]
+                position_hash ^= _ZOBRIST_PIECE_LIST[color][piece_type][8 * i + j]
+                j += 1
+            if j != dims[1]:
+                raise ValueError("Rank {} of FEN {} doesn't have {} files".format(rank, fen, dims[1]))
+
+        castling_rights = np.zeros_like(initial_castling_rights)
+        for c, color, side in (("K", 1, 1), ("Q", 1, 0), ("k", 0, 1), ("q", 0, 0)):
+            if c in castling:
+                castling_rights[color, side] = 1
+                position_hash ^= int(ZOBRIST_CASTLING[color, side])
+        has_en_passant = en_passant_square != "-"
+        if has_en_passant:
+            # Inverse of the rank numbering in fen()
+            en_passant = np.array([dims[0] - int(en_passant_square[1:]), "abcdefghi".index(en_passant_square[0])], dtype=np.int8)
+            position_hash ^= int(ZOBRIST_EN_PASSANT[en_passant[1]])
+        else:
+            en_passant = _NO_EN_PASSANT.copy()
+        white = turn == "w"
+        if not white:
+            position_hash ^= int(ZOBRIST_BLACK_TO_MOVE)
+
+        if dims not in _ZERO_PIECE_SQUARE_TABLES:
+            zeros = np.zeros((2, 6, dims[0], dims[1]), dtype=np.int32)
+            _ZERO_PIECE_SQUARE_TABLES[dims] = (zeros, zeros.tolist())
+        zeros, zero_list = _ZERO_PIECE_SQUARE_TABLES[dims]
+        return cls(
+            np.array(boards, dtype=np.uint64), piece_lookup, dims, *tables, castling_rights,
+            has_en_passant, en_passant, ply_count, 2 * (full_moves - 1) + (0 if white else 1), 1 if white else 0,
+            np.uint64(position_hash), (DEFAULT_PIECE_VALUES, zeros, _DEFAULT_VALUE_LIST, zero_list, material, [0, 0]))
 
     def fen(self):
-        fen_string = ""
-        files = "abcdefghi"
-        ranks = "12345678"
-        for rank in range(self.dims[0]):
-            empties = 0
-            for file in range(self.dims[1]):
-                piece, color = self.any_piece_at(rank, file)
-                if piece == -1:
-                    empties += 1
-                else:
-                    if empties > 0:
-                        fen_string += str(empties)
-                        empties = 0
-                    piece_char = INVERSE_PIECE_LOOKUP[piece]
-                    if color == 1:
-                        piece_char = piece_char.upper()
-                    fen_string += piece_char
-            if empties > 0:
-                fen_string += str(empties)
-                empties = 0
-            if rank != self.dims[0] - 1:
-                fen_string += '/'
-
-        en_passant_square = "-" if not self.has_en_passant else files[self.en_passant[1]] + str((self.dims[0] + 1) - int(ranks[self.en_passant[0]]))
-        turn = "w" if self.turn else "b"
-        castling_rights = ""
-        castling_rights += "K" if self.castling_rights[1, 1] else ""
-        castling_rights += "Q" if self.castling_rights[1, 0] else ""
-        castling_rights += "k" if self.castling_rights[0, 1] else ""
-        castling_rights += "q" if self.castling_rights[0, 0] else ""
-        if castling_rights == "":
-            castling_rights = "-"
-        fen_string += " {} {} {} {} {}".format(turn, castling_rights, en_passant_square, self.ply_count_without_adv, self.half_move_count // 2 + 1)
-        return fen_string
-        
-                
+        """FEN of the position. The piece placement is written by the compiled write_fen_placement, straight from piece_lookup."""
+        rows, cols = self.dims
+        buffer = np.empty(rows * (cols + 1), dtype=np.uint8)
+        placement = buffer[:write_fen_placement(buffer, self.piece_lookup, FEN_PIECE_CODES)].tobytes().decode()
+
+        en_passant_square = _square_names(self.dims)[self.en_passant[0]][self.en_passant[1]] if self.has_en_passant else "-"
+        (black_queenside, black_kingside), (white_queenside, white_kingside) = self.castling_rights.tolist()
+        castling_rights = ("K" if white_kingside else "") + ("Q" if white_queenside else "") + ("k" if black_kingside else "") + ("q" if black_queenside else "")
+        return "{} {} {} {} {} {}".format(
+            placement, "w" if self.turn else "b", castling_rights or "-", en_passant_square, self.ply_count_without_adv, self.half_move_count // 2 + 1)
+
+    def position_key(self):
+        """
+        Exact key of the position for when only its identity matters, e.g. as a dictionary key: pieces, side to move, castling rights
+        and en-passant square, without the move counters. Cheaper than fen(), and unlike the hash it can't collide.
+
+        :return bytes:
+        """
+        return self.bitboards.tobytes() + self.castling_rights.tobytes() + bytes(
+            (self.turn, 1 if self.has_en_passant else 0, int(self.en_passant[1]) if self.has_en_passant else 0))
 
     def game_result(self):
         """
@@ -120,7 +241,8 @@ class Chess:
         :return int: -1 if black has won, 1 if white has one, 0 if draw. 
         """
         if self.legal_move_cache is None:
-            self.legal_moves()
+            # Searches need the packed moves right after this anyway, this fills both caches in one go
+            self.legal_move_array()
 
         if self.ply_count_without_adv > 20 or self.insufficient_material():
             return 0
@@ -197,9 +319,17 @@ class Chess:
 
         self.bitboards[self.turn, piece_at] = unset_bit(self.bitboards[self.turn, piece_at], f_from)
         self.piece_lookup[self.turn, origin[0], origin[1]] = -1
+        self.hash ^= ZOBRIST_PIECES[self.turn, piece_at, f_from]
+        moved = piece_at
         piece_at = piece_at if promotion == -1 else promotion
         self.bitboards[self.turn, piece_at] = set_bit(self.bitboards[self.turn, piece_at], f_to)
         self.piece_lookup[self.turn, target[0], target[1]] = piece_at
+        self.hash ^= ZOBRIST_PIECES[self.turn, piece_at, f_to]
+
+        pst = self._pst_list[self.turn]
+        self.positional[self.turn] += pst[piece_at][target[0]][target[1]] - pst[moved][origin[0]][origin[1]]
+        if promotion != -1:
+            self.material[self.turn] += self._value_list[promotion] - self._value_list[moved]
 
     def make_move(self, i: np.uint8, j: np.uint8, dx: np.int8, dy: np.int8, promotion=-1):
         """
@@ -210,11 +340,21 @@ class Chess:
         :param int8 dx: Delta in the rank-dimension (i) to move.
         :param int8 dy: Delta in the file-dimension (j) to move.
         :param int promotion: Piece to promote to, defaults to -1
+        :return tuple: Undo record that can be passed to unmake_move to take the move back.
         """
         
         enemy_turn = inv_color(self.turn)
         piece_at = self.piece_at(i, j, self.turn)
         piece_to = self.piece_at(i + dx, j + dy, inv_color(self.turn))
+        is_en_passant = piece_at == 0 and self.has_en_passant and self.en_passant[0] == i + dx and self.en_passant[1] == j + dy
+        captured = 0 if is_en_passant else piece_to
+        castling_rights = self.castling_rights.copy()
+        undo = (
+            i, j, dx, dy, promotion, piece_at, captured, is_en_passant,
+            castling_rights, self.has_en_passant, self.en_passant, self.ply_count_without_adv,
+            self.legal_move_cache, self.promotion_move_cache, self.packed_move_cache, self.has_legal_moves, self.any_checkers, self.hash,
+            self.material[:], self.positional[:]
+        )
         self.move_pieces(piece_at, (i, j), (i + dx, j + dy), promotion)
         # If this was castling...
         if piece_at == 5 and abs(dy) == 2:
@@ -242,16 +382,23 @@ class Chess:
             if (i + dx) == back_rank and ((j + dy) == 0 or (j + dy) == self.dims[1] - 1):
                 self.castling_rights[enemy_turn, side] = 0
 
+        if piece_at == 5 or piece_at == 3 or piece_to == 3:
+            for color, side in zip(*np.nonzero(castling_rights != self.castling_rights)):
+                self.hash ^= ZOBRIST_CASTLING[color, side]
+
         # A capture (if there's someone already on the square)
-        if piece_at == 0 and self.has_en_passant and self.en_passant[0] == i + dx and self.en_passant[1] == j + dy:
+        if is_en_passant:
             f_to = flat(i, j + dy, self.dims)
         else:
             f_to = flat(i + dx, j + dy, self.dims)
 
         for piece_type in range(5):
             self.bitboards[enemy_turn, piece_type] = unset_bit(self.bitboards[enemy_turn, piece_type], f_to)
-
         target = unflat(f_to, self.dims)
+        if captured != -1:
+            self.hash ^= ZOBRIST_PIECES[enemy_turn, captured, f_to]
+            self.material[enemy_turn] -= self._value_list[captured]
+            self.positional[enemy_turn] -= self._pst_list[enemy_turn][captured][target[0]][target[1]]
         # Update the move counter for forced draw...
         # 'If I just moved a pawn or made a capture'
         if piece_at == 0 or self.piece_at(target[0], target[1], enemy_turn) != -1:
@@ -264,26 +411,107 @@ class Chess:
         self.piece_lookup[enemy_turn, target[0], target[1]] = -1
 
         # If this enables en-passant
+        if self.has_en_passant:
+            self.hash ^= ZOBRIST_EN_PASSANT[self.en_passant[1]]
         if piece_at == 0 and abs(dx) == 2:
             row_inc = 1 if dx > 0 else -1
             self.has_en_passant = True
             self.en_passant = np.array([i + row_inc, j], dtype=np.int8)
+            self.hash ^= ZOBRIST_EN_PASSANT[j]
         else:
             self.reset_en_passant()
         self.turn = enemy_turn
+        self.hash ^= ZOBRIST_BLACK_TO_MOVE
 
         # Empty the cache after making a move
         self.legal_move_cache = None
+        self.packed_move_cache = None
         self.has_legal_moves = False
+        return undo
+
+    def unmake_move(self, undo):
+        """
+        Takes back a move made with make_move, restoring the position exactly as it was before the move.
+        Moves have to be taken back in the reverse order of which they were made.
+
+        :param tuple undo: Undo record returned by make_move.
+        """
+        (i, j, dx, dy, promotion, piece_at, captured, is_en_passant,
+         castling_rights, has_en_passant, en_passant, ply_count_without_adv,
+         legal_move_cache, promotion_move_cache, packed_move_cache, has_legal_moves, any_checkers, position_hash,
+         material, positional) = undo
+        enemy_turn = self.turn
+        self.turn = inv_color(enemy_turn)
+
+        # Move the piece back, turning it into a pawn again if it was promoted
+        moved = piece_at if promotion == -1 else promotion
+        self.move_pieces(moved, (i + dx, j + dy), (i, j))
+        if promotion != -1:
+            self.bitboards[self.turn, moved] = unset_bit(self.bitboards[self.turn, moved], flat(i, j, self.dims))
+            self.bitboards[self.turn, piece_at] = set_bit(self.bitboards[self.turn, piece_at], flat(i, j, self.dims))
+            self.piece_lookup[self.turn, i, j] = piece_at
+
+        # Put the rook back if this was castling
+        if piece_at == 5 and abs(dy) == 2:
+            side = dy > 0
+            rook_square_y_from = 0 if side == 0 else self.dims[1] - 1
+            rook_square_y_to = (j + dy + 1) if side == 0 else (j + dy - 1)
+            self.move_pieces(3, (i, rook_square_y_to), (i, rook_square_y_from))
+
+        # Put back the captured piece
+        if captured != -1:
+            target = (i, j + dy) if is_en_passant else (i + dx, j + dy)
+            f_to = flat(target[0], target[1], self.dims)
+            self.bitboards[enemy_turn, captured] = set_bit(self.bitboards[enemy_turn, captured], f_to)
+            self.piece_lookup[enemy_turn, target[0], target[1]] = captured
+
+        self.castling_rights[:, :] = castling_rights
+        self.has_en_passant = has_en_passant
+        self.en_passant = en_passant
+        self.ply_count_without_adv = ply_count_without_adv
+        self.half_move_count -= 1
+
+        self.legal_move_cache = legal_move_cache
+        self.promotion_move_cache = promotion_move_cache
+        self.packed_move_cache = packed_move_cache
+        self.has_legal_moves = has_legal_moves
+        self.any_checkers = any_checkers
+        self.hash = position_hash
+        self.material = material
+        self.positional = positional
 
     def reset_en_passant(self):
         self.has_en_passant = False
-        self.en_passant = np.array([-1, -1], dtype=np.int8)
+        self.en_passant = _NO_EN_PASSANT.copy()
 
     def make_null_move(self):
-        """Essentially just passes the turn, without making any real move."""
+        """
+        Essentially just passes the turn, without making any real move.
+
+        :return tuple: Undo record that can be passed to unmake_null_move to take the pass back.
+        """
+        undo = (self.has_en_passant, self.en_passant, self.legal_move_cache, self.promotion_move_cache, self.packed_move_cache,
+                self.has_legal_moves, self.any_checkers, self.hash)
+        if self.has_en_passant:
+            self.hash ^= ZOBRIST_EN_PASSANT[self.en_passant[1]]
         self.reset_en_passant()
         self.turn = inv_color(self.turn)
+        self.hash ^= ZOBRIST_BLACK_TO_MOVE
+        # Legal moves, pins and checkers are those of the player to move
+        self.legal_move_cache = None
+        self.packed_move_cache = None
+        self.has_legal_moves = False
+        return undo
+
+    def unmake_null_move(self, undo):
+        """
+        Takes back a pass made with make_null_move.
+
+        :param tuple undo: Undo record returned by make_null_move.
+        """
+        (self.has_en_passant, self.en_passant, self.legal_move_cache, self.promotion_move_cache, self.packed_move_cache,
+         self.has_legal_moves, self.any_checkers, self.hash) = undo
+        self.turn = inv_color(self.turn)
 
     def find_king(self, turn: bool):
         """Returns the position of the king. (i, j)"""
@@ -371,300 +599,90 @@ class Chess:
             return res, 0
         return self.piece_at(i, j, 1), 1
 
-    def can_castle(self, side: bool, all_pieces: np.uint64, king_danger_squares: np.uint64):
-        """Calculates if castling is legal to the current side. If castling is disabled for the given variant, castling rights are pre-set to 0.
-
-        :param bool side: Side to consider
-        :param uint64 all_pieces: Bitboard of all pieces on the board
-        :param uint64 king_danger_squares: Squares that are threatened for the king
-        :return bool: If the king can castle to the given side.
-        """
-        j = 0 if side == 0 else self.dims[1] - 1
-        back_rank = 0 if self.turn == 0 else self.dims[0] - 1
-        # Må faktisk ha et tårn der
-        if not has_bit(self.bitboards[self.turn, 3], flat(back_rank, j, self.dims)):
-            return False
-        return self.castling_rights[self.turn, side] and (self.CASTLING_ATTACK_MASKS[self.turn, side] & king_danger_squares) == 0 and (self.CASTLING_EMPTY_MASKS[self.turn, side] & all_pieces) == 0
-
     def single_to_bitboard(self, i, j):
         """Creates an empty bitboard with the bit at (i, j) set."""
         return set_bit(0, flat(i, j, self.dims))
 
-    def find_checkers(self, all_pieces: np.uint64, enemy_turn: bool, king_pos: Tuple[int, int]):
-        """Finds the pieces giving check to the player to move's king.
-
-        :param uint64 all_pieces: Bitboard with all the pieces.
-        :param bool enemy_turn: The color of the enemy turn. 
-        :param Tuple[int8, int8] king_pos: Position of the king of the player to move.
-        :return uint64: Bitboard containing all pieces giving check.
-        """
-        i, j = king_pos
-        checkers = B_0
-        # Translates to: knight moves that attack the king, and also has a knight present
-        # Meaning: knights that attack our king!
-        checkers |= self.KNIGHT_MOVES[i, j] & self.bitboards[enemy_turn, 1]
-        # Same, but with diagonally attacking pieces
-        checkers |= self.diagonal_move_magic(all_pieces, i, j) & (self.bitboards[enemy_turn, 2] | self.bitboards[enemy_turn, 4])
-        # Same, but with pieces attacking in straight lines
-        checkers |= self.straight_move_magic(all_pieces, i, j) & (self.bitboards[enemy_turn, 3] | self.bitboards[enemy_turn, 4])
-
-        # Same, but with pawns
-        # Have to look at pawn attacks from the king-position in the opposite direction of attack of the enemy pawns
-        # Enemies attack "downwards", but king looks upward
-        checkers |= self.PAWN_ATTACKS[self.turn, i, j] & self.bitboards[enemy_turn, 0]
-        return checkers
-
-    def find_pinned_ray(self, all_pieces: np.uint64, king_pos: Tuple[int, int], attacker: Tuple[int, int], pinned_piece: Tuple[int, int], straight: bool):
-        """Finds move-rays of a given piece, given that they might be restricted by an absolute pin.
-
-        :param uint64 all_pieces: Bitboard of all pieces on the board.
-        :param Tuple[int, int] king_pos: Position of the king.
-        :param Tuple[int, int] attacker: Current attacking piece to consider.
-        :param Tuple[int, int] pinned_piece: Piece being pinned to the king.
-        :param bool straight: If the pinned rays should be on the straight-lines (if not, on the diagonals)
-        :return uint64: Bitboard containing the pin-rays.
-        """
-        pin_mask = self.single_to_bitboard(pinned_piece[0], pinned_piece[1])
-        all_pieces_without_pinned = all_pieces & ~pin_mask
-        king_mask = self.bitboards[self.turn, 5]
-        attacker_mask = self.single_to_bitboard(attacker[0], attacker[1])
-        if straight:
-            result = (self.straight_move_magic(all_pieces_without_pinned, king_pos[0], king_pos[1]) | king_mask) & (
-                self.straight_move_magic(all_pieces_without_pinned, attacker[0], attacker[1]) | attacker_mask)
-        else:
-            result = (self.diagonal_move_magic(all_pieces_without_pinned, king_pos[0], king_pos[1]) | king_mask) & (
-                self.diagonal_move_magic(all_pieces_without_pinned, attacker[0], attacker[1]) | attacker_mask)
-        f = flat(king_pos[0], king_pos[1], self.dims)
-        if not has_bit(result, f):
-            return np.iinfo(np.uint64).max
-        return result
-
-    def is_on_diagonal(self, p1: Tuple[int, int], p2: Tuple[int, int]):
-        """Helper, if two points are on same diagonal"""
-        return abs(p2[1] - p1[1]) == abs(p2[0] - p1[0])
-
-    def is_on_straight(self, p1: Tuple[int, int], p2: Tuple[int, int]):
-        """Helper, if two points are on same straight"""
-        return p2[1] == p1[1] or p2[0] == p1[0]
-
-    def find_pinned_pieces(self, all_pieces: np.uint64, enemy_pieces: np.uint64, enemy_turn: bool, king_pos: Tuple[int, int]):
-        """Finds a bitboard of all pieces that are absolutely pinned.
-
-        :param uint64 all_pieces: Bitboard of all pieces.
-        :param uint64 enemy_pieces: Bitboard of all enemy pieces.
-        :param bool enemy_turn: Turn of the pleyr not to move.
-        :param Tuple[int, int] king_pos: Position of the king of the player to move.
-        :return uint64: Bitboard of the absolutelyl pinned pieces.
-        """
-        king_straights = self.straight_move_magic(all_pieces, king_pos[0], king_pos[1])
-        king_diagonals = self.diagonal_move_magic(all_pieces, king_pos[0], king_pos[1])
-
-        # Find all sliding rays from opponent
-        pin_rays = np.full(self.dims, np.iinfo(np.uint64).max, dtype=np.uint64)
-        squares_to_check = (self.DIAGONAL_MOVES[king_pos[0], king_pos[1]] | self.STRAIGHT_MOVES[king_pos[0], king_pos[1]]
-                            | self.single_to_bitboard(king_pos[0], king_pos[1])) & enemy_pieces
-        for bit in true_bits(squares_to_check):
-            i, j = unflat(bit, self.dims)
-            piece_at = self.piece_at(i, j, enemy_turn)
-            found = False
-            if self.is_on_straight((i, j), king_pos) and (piece_at == 3 or piece_at == 4):
-                straight_pinned = self.straight_move_magic(all_pieces, i, j) & king_straights
-                if straight_pinned:
-                    # There is a pinned piece here!
-                    # There can maximally be one piece per ray.
-                    # Now, remove the pinned piece from the board, and calculate hypothetical check-rays
-                    pinned_piece = self.bit_pos(straight_pinned)
-                    pin_rays[pinned_piece[0], pinned_piece[1]] = self.find_pinned_ray(all_pieces, king_pos, (i, j), pinned_piece, True)
-                    found = True
-            if self.is_on_diagonal((i, j), king_pos) and not found and (piece_at == 2 or piece_at == 4):
-                diagonal_pinned = self.diagonal_move_magic(all_pieces, i, j) & king_diagonals
-                if diagonal_pinned:
-                    # There is a pinned piece here!
-                    # There can maximally be one piece per ray.
-                    pinned_piece = self.bit_pos(diagonal_pinned)
-                    pin_rays[pinned_piece[0], pinned_piece[1]] = self.find_pinned_ray(all_pieces, king_pos, (i, j), pinned_piece, False)
-
-        return pin_rays
-
-    def find_and_validate_en_passant_moves(self, all_pieces: np.uint64, opp_pawn_row_inc: np.int8, enemy_turn: bool, king_pos: Tuple[int, int]):
-        """Finds all valid en-passant moves in the given position.
-
-        :param uint64 all_pieces: Bitboard of all pieces.
-        :param int8 opp_pawn_row_inc: dy of the enemy pawns. (The direction of the movement of the enemy pawns.) Either -1 or 1.
-        :param bool enemy_turn: Turn of the player that doesn't have the move.
-        :param Tuple[int, int] king_pos: Position of the king.
-        :return uint64: Bitboard of the valid en-passant moves.
-        """
-        en_passant_moves = B_0
-        if self.has_en_passant:
-            # Edge-case: taking en-passant opens up for discovered-check
-            # i_act, j_act is where the pawn is also open for attack,
-            # i_act + opp_row_inc, j_act is where the pawn actually is.
-            i_act, j_act = self.en_passant
-            # Two potential en-passant attacks:
-            for dx in [-1, 1]:
-                to_remove = self.single_to_bitboard(i_act + opp_pawn_row_inc, j_act) | self.single_to_bitboard(i_act + opp_pawn_row_inc, j_act + dx)
-                # If there is an intersection between the king and some
-                intersections = self.straight_move_magic(all_pieces & ~to_remove, king_pos[0], king_pos[1])
-                # Find all sliding rays from opponent
-                opponent_straights = B_0
-                enemies_to_look_for = (self.bitboards[enemy_turn, 3] | self.bitboards[enemy_turn, 4]) & self.STRAIGHT_MOVES[king_pos[0], king_pos[1]]
-                for bit in true_bits(enemies_to_look_for):
-                    i, j = unflat(bit, self.dims)
-                    opponent_straights |= self.straight_move_magic(all_pieces, i, j)
-                # ONLY IF there is no intersection, i.e. the en-passant move doesn't cause check, add it.
-                if has_bit(intersections & opponent_straights, flat(king_pos[0], king_pos[1], self.dims)) == 0:
-                    en_passant_moves |= self.single_to_bitboard(i_act, j_act)
-            # en_passant_moves &= (self.PAWN_ATTACKS[enemy_turn, i_act, j_act] & self.bitboards[self.turn, 0])
-        return en_passant_moves
-
     def legal_moves(self):
         """
         Finds all legal moves. 
         They are given as a matrix of bitboards, where the bitboard at (i, j) designates the legal moves that can be made from that position.
         This is returned along with an a similar matrix designating the available promotions.
+        The moves are generated by the compiled generate_legal_moves, and cached until the next move is made.
         """
         if self.legal_move_cache is not None:
             return self.legal_move_cache, self.promotion_move_cache
-        enemy_turn = inv_color(self.turn)
-        all_pieces = self.get_all_pieces(False)
-        my_pieces = self.get_all_pieces(False, [self.turn])
-        enemy_pieces = all_pieces & ~my_pieces
-        my_pawn_row_inc = -1 if self.turn == 1 else 1
-        opp_pawn_row_inc = my_pawn_row_inc * -1
-        # Get squares that are dangerous for the king
-        king_danger_squares = self.get_attacked_squares(inv_color(self.turn), True)
-        king_pos = self.find_king(self.turn)
-        # i, j is the position of our king...
-        i, j = king_pos
-        king_moves = (self.KING_MOVES[i, j] & ~king_danger_squares) & ~my_pieces
-
-        checkers = self.find_checkers(all_pieces, enemy_turn, king_pos)
-        more_than_one_checker = more_than_one_bit_set(checkers)
-        if more_than_one_checker:
-            # In double-check, only legal thing to do is move the king.
-            # This means that all the legal moves consist of moves that move the king.
-            legal_moves = np.zeros(self.dims, dtype=np.uint64)
-            legal_moves[i, j] = king_moves
-            self.has_legal_moves = np.any(legal_moves > 0)
-            self.any_checkers = checkers != 0
-            self.legal_move_cache = legal_moves
-            self.promotion_move_cache = np.zeros_like(legal_moves)
-            return legal_moves, np.zeros_like(legal_moves)
-
-        # If we are in check, that limits what we can do.
-        # We either have to capture the piece in check, or block it.
-        # Need to create two masks for this.
-
-        # If not in check, these masks don't limit anything.
-        # Need to have two different masks due to en-passant checks.
-        # In that (and only that) case, you can capture a piece by moving to an empty tile.
-        # Meaning that you capture it by moving to someplace it isn't, thus requiring two different masks!
-        capture_mask = np.iinfo(np.uint64).max
-        en_passant_capture_mask = B_0
-        push_mask = np.iinfo(np.uint64).max
-        # Only a single checker!
-        if checkers != 0 and not more_than_one_checker:
-            # Can capture the checker...
-            capture_mask = checkers
-
-            i, j = self.bit_pos(checkers)
-            piece_at = self.piece_at(i, j, enemy_turn)
-            # Edge-case: checker is a pawn that was just moved two squares forward, opens up for en-passant
-            # Need to add the en-passant square as a possible one to be attacked as well.
-            if piece_at == 0 and self.has_en_passant:
-                en_passant_capture_mask |= self.single_to_bitboard(self.en_passant[0], self.en_passant[1])
-            # If a knight is giving check, it can't be blocked
-            if piece_at == 0 or piece_at == 1:
-                push_mask = B_0
-            else:
-
-                # Find the straight-line moves from the king and from the checker, and see where they intersect.
-
-                # TODO: this now also considers squares "behind" the king, which is not right.
-                # Like this: ..R..k..x, in this case, the x would also be a valid intersection, and so would be a valid "block".
-                # Not good.
-
-                # ACTUALLY, no it wouldn't! As the king counts as a blocker for the magic :)
-                intersections = B_0
-                if piece_at == 2:
-                    intersections |= self.diagonal_move_magic(all_pieces, i, j) & self.diagonal_move_magic(all_pieces, king_pos[0], king_pos[1])
-                if piece_at == 3:
-                    intersections |= self.straight_move_magic(all_pieces, i, j) & self.straight_move_magic(all_pieces, king_pos[0], king_pos[1])
-
-                # Stop pinning diagonally and straight at the same time...
-                if piece_at == 4:
-                    if king_pos[0] == i or king_pos[1] == j:
-                        intersections |= self.straight_move_magic(all_pieces, i, j) & self.straight_move_magic(all_pieces, king_pos[0], king_pos[1])
-                    else:
-                        intersections |= self.diagonal_move_magic(all_pieces, i, j) & self.diagonal_move_magic(all_pieces, king_pos[0], king_pos[1])
-
-                # Remove the actual pieces from the mix, leaving the ray between the checker and the king
-                intersections &= (~self.bitboards[self.turn, 5] | ~checkers)
-                push_mask = intersections
-
-            # Meaning, any piece that has to move, either has to go to the field indicated by push_mask or capture_mask
-
-        # Pinned pieces
-        pin_masks = self.find_pinned_pieces(all_pieces, enemy_pieces, enemy_turn, king_pos)
-        # Sweet! Now any piece that falls in this pinned_check_ray has to move only within that.
-
-        en_passant_moves = self.find_and_validate_en_passant_moves(all_pieces, opp_pawn_row_inc, enemy_turn, king_pos)
-
-        legal_moves = np.zeros(self.dims, dtype=np.uint64)
-        # Now calculate legal moves from position (i, j)
-        promotions = np.zeros(self.dims, dtype=np.uint64)
-        # print_bitboard(capture_mask, self.dims)
-        # print()
-        # print_bitboard(en_passant_moves, self.dims)
-        # print()
-        for bit in true_bits(my_pieces):
-            i, j = unflat(bit, self.dims)
-            moves_to_make = B_0
-            f = flat(i, j, self.dims)
-            piece_at = self.piece_at(i, j, self.turn)
-            if piece_at == 0:
-                # Can either attack an enemy square, or the en-passant square
-                moves_to_make |= self.PAWN_ATTACKS[self.turn, i, j] & (enemy_pieces | en_passant_moves)
-                # Pushing pawns one step, if there are no pieces in the way
-                single_pawn_moves = (self.PAWN_MOVES_SINGLE[self.turn, i, j] & ~all_pieces)
-                moves_to_make |= single_pawn_moves
-                # If a pawn can't be pushed one square forward, it is blocked from pushing two aswell
-                if single_pawn_moves != 0:
-                    moves_to_make |= (self.PAWN_MOVES_DOUBLE[self.turn, i, j] & ~all_pieces)
-
-                promotions[i, j] |= (moves_to_make & self.PROMOTION_MASKS[self.turn])
-
-            if piece_at == 1:
-                moves_to_make |= (self.KNIGHT_MOVES[i, j] & ~my_pieces)
-            if piece_at == 2 or piece_at == 4:
-                moves_to_make |= (self.diagonal_move_magic(all_pieces, i, j) & ~my_pieces)
-            if piece_at == 3 or piece_at == 4:
-                moves_to_make |= (self.straight_move_magic(all_pieces, i, j) & ~my_pieces)
-            if piece_at == 5:
-                moves_to_make |= king_moves
-                # Castle left
-                if self.can_castle(0, all_pieces, king_danger_squares):
-                    moves_to_make |= self.single_to_bitboard(i, j - 2)
-                if self.can_castle(1, all_pieces, king_danger_squares):
-                    moves_to_make |= self.single_to_bitboard(i, j + 2)
-            # Remove moves that don't deal with check if necessary
-            if piece_at != 5 and piece_at != 0:
-                moves_to_make &= (capture_mask | push_mask)
-            if piece_at == 0:
-                moves_to_make &= (capture_mask | en_passant_capture_mask | push_mask)
-            # If it's pinned, restrict the moves to the pinned ray
-            moves_to_make &= pin_masks[i, j]
-            legal_moves[i, j] = moves_to_make
+        legal_moves, promotions, has_legal_moves, any_checkers = generate_legal_moves(
+            self.bitboards, self.piece_lookup, self.turn, self.castling_rights,
+            bool(self.has_en_passant), int(self.en_passant[0]), int(self.en_passant[1]), *self.move_tables)
 
         # Now legal_moves is a (m x n) matrix with bitboards designating the legal moves from the field (i, j)
         # And promotions is a (m x n) matrix with bitboards designating that any (pawn)moves to the given square is a promotion
-        self.has_legal_moves = np.any(legal_moves > 0)
-        self.any_checkers = checkers != 0
+        self.has_legal_moves = has_legal_moves
+        self.any_checkers = any_checkers
         self.legal_move_cache = legal_moves
         self.promotion_move_cache = promotions
         return legal_moves, promotions
 
+    def legal_move_array(self):
+        """
+        Finds all legal moves, as a flat int32 array of packed moves (see fastchess_utils.pack_move).
+        Contains the same moves, in the same order, as piece_matrix_to_legal_moves(*legal_moves()), but without building Python tuples.
+        Each move also carries the captured piece (bits 15-17) and the MOVE_* flags from movegen, which makes move ordering cheap.
+        """
+        if self.packed_move_cache is not None:
+            return self.packed_move_cache
+        packed, legal_moves, promotions, has_legal_moves, any_checkers = generate_packed_moves(
+            self.bitboards, self.piece_lookup, self.turn, self.castling_rights,
+            bool(self.has_en_passant), int(self.en_passant[0]), int(self.en_passant[1]), *self.move_tables)
+        self.has_legal_moves = has_legal_moves
+        self.any_checkers = any_checkers
+        self.legal_move_cache = legal_moves
+        self.promotion_move_cache = promotions
+        self.packed_move_cache = packed
+        return packed
+
+    def attack_maps(self):
+        """
+        Attack maps of the position, computed by the compiled generate_attack_maps.
+        Evaluation terms like king safety, hanging pieces or (pseudo-legal) mobility can be computed from these without generating moves.
+
+        :return: (attackers, attacked, pin_rays, checkers):
+
+            - attackers: (2, rows, cols) bitboards, attackers[color, i, j] are the pieces of color attacking (i, j).
+            - attacked: (2,) bitboards of all squares attacked by each color.
+            - pin_rays: (rows, cols) bitboards restricting the moves of the absolutely pinned pieces of the player to move to their pin ray,
+              all bits set for pieces that aren't pinned.
+            - checkers: Bitboard of the pieces giving check to the player to move.
+        """
+        return generate_attack_maps(self.bitboards, self.piece_lookup, self.turn, self.dims[0], self.dims[1], *self.move_tables)
+
+    def attackers_of(self, i: int, j: int, color: int):
+        """Bitboard of the pieces of the given color attacking (i, j), from attack_maps."""
+        return self.attack_maps()[0][color, i, j]
+
+    def hanging_pieces(self, color: int):
+        """Bitboard of the pieces of the given color that are attacked by the other color and not defended, from attack_maps."""
+        attackers, attacked, _, _ = self.attack_maps()
+        pieces = B_0
+        for piece_type in range(5):
+            pieces |= self.bitboards[color, piece_type]
+        return pieces & attacked[1 - color] & ~attacked[color]
+
+    def see(self, move):
+        """
+        Static exchange evaluation of a move of the player to move, without making any moves: the material it wins (negative if it
+        loses material) once both sides have made all the captures on its target square that pay off for them, x-rays included.
+        Pieces are valued with the piece values set with set_evaluation_tables.
+
+        :param move: Packed move (see fastchess_utils.pack_move), or a move in the ((i, j), (dx, dy), promotion) format of the agents.
+        :return int: Material balance of the exchange for the player to move.
+        """
+        if not isinstance(move, (int, np.integer)):
+            (i, j), (dx, dy), promotion = move
+            move = pack_move(i, j, dx, dy, promotion)
+        return int(static_exchange(self.bitboards, self.piece_lookup, self.turn, int(move), np.asarray(self.piece_values, dtype=np.int64), *self.move_tables))
+
     def copy(self):
         return Chess(
             self.bitboards.copy(),
@@ -682,4 +700,5 @@ class Chess:
             self.PROMOTION_MASKS,
             self.castling_rights.copy(),
             self.has_en_passant, self.en_passant.copy(),
-            self.ply_count_without_adv, self.half_move_count, self.turn)
\ No newline at end of file
+            self.ply_count_without_adv, self.half_move_count, self.turn, self.hash,
+            (self.piece_values, self.piece_square_tables, self._value_list, self._pst_list, self.material, self.positional))
\ No newline at end of file
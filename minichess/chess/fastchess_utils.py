@@ -36,6 +36,17 @@ B_0 = np.uint64(0)
 
 INVERSE_PIECE_LOOKUP = {v: k for k, v in PIECE_LOOKUP.items()}
 
+# Zobrist keys, drawn once with a fixed seed so hashes are identical across processes and runs.
+# Pieces are indexed by [color, piece_type, flattened square], en-passant keys by file.
+_zobrist_rng = np.random.default_rng(747)
+ZOBRIST_PIECES = _zobrist_rng.integers(0, np.iinfo(np.uint64).max, size=(2, 6, 64), dtype=np.uint64, endpoint=True)
+ZOBRIST_CASTLING = _zobrist_rng.integers(0, np.iinfo(np.uint64).max, size=(2, 2), dtype=np.uint64, endpoint=True)
+ZOBRIST_EN_PASSANT = _zobrist_rng.integers(0, np.iinfo(np.uint64).max, size=8, dtype=np.uint64, endpoint=True)
+ZOBRIST_BLACK_TO_MOVE = _zobrist_rng.integers(0, np.iinfo(np.uint64).max, dtype=np.uint64, endpoint=True)
+
+# Material values Chess evaluates positions with unless given others, indexed by piece type
+DEFAULT_PIECE_VALUES = np.array([100, 320, 330, 500, 900, 20000], dtype=np.int32)
+
 
 def load_board(board_setup_path="minichess/boards/8x8standard"):
     with open(board_setup_path + ".board") as f:
@@ -265,33 +276,89 @@ def promotion_masks(dims):
 @njit
 def agent_state(dims, bitboards, castling_rights, turn, en_passant, has_en_passant, ply_count_without_adv):
     full_state = np.zeros((dims[0], dims[1], 4 + 3 + 2 * 6), dtype=np.float32)
+    write_agent_state(full_state, bitboards, castling_rights, turn, en_passant, has_en_passant, ply_count_without_adv, 20)
+    return full_state
+
+@njit
+def write_agent_state(out, bitboards, castling_rights, turn, en_passant, has_en_passant, ply_count_without_adv, ply_divisor):
+    """
+    Writes the planes of agent_state into out, a (rows, cols, 19) array of any numeric dtype, without allocating anything.
+    For black to move the board is rotated by 180 degrees, so the player to move always plays "up".
+
+    :param ply_divisor: The ply count plane holds ply_count_without_adv / ply_divisor. agent_state uses 20, integer buffers 1.
+    """
+    rows, cols = out.shape[0], out.shape[1]
+    out[:] = 0
+    flip = turn == 0
 
     # Brett for trekk og motstander
-    for _turn in [0, 1]:
+    for _turn in range(2):
         for piece_type in range(6):
             for bit in true_bits(bitboards[_turn, piece_type]):
-                i, j = unflat(bit, dims)
-                full_state[i, j, 6 * _turn + piece_type] = 1
+                i, j = unflat(bit, (rows, cols))
+                if flip:
+                    i, j = rows - 1 - i, cols - 1 - j
+                out[i, j, 6 * _turn + piece_type] = 1
     offset = 6 * 1 + 6
     # Mine rokeringsmuligheter
-    full_state[:, :, offset] = castling_rights[turn, 0]
-    full_state[:, :, offset + 1] = castling_rights[turn, 1]
+    out[:, :, offset] = castling_rights[turn, 0]
+    out[:, :, offset + 1] = castling_rights[turn, 1]
     # Deres rokeringsmuligheter
-    full_state[:, :, offset + 2][:, :] = castling_rights[inv_color(turn), 0]
-    full_state[:, :, offset + 3][:, :] = castling_rights[inv_color(turn), 1]
+    out[:, :, offset + 2] = castling_rights[inv_color(turn), 0]
+    out[:, :, offset + 3] = castling_rights[inv_color(turn), 1]
 
-    en_passant_plane = np.zeros((dims[0], dims[1]), dtype=np.float32)
     if has_en_passant:
-        en_passant_plane[en_passant[0], en_passant[1]] = 1
+        i, j = int(en_passant[0]), int(en_passant[1])
+        if flip:
+            i, j = rows - 1 - i, cols - 1 - j
+        out[i, j, offset + 4] = 1
+    out[:, :, offset + 5] = ply_count_without_adv / ply_divisor
+    out[:, :, offset + 6] = turn
 
-    full_state[:, :, offset + 4] = en_passant_plane
-    full_state[:, :, offset + 5][:, :] = ply_count_without_adv / 20
-    full_state[:, :, offset + 6][:, :] = turn
-
-    if turn == 0:
-        full_state = np.fliplr(full_state)
-        full_state = np.flipud(full_state)
-    return full_state
+@njit
+def write_agent_states(out, bitboards, castling_rights, turn, en_passant, has_en_passant, ply_count_without_adv, ply_divisor):
+    """
+    write_agent_state for a batch of positions, all arguments stacked on a first batch axis.
+    out has shape (N, rows, cols, 19) with N at least the number of positions, which are written to its first rows.
+    """
+    for n in range(bitboards.shape[0]):
+        write_agent_state(out[n], bitboards[n], castling_rights[n], turn[n], en_passant[n], has_en_passant[n], ply_count_without_adv[n], ply_divisor)
+
+# ASCII code of every piece in a FEN, indexed by [color, piece type]
+FEN_PIECE_CODES = np.array([[ord(INVERSE_PIECE_LOOKUP[t]) for t in range(6)], [ord(INVERSE_PIECE_LOOKUP[t].upper()) for t in range(6)]], dtype=np.uint8)
+
+
+@njit(cache=True)
+def write_fen_placement(out, piece_lookup, piece_codes):
+    """
+    Writes the piece placement field of a FEN (the ranks from the top of the board, separated by '/') as ASCII codes.
+
+    :param NDArray[uint8] out: Buffer of at least rows * (cols + 1) bytes.
+    :param NDArray[uint8] piece_codes: FEN_PIECE_CODES.
+    :return int: Number of bytes written.
+    """
+    rows, cols = piece_lookup.shape[1], piece_lookup.shape[2]
+    n = 0
+    for i in range(rows):
+        empties = 0
+        for j in range(cols):
+            color = 0 if piece_lookup[0, i, j] != -1 else (1 if piece_lookup[1, i, j] != -1 else -1)
+            if color == -1:
+                empties += 1
+                continue
+            if empties > 0:
+                out[n] = 48 + empties
+                n += 1
+                empties = 0
+            out[n] = piece_codes[color, piece_lookup[color, i, j]]
+            n += 1
+        if empties > 0:
+            out[n] = 48 + empties
+            n += 1
+        if i != rows - 1:
+            out[n] = 47
+            n += 1
+    return n
 
 @njit
 def true_bits(num):
@@ -403,7 +470,7 @@ def square_name_to_coordinate_move(coordinate, board_dimensions):
     rank = int(coordinate[1]) - 1
     file = ord(coordinate[0]) - ord('a')
 
-    return board_dimensions[1] - 1 - rank, file
+    return board_dimensions[0] - 1 - rank, file
 
 
 def uci_move_to_native_move(uci_move, board):
@@ -419,6 +486,72 @@ def uci_move_to_native_move(uci_move, board):
     return i, j, dx, dy, promotion
 
 
+def zobrist_hash(bitboards, castling_rights, turn, has_en_passant, en_passant):
+    """Computes the Zobrist hash of a position from scratch. Chess keeps its hash up to date incrementally, this is only needed to initialise it."""
+    h = B_0
+    for color in [0, 1]:
+        for piece_type in range(6):
+            for bit in true_bits(bitboards[color, piece_type]):
+                h ^= ZOBRIST_PIECES[color, piece_type, bit]
+    for color in [0, 1]:
+        for side in [0, 1]:
+            if castling_rights[color, side]:
+                h ^= ZOBRIST_CASTLING[color, side]
+    if has_en_passant:
+        h ^= ZOBRIST_EN_PASSANT[en_passant[1]]
+    if turn == 0:
+        h ^= ZOBRIST_BLACK_TO_MOVE
+    return h
+
+
+
+def evaluation_scores(bitboards, dims, piece_values, piece_square_tables):
+    """
+    Computes the material and piece-square scores of both colors from scratch. Chess keeps them up to date incrementally, this is only needed to initialise them.
+
+    :param list piece_values: Value per piece type.
+    :param list piece_square_tables: Nested list indexed [color][piece type][i][j].
+    :return Tuple[list, list]: Material and piece-square score per color, indexed by color.
+    """
+    material, positional = [0, 0], [0, 0]
+    for color in [0, 1]:
+        for piece_type in range(6):
+            for bit in true_bits(bitboards[color, piece_type]):
+                i, j = unflat(bit, dims)
+                material[color] += piece_values[piece_type]
+                positional[color] += piece_square_tables[color][piece_type][i][j]
+    return material, positional
+
+
+def pack_move(i, j, dx, dy, promotion=-1):
+    """
+    Packs a move into a single int: origin square in bits 0-5, target square in bits 6-11 and promotion + 1 in bits 12-14.
+    Moves from Chess.legal_move_array also have the captured piece + 1 in bits 15-17 and the flags from movegen in bits 18-20.
+    Masking with MOVE_KEY_MASK gives the part identifying the move, which is what pack_move produces.
+    """
+    return (8 * i + j) | ((8 * (i + dx) + j + dy) << 6) | ((promotion + 1) << 12)
+
+
+MOVE_KEY_MASK = (1 << 15) - 1
+
+
+def unpack_move(packed):
+    """Inverse of pack_move, gives the move back in the ((i, j), (dx, dy), promotion) format used by the agents."""
+    origin, target, promotion = packed & 63, (packed >> 6) & 63, ((packed >> 12) & 7) - 1
+    i, j = origin // 8, origin % 8
+    return (i, j), (target // 8 - i, target % 8 - j), promotion
+
+
+def move_captured(packed):
+    """Piece type captured by a move from Chess.legal_move_array, -1 if it isn't a capture."""
+    return ((packed >> 15) & 7) - 1
+
+
+def move_promotion(packed):
+    """Piece type a packed move promotes to, -1 if it isn't a promotion."""
+    return ((packed >> 12) & 7) - 1
+
+
 def more_than_one_bit_set(board):
     return board & (board - B_1) != 0
 
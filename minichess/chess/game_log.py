@@ -0,0 +1,196 @@
+"""
+Binary game logs: many games in one append-only file, each stored as its moves instead of a FEN per position.
+
+A log starts with MAGIC and a version byte, followed by one record per game:
+
+    header  uint32 record size in bytes (header included), uint32 game number, int64 seed, int8 result, uint16 plies
+    names   variant, white agent and black agent, each as a uint8 length followed by that many bytes of UTF-8
+    moves   plies x uint16, the moves packed as by fastchess_utils.pack_move
+    times   plies x float16, seconds the agent took for each move
+
+All numbers are little-endian. A 40-ply game takes about 200 bytes, against 1-2 KB (and a file of its own) as FEN text.
+Positions are rebuilt on demand by replaying the moves from the variant's initial position.
+
+Existing FEN files (autograder.py --save_fens) can be converted, from the repository root:
+
+    python -m minichess.chess.game_log fens/ --output games/converted.mcgl
+"""
+import os
+import struct
+from argparse import ArgumentParser
+
+import numpy as np
+
+from .chess_helpers import game_from_fens, get_initial_chess_object
+from .fastchess_utils import pack_move, unpack_move
+
+MAGIC = b"MCGL"
+VERSION = 1
+GAME_LOG_EXTENSION = ".mcgl"
+
+_HEADER = struct.Struct("<IIqbH")
+
+# Result of a game by the name autograder.py gives its FEN file, for files without the result line
+_FILE_RESULTS = {"white": 1, "black": -1, "draw": 0}
+
+
+class GameRecord:
+    """One game of a log: who played it, how it ended, and its moves with the time each took."""
+
+    def __init__(self, variant: str, white: str, black: str, result: int, moves, times=None, game: int = 0, seed: int = -1):
+        """
+        :param str variant: Variant the game was played in, it starts from the variant's initial position.
+        :param int result: 1 if white won, -1 if black won, 0 for a draw.
+        :param moves: Packed moves (see fastchess_utils.pack_move), one per ply.
+        :param times: Seconds each move took, zeros if None.
+        :param int game: Number of the game in its match.
+        :param int seed: Seed the game was played with, -1 if unknown.
+        """
+        self.variant = variant
+        self.white = white
+        self.black = black
+        self.result = int(result)
+        self.moves = np.asarray(moves, dtype=np.uint16)
+        self.times = np.zeros(len(self.moves), dtype=np.float16) if times is None else np.asarray(times, dtype=np.float16)
+        self.game = int(game)
+        self.seed = int(seed)
+
+    def __len__(self):
+        return len(self.moves)
+
+    def agent_moves(self):
+        """The moves in the ((i, j), (dx, dy), promotion) format of the agents."""
+        return [unpack_move(move) for move in self.moves.tolist()]
+
+    def positions(self):
+        """
+        Yields the initial position and the position after every ply, len(self) + 1 in total.
+        The same Chess object is yielded every time, moved on after each yield, copy it to keep a position.
+        """
+        chess = get_initial_chess_object(self.variant)
+        yield chess
+        for (i, j), (dx, dy), promotion in self.agent_moves():
+            chess.make_move(i, j, dx, dy, promotion)
+            yield chess
+
+    def position(self, ply: int):
+        """The position after the given number of plies."""
+        chess = get_initial_chess_object(self.variant)
+        for (i, j), (dx, dy), promotion in self.agent_moves()[:ply]:
+            chess.make_move(i, j, dx, dy, promotion)
+        return chess
+
+    def fens(self):
+        """FEN of every position, as autograder.py --save_fens writes them (without the result line)."""
+        return [chess.fen() for chess in self.positions()]
+
+    def to_bytes(self):
+        names = b"".join(len(name).to_bytes(1, "little") + name for name in (s.encode() for s in (self.variant, self.white, self.black)))
+        body = names + self.moves.astype("<u2").tobytes() + self.times.astype("<f2").tobytes()
+        return _HEADER.pack(_HEADER.size + len(body), self.game, self.seed, self.result, len(self.moves)) + body
+
+
+class GameLogWriter:
+    """Appends games to a log, creating it if it doesn't exist. Use as a context manager, or close it when done."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC + bytes([VERSION]))
+
+    def write(self, record: GameRecord):
+        self.file.write(record.to_bytes())
+        # Every game is complete on disk as soon as it is written, a match can be read while it is still being played
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _read_name(data, offset):
+    length = data[offset]
+    return data[offset + 1:offset + 1 + length].decode(), offset + 1 + length
+
+
+def read_games(path: str):
+    """
+    Streams the games of a log, one record at a time, so logs of any size can be read.
+
+    :return: Generator of GameRecord.
+    """
+    with open(path, "rb") as f:
+        start = f.read(len(MAGIC) + 1)
+        if start[:len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a game log".format(path))
+        if start[len(MAGIC)] != VERSION:
+            raise ValueError("{} is a version {} game log, only version {} can be read".format(path, start[len(MAGIC)], VERSION))
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            size, game, seed, result, plies = _HEADER.unpack(header)
+            body = f.read(size - _HEADER.size)
+            variant, offset = _read_name(body, 0)
+            white, offset = _read_name(body, offset)
+            black, offset = _read_name(body, offset)
+            moves = np.frombuffer(body, dtype="<u2", count=plies, offset=offset)
+            times = np.frombuffer(body, dtype="<f2", count=plies, offset=offset + 2 * plies)
+            yield GameRecord(variant, white, black, result, moves, times, game, seed)
+
+
+def read_fen_game(path: str):
+    """
+    Reads a game saved by autograder.py --save_fens.
+
+    :return: (fens, result), result being 1 if white won, -1 if black won and 0 for a draw.
+    """
+    with open(path) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    fens = [line for line in lines if "/" in line]
+    if lines and "/" not in lines[-1]:
+        result = int(lines[-1])
+    else:
+        result = _FILE_RESULTS[os.path.splitext(path)[0].rsplit("_", 1)[-1]]
+    return fens, result
+
+
+def fen_files(paths):
+    """The .fen files among the given files and directories, directories searched recursively."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names if name.endswith(".fen")))
+        else:
+            files.append(path)
+    return files
+
+
+def record_from_fen_file(path: str, variant: str = "5x4microchess"):
+    """Converts a game saved by autograder.py --save_fens. The agent names come from its directory name (<white>_vs_<black>), timings are unknown."""
+    fens, result = read_fen_game(path)
+    moves = [pack_move(i, j, dx, dy, promotion) for (i, j), (dx, dy), promotion in game_from_fens(variant, fens)]
+    white, _, black = os.path.basename(os.path.dirname(os.path.abspath(path))).partition("_vs_")
+    name = os.path.basename(path)
+    game = int(name.split("_", 1)[0]) if name.split("_", 1)[0].isdigit() else 0
+    return GameRecord(variant, white, black, result, moves, game=game)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("paths", nargs="+", help="Directories (searched recursively) or files of games saved by autograder.py --save_fens.")
+    parser.add_argument("--variant", default="5x4microchess", help="Variant the games were played in. Default 5x4microchess.")
+    parser.add_argument("--output", required=True, help="Log to append the games to.")
+    args = parser.parse_args()
+
+    with GameLogWriter(args.output) as writer:
+        files = fen_files(args.paths)
+        for file in files:
+            writer.write(record_from_fen_file(file, args.variant))
+    print("Converted {} games into {}".format(len(files), args.output))
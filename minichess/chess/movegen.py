@@ -0,0 +1,485 @@
+import numpy as np
+from numba import njit
+
+U_0 = np.uint64(0)
+U_1 = np.uint64(1)
+U_ALL = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+# Flags of packed moves, see fastchess_utils.pack_move for the layout of the other fields
+MOVE_EN_PASSANT = 1 << 18
+MOVE_CASTLING = 1 << 19
+MOVE_DOUBLE_PUSH = 1 << 20
+
+
+@njit(cache=True)
+def bit(i, j):
+    """Bitboard with only the bit for (i, j) set."""
+    return U_1 << np.uint64(8 * i + j)
+
+
+@njit(cache=True)
+def lowest_bit_index(bitboard):
+    """Flattened index of the lowest set bit. The bitboard must be non-empty."""
+    return int(np.log2(float(bitboard & (~bitboard + U_1))))
+
+
+@njit(cache=True)
+def magic_lookup(occupants, i, j, line_moves, magics, hash_table, shift):
+    """Sliding moves from (i, j) along the lines in line_moves, given the blockers in occupants. Same as Chess.move_magic."""
+    mask = line_moves[i, j]
+    return hash_table[i, j, ((occupants & mask) * magics[i, j]) >> np.uint64(64 - shift)] & mask
+
+
+@njit(cache=True)
+def attacked_squares(bitboards, color, occupants, tables):
+    """Bitboard of all squares attacked by the given color, with occupants as blockers for the sliding pieces."""
+    (diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+     pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+     diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks) = tables
+    attacked = U_0
+    for piece_type in range(6):
+        bb = bitboards[color, piece_type]
+        while bb:
+            f = lowest_bit_index(bb)
+            bb &= bb - U_1
+            i, j = f // 8, f % 8
+            if piece_type == 0:
+                attacked |= pawn_attacks[color, i, j]
+            elif piece_type == 1:
+                attacked |= knight_moves[i, j]
+            elif piece_type == 5:
+                attacked |= king_moves[i, j]
+            else:
+                if piece_type == 2 or piece_type == 4:
+                    attacked |= magic_lookup(occupants, i, j, diagonal_moves, diagonal_magics, diagonal_hash, diagonal_shift)
+                if piece_type == 3 or piece_type == 4:
+                    attacked |= magic_lookup(occupants, i, j, straight_moves, straight_magics, straight_hash, straight_shift)
+    return attacked
+
+
+@njit(cache=True)
+def _pinned_ray(bitboards, turn, all_pieces, king_i, king_j, a_i, a_j, pinned, straight, tables):
+    """The ray a pinned piece may move along, or all bits set if it turns out not to be pinned."""
+    (diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+     pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+     diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks) = tables
+    all_pieces_without_pinned = all_pieces & ~(U_1 << np.uint64(pinned))
+    king_mask = bitboards[turn, 5]
+    attacker_mask = bit(a_i, a_j)
+    if straight:
+        result = (magic_lookup(all_pieces_without_pinned, king_i, king_j, straight_moves, straight_magics, straight_hash, straight_shift) | king_mask) & (
+            magic_lookup(all_pieces_without_pinned, a_i, a_j, straight_moves, straight_magics, straight_hash, straight_shift) | attacker_mask)
+    else:
+        result = (magic_lookup(all_pieces_without_pinned, king_i, king_j, diagonal_moves, diagonal_magics, diagonal_hash, diagonal_shift) | king_mask) & (
+            magic_lookup(all_pieces_without_pinned, a_i, a_j, diagonal_moves, diagonal_magics, diagonal_hash, diagonal_shift) | attacker_mask)
+    if (result & bit(king_i, king_j)) == 0:
+        return U_ALL
+    return result
+
+
+@njit(cache=True)
+def pinned_rays(bitboards, piece_lookup, turn, all_pieces, enemy_pieces, king_i, king_j, rows, cols, tables):
+    """A (rows, cols) matrix restricting the moves of absolutely pinned pieces to their pin-ray, all bits set for the others."""
+    (diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+     pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+     diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks) = tables
+    enemy_turn = 1 - turn
+    king_straights = magic_lookup(all_pieces, king_i, king_j, straight_moves, straight_magics, straight_hash, straight_shift)
+    king_diagonals = magic_lookup(all_pieces, king_i, king_j, diagonal_moves, diagonal_magics, diagonal_hash, diagonal_shift)
+
+    pin_rays = np.full((rows, cols), U_ALL, dtype=np.uint64)
+    squares_to_check = (diagonal_moves[king_i, king_j] | straight_moves[king_i, king_j] | bit(king_i, king_j)) & enemy_pieces
+    while squares_to_check:
+        f = lowest_bit_index(squares_to_check)
+        squares_to_check &= squares_to_check - U_1
+        i, j = f // 8, f % 8
+        piece_at = piece_lookup[enemy_turn, i, j]
+        found = False
+        if (j == king_j or i == king_i) and (piece_at == 3 or piece_at == 4):
+            straight_pinned = magic_lookup(all_pieces, i, j, straight_moves, straight_magics, straight_hash, straight_shift) & king_straights
+            if straight_pinned:
+                pinned = lowest_bit_index(straight_pinned)
+                pin_rays[pinned // 8, pinned % 8] = _pinned_ray(bitboards, turn, all_pieces, king_i, king_j, i, j, pinned, True, tables)
+                found = True
+        if abs(king_j - j) == abs(king_i - i) and not found and (piece_at == 2 or piece_at == 4):
+            diagonal_pinned = magic_lookup(all_pieces, i, j, diagonal_moves, diagonal_magics, diagonal_hash, diagonal_shift) & king_diagonals
+            if diagonal_pinned:
+                pinned = lowest_bit_index(diagonal_pinned)
+                pin_rays[pinned // 8, pinned % 8] = _pinned_ray(bitboards, turn, all_pieces, king_i, king_j, i, j, pinned, False, tables)
+    return pin_rays
+
+
+@njit(cache=True)
+def checkers_of(bitboards, turn, all_pieces, king_i, king_j, tables):
+    """Bitboard of the enemy pieces giving check to the king of the player to move."""
+    (diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+     pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+     diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks) = tables
+    enemy_turn = 1 - turn
+    checkers = knight_moves[king_i, king_j] & bitboards[enemy_turn, 1]
+    checkers |= magic_lookup(all_pieces, king_i, king_j, diagonal_moves, diagonal_magics, diagonal_hash, diagonal_shift) & (bitboards[enemy_turn, 2] | bitboards[enemy_turn, 4])
+    checkers |= magic_lookup(all_pieces, king_i, king_j, straight_moves, straight_magics, straight_hash, straight_shift) & (bitboards[enemy_turn, 3] | bitboards[enemy_turn, 4])
+    checkers |= pawn_attacks[turn, king_i, king_j] & bitboards[enemy_turn, 0]
+    return checkers
+
+
+@njit(cache=True)
+def attackers_to(bitboards, occupants, i, j, tables):
+    """Bitboard of the pieces of both colors in occupants attacking (i, j), with occupants as blockers for the sliding pieces."""
+    (diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+     pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+     diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks) = tables
+    # A pawn of one color attacks (i, j) from where a pawn of the other color on (i, j) would attack
+    attackers = (pawn_attacks[0, i, j] & bitboards[1, 0]) | (pawn_attacks[1, i, j] & bitboards[0, 0])
+    attackers |= knight_moves[i, j] & (bitboards[0, 1] | bitboards[1, 1])
+    attackers |= king_moves[i, j] & (bitboards[0, 5] | bitboards[1, 5])
+    attackers |= magic_lookup(occupants, i, j, diagonal_moves, diagonal_magics, diagonal_hash, diagonal_shift) & (
+        bitboards[0, 2] | bitboards[1, 2] | bitboards[0, 4] | bitboards[1, 4])
+    attackers |= magic_lookup(occupants, i, j, straight_moves, straight_magics, straight_hash, straight_shift) & (
+        bitboards[0, 3] | bitboards[1, 3] | bitboards[0, 4] | bitboards[1, 4])
+    return attackers & occupants
+
+
+@njit(cache=True)
+def attack_maps_kernel(bitboards, piece_lookup, turn, rows, cols, tables):
+    """
+    Everything about which piece attacks what in a position, see Chess.attack_maps.
+
+    :return: (attackers, attacked, pin_rays, checkers): (2, rows, cols) bitboards of the pieces of each color attacking each square,
+        (2,) bitboards of all squares each color attacks, the pin rays of the player to move as in pinned_rays, and the pieces giving
+        check to the player to move.
+    """
+    all_pieces = U_0
+    for piece_type in range(6):
+        all_pieces |= bitboards[0, piece_type] | bitboards[1, piece_type]
+    own_pieces = np.zeros(2, dtype=np.uint64)
+    for color in range(2):
+        for piece_type in range(6):
+            own_pieces[color] |= bitboards[color, piece_type]
+
+    attackers = np.zeros((2, rows, cols), dtype=np.uint64)
+    attacked = np.zeros(2, dtype=np.uint64)
+    for i in range(rows):
+        for j in range(cols):
+            on_square = attackers_to(bitboards, all_pieces, i, j, tables)
+            for color in range(2):
+                attackers[color, i, j] = on_square & own_pieces[color]
+                if attackers[color, i, j]:
+                    attacked[color] |= bit(i, j)
+
+    king = bitboards[turn, 5]
+    if king == 0:
+        return attackers, attacked, np.full((rows, cols), U_ALL, dtype=np.uint64), U_0
+    f = lowest_bit_index(king)
+    king_i, king_j = f // 8, f % 8
+    pin_rays = pinned_rays(bitboards, piece_lookup, turn, all_pieces, own_pieces[1 - turn], king_i, king_j, rows, cols, tables)
+    return attackers, attacked, pin_rays, attackers[1 - turn, king_i, king_j]
+
+
+@njit(cache=True)
+def see_kernel(bitboards, piece_lookup, turn, move, piece_values, tables):
+    """
+    Static exchange evaluation: the material the player to move wins with the packed move, if both sides then keep capturing
+    on its target square with their least valuable piece as long as that pays off. Sliding pieces behind a capturing piece join
+    in (x-rays) since attackers are recomputed without the pieces that already captured. Pins are ignored, and a king capture
+    into an attacked square comes out as losing the king.
+    """
+    promotion_masks = tables[15]
+    origin, target, promotion = move & 63, (move >> 6) & 63, ((move >> 12) & 7) - 1
+    i, j, ti, tj = origin // 8, origin % 8, target // 8, target % 8
+    occupants = U_0
+    for color in range(2):
+        for piece_type in range(6):
+            occupants |= bitboards[color, piece_type]
+
+    gain = np.zeros(34, dtype=np.int64)
+    moved = piece_lookup[turn, i, j]
+    captured = piece_lookup[1 - turn, ti, tj]
+    if captured != -1:
+        gain[0] = piece_values[captured]
+    elif moved == 0 and j != tj:
+        # En passant, the captured pawn is next to the origin
+        gain[0] = piece_values[0]
+        occupants &= ~bit(i, tj)
+    on_target = piece_values[moved]
+    if promotion != -1:
+        gain[0] += piece_values[promotion] - piece_values[0]
+        on_target = piece_values[promotion]
+    occupants &= ~bit(i, j)
+
+    side = 1 - turn
+    d = 0
+    while True:
+        attackers = attackers_to(bitboards, occupants, ti, tj, tables)
+        piece_type = 0
+        least = U_0
+        while piece_type < 6:
+            least = attackers & bitboards[side, piece_type]
+            if least:
+                break
+            piece_type += 1
+        if not least:
+            break
+        d += 1
+        gain[d] = on_target - gain[d - 1]
+        on_target = piece_values[piece_type]
+        if piece_type == 0 and bit(ti, tj) & promotion_masks[side]:
+            gain[d] += piece_values[4] - piece_values[0]
+            on_target = piece_values[4]
+        occupants &= ~(least & (~least + U_1))
+        side = 1 - side
+    # Either side may stop capturing when continuing would lose material
+    while d > 0:
+        gain[d - 1] = -max(-gain[d - 1], gain[d])
+        d -= 1
+    return gain[0]
+
+
+@njit(cache=True)
+def _en_passant_exposes_king(bitboards, turn, all_pieces, king_i, king_j, i, j, en_passant_i, en_passant_j, tables):
+    """
+    Whether the pawn on (i, j) taking en passant would leave its king attacked by a sliding piece. The capture empties two
+    squares of the pawns' rank at once, so a rook or queen on that rank can reach the king although neither pawn is pinned.
+    """
+    (diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+     pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+     diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks) = tables
+    enemy_turn = 1 - turn
+    # The captured pawn stands next to the capturing one, on the file of the en-passant square
+    occupants = (all_pieces & ~bit(i, j) & ~bit(i, en_passant_j)) | bit(en_passant_i, en_passant_j)
+    straights = magic_lookup(occupants, king_i, king_j, straight_moves, straight_magics, straight_hash, straight_shift)
+    diagonals = magic_lookup(occupants, king_i, king_j, diagonal_moves, diagonal_magics, diagonal_hash, diagonal_shift)
+    return ((straights & (bitboards[enemy_turn, 3] | bitboards[enemy_turn, 4])) |
+            (diagonals & (bitboards[enemy_turn, 2] | bitboards[enemy_turn, 4]))) != 0
+
+
+@njit(cache=True)
+def legal_moves_kernel(bitboards, piece_lookup, turn, castling_rights, has_en_passant, en_passant_i, en_passant_j, tables):
+    """
+    Compiled version of Chess.legal_moves, working directly on the raw position arrays.
+    Call generate_legal_moves from Python, this takes the tables as one tuple which is only cheap to pass between compiled functions.
+
+    :param NDArray[uint64] bitboards: (2, 6) bitboards of the position.
+    :param NDArray[int8] piece_lookup: (2, rows, cols) piece types per square, -1 where empty.
+    :param int turn: Player to move.
+    :param NDArray[uint8] castling_rights: (2, 2) castling rights per color and side.
+    :param bool has_en_passant: If en-passant is possible this move.
+    :param int en_passant_i: Rank of the en-passant square.
+    :param int en_passant_j: File of the en-passant square.
+    :param tuple tables: Magic and attack tables of the variant, in the order of Chess.move_tables.
+    :return: (legal_moves, promotions, has_legal_moves, any_checkers), the first two as (rows, cols) matrices of bitboards.
+    """
+    (diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+     pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+     diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks) = tables
+    rows, cols = piece_lookup.shape[1], piece_lookup.shape[2]
+    enemy_turn = 1 - turn
+
+    my_pieces = U_0
+    enemy_pieces = U_0
+    for piece_type in range(6):
+        my_pieces |= bitboards[turn, piece_type]
+        enemy_pieces |= bitboards[enemy_turn, piece_type]
+    all_pieces = my_pieces | enemy_pieces
+
+    # Squares that are dangerous for the king, looking through the king itself
+    king_danger_squares = attacked_squares(bitboards, enemy_turn, all_pieces & ~bitboards[turn, 5], tables)
+    king_f = lowest_bit_index(bitboards[turn, 5])
+    king_i, king_j = king_f // 8, king_f % 8
+    king_targets = (king_moves[king_i, king_j] & ~king_danger_squares) & ~my_pieces
+
+    legal_moves = np.zeros((rows, cols), dtype=np.uint64)
+    promotions = np.zeros((rows, cols), dtype=np.uint64)
+
+    checkers = checkers_of(bitboards, turn, all_pieces, king_i, king_j, tables)
+    if checkers & (checkers - U_1):
+        # Double check, only the king can move
+        legal_moves[king_i, king_j] = king_targets
+        return legal_moves, promotions, king_targets != 0, True
+
+    capture_mask = U_ALL
+    en_passant_capture_mask = U_0
+    push_mask = U_ALL
+    if checkers != 0:
+        capture_mask = checkers
+        f = lowest_bit_index(checkers)
+        i, j = f // 8, f % 8
+        piece_at = piece_lookup[enemy_turn, i, j]
+        if piece_at == 0 and has_en_passant:
+            en_passant_capture_mask |= bit(en_passant_i, en_passant_j)
+        if piece_at == 0 or piece_at == 1:
+            push_mask = U_0
+        else:
+            intersections = U_0
+            if piece_at == 2 or (piece_at == 4 and not (king_i == i or king_j == j)):
+                intersections |= magic_lookup(all_pieces, i, j, diagonal_moves, diagonal_magics, diagonal_hash, diagonal_shift) & magic_lookup(
+                    all_pieces, king_i, king_j, diagonal_moves, diagonal_magics, diagonal_hash, diagonal_shift)
+            if piece_at == 3 or (piece_at == 4 and (king_i == i or king_j == j)):
+                intersections |= magic_lookup(all_pieces, i, j, straight_moves, straight_magics, straight_hash, straight_shift) & magic_lookup(
+                    all_pieces, king_i, king_j, straight_moves, straight_magics, straight_hash, straight_shift)
+            intersections &= (~bitboards[turn, 5] | ~checkers)
+            push_mask = intersections
+
+    pin_masks = pinned_rays(bitboards, piece_lookup, turn, all_pieces, enemy_pieces, king_i, king_j, rows, cols, tables)
+
+    # Whether each pawn may actually take en passant is checked below, see _en_passant_exposes_king
+    en_passant_moves = U_0
+    if has_en_passant:
+        en_passant_moves = bit(en_passant_i, en_passant_j)
+
+    has_legal_moves = False
+    bb = my_pieces
+    while bb:
+        f = lowest_bit_index(bb)
+        bb &= bb - U_1
+        i, j = f // 8, f % 8
+        moves_to_make = U_0
+        piece_at = piece_lookup[turn, i, j]
+        if piece_at == 0:
+            moves_to_make |= pawn_attacks[turn, i, j] & enemy_pieces
+            if pawn_attacks[turn, i, j] & en_passant_moves and not _en_passant_exposes_king(
+                    bitboards, turn, all_pieces, king_i, king_j, i, j, en_passant_i, en_passant_j, tables):
+                moves_to_make |= en_passant_moves
+            single_pawn_moves = pawn_moves_single[turn, i, j] & ~all_pieces
+            moves_to_make |= single_pawn_moves
+            if single_pawn_moves != 0:
+                moves_to_make |= pawn_moves_double[turn, i, j] & ~all_pieces
+            promotions[i, j] |= moves_to_make & promotion_masks[turn]
+        elif piece_at == 1:
+            moves_to_make |= knight_moves[i, j] & ~my_pieces
+        elif piece_at == 5:
+            moves_to_make |= king_targets
+            back_rank = 0 if turn == 0 else rows - 1
+            for side in range(2):
+                rook_j = 0 if side == 0 else cols - 1
+                if (bitboards[turn, 3] & bit(back_rank, rook_j)) and castling_rights[turn, side] and \
+                        (castling_attack_masks[turn, side] & king_danger_squares) == 0 and (castling_empty_masks[turn, side] & all_pieces) == 0:
+                    moves_to_make |= bit(i, j - 2 if side == 0 else j + 2)
+        else:
+            if piece_at == 2 or piece_at == 4:
+                moves_to_make |= magic_lookup(all_pieces, i, j, diagonal_moves, diagonal_magics, diagonal_hash, diagonal_shift) & ~my_pieces
+            if piece_at == 3 or piece_at == 4:
+                moves_to_make |= magic_lookup(all_pieces, i, j, straight_moves, straight_magics, straight_hash, straight_shift) & ~my_pieces
+
+        # Remove moves that don't deal with check if necessary
+        if piece_at == 0:
+            moves_to_make &= (capture_mask | en_passant_capture_mask | push_mask)
+        elif piece_at != 5:
+            moves_to_make &= (capture_mask | push_mask)
+        # If it's pinned, restrict the moves to the pinned ray
+        moves_to_make &= pin_masks[i, j]
+        legal_moves[i, j] = moves_to_make
+        if moves_to_make:
+            has_legal_moves = True
+
+    return legal_moves, promotions, has_legal_moves, checkers != 0
+
+
+@njit(cache=True)
+def _bit_count(bitboard):
+    count = 0
+    while bitboard:
+        bitboard &= bitboard - U_1
+        count += 1
+    return count
+
+
+@njit(cache=True)
+def packed_moves_kernel(bitboards, piece_lookup, turn, castling_rights, has_en_passant, en_passant_i, en_passant_j, tables):
+    """
+    Same as legal_moves_kernel, but also gives the moves as a flat int32 array, packed as described in fastchess_utils.pack_move.
+    Besides origin, target and promotion every move carries the captured piece and the en-passant, castling and double push flags.
+    The moves come in the same order as piece_matrix_to_legal_moves gives them.
+
+    :return: (packed_moves, legal_moves, promotions, has_legal_moves, any_checkers)
+    """
+    legal_moves, promotions, has_legal_moves, any_checkers = legal_moves_kernel(
+        bitboards, piece_lookup, turn, castling_rights, has_en_passant, en_passant_i, en_passant_j, tables)
+    rows, cols = legal_moves.shape
+    enemy_turn = 1 - turn
+
+    total = 0
+    for i in range(rows):
+        for j in range(cols):
+            if legal_moves[i, j]:
+                total += _bit_count(legal_moves[i, j]) + 3 * _bit_count(legal_moves[i, j] & promotions[i, j])
+
+    packed = np.empty(total, dtype=np.int32)
+    n = 0
+    for i in range(rows):
+        for j in range(cols):
+            bb = legal_moves[i, j]
+            piece_at = piece_lookup[turn, i, j]
+            while bb:
+                f = lowest_bit_index(bb)
+                bb &= bb - U_1
+                ti, tj = f // 8, f % 8
+                move = (8 * i + j) | (f << 6)
+                captured = piece_lookup[enemy_turn, ti, tj]
+                if piece_at == 0 and has_en_passant and ti == en_passant_i and tj == en_passant_j:
+                    captured = 0
+                    move |= MOVE_EN_PASSANT
+                elif piece_at == 0 and abs(ti - i) == 2:
+                    move |= MOVE_DOUBLE_PUSH
+                elif piece_at == 5 and abs(tj - j) == 2:
+                    move |= MOVE_CASTLING
+                move |= (captured + 1) << 15
+                if promotions[i, j] & (U_1 << np.uint64(f)):
+                    for promotion in range(1, 5):
+                        packed[n] = move | ((promotion + 1) << 12)
+                        n += 1
+                else:
+                    packed[n] = move
+                    n += 1
+    return packed, legal_moves, promotions, has_legal_moves, any_checkers
+
+
+# Entry points for calling from Python. Numba often falls back to slow, interpreted type inference for a tuple
+# of arrays, so these take the tables of Chess.move_tables as separate arguments and only build the tuple once compiled.
+
+@njit(cache=True)
+def generate_legal_moves(bitboards, piece_lookup, turn, castling_rights, has_en_passant, en_passant_i, en_passant_j,
+                         diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+                         pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+                         diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks):
+    """See legal_moves_kernel. Call as generate_legal_moves(<position arrays and state>, *chess.move_tables)."""
+    tables = (diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+              pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+              diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks)
+    return legal_moves_kernel(bitboards, piece_lookup, turn, castling_rights, has_en_passant, en_passant_i, en_passant_j, tables)
+
+
+@njit(cache=True)
+def generate_packed_moves(bitboards, piece_lookup, turn, castling_rights, has_en_passant, en_passant_i, en_passant_j,
+                          diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+                          pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+                          diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks):
+    """See packed_moves_kernel. Call as generate_packed_moves(<position arrays and state>, *chess.move_tables)."""
+    tables = (diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+              pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+              diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks)
+    return packed_moves_kernel(bitboards, piece_lookup, turn, castling_rights, has_en_passant, en_passant_i, en_passant_j, tables)
+
+
+@njit(cache=True)
+def static_exchange(bitboards, piece_lookup, turn, move, piece_values,
+                    diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+                    pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+                    diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks):
+    """See see_kernel. Call as static_exchange(<position arrays and state>, move, piece_values, *chess.move_tables)."""
+    tables = (diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+              pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+              diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks)
+    return see_kernel(bitboards, piece_lookup, turn, move, piece_values, tables)
+
+
+@njit(cache=True)
+def generate_attack_maps(bitboards, piece_lookup, turn, rows, cols,
+                         diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+                         pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+                         diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks):
+    """See attack_maps_kernel. Call as generate_attack_maps(<position arrays and state>, rows, cols, *chess.move_tables)."""
+    tables = (diagonal_hash, diagonal_magics, diagonal_shift, straight_hash, straight_magics, straight_shift,
+              pawn_moves_single, pawn_moves_double, pawn_attacks, knight_moves, king_moves,
+              diagonal_moves, straight_moves, castling_empty_masks, castling_attack_masks, promotion_masks)
+    return attack_maps_kernel(bitboards, piece_lookup, turn, rows, cols, tables)
@@ -0,0 +1,218 @@
+"""
+Perft (move path enumeration) for checking the move generator, and a nodes/sec benchmark.
+
+Run from the repository root:
+
+    python -m minichess.chess.perft
+    python -m minichess.chess.perft --variants 5x4microchess --depth 5
+    python -m minichess.chess.perft --variants 5x4microchess --batch_games 10000
+"""
+import json
+import os
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from .batch import ONGOING, BatchChess
+from .chess_helpers import get_initial_chess_object
+from .fastchess import Chess
+from .fastchess_utils import chess_move_to_uci, piece_matrix_to_legal_moves, unpack_move
+
+# (name, variant, FEN of the position to measure)
+BENCHMARK_POSITIONS = [
+    ("5x4 start", "5x4microchess", "knbr/p3/4/3P/RBNK w - - 0 1"),
+    ("5x4 in check", "5x4microchess", "1k1r/p3/bn1P/N1RK/1B2 w - - 11 7"),
+    ("5x4 captures", "5x4microchess", "2bB/pk2/R3/nK1P/2N1 w - - 3 6"),
+    ("5x4 promotion", "5x4microchess", "1kbB/p2P/R1n1/1K2/2N1 w - - 1 8"),
+    ("8x8 start", "8x8standard", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"),
+    ("8x8 Kiwipete", "8x8standard", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"),
+    # Standard perft position 3, with en-passant captures that would expose the king along the rank
+    ("8x8 position 3", "8x8standard", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1"),
+]
+
+# Known node counts of benchmark positions, by depth starting at 1. The 8x8 ones are the published values of the standard perft positions
+PERFT_REFERENCE = {
+    "5x4 start": [11, 95, 805, 6877, 61255, 549943],
+    "8x8 start": [20, 400, 8902, 197281],
+    "8x8 Kiwipete": [48, 2039, 97862],
+    "8x8 position 3": [14, 191, 2812, 43238, 674624],
+}
+
+DEFAULT_DEPTHS = {
+    "5x4microchess": 5,
+    "8x8standard": 3,
+}
+
+
+def count_moves(legal_moves, promotions):
+    """Number of moves in a legal move matrix, counting each promotion piece as its own move."""
+    total = 0
+    for board, promotion in zip(legal_moves.flat, promotions.flat):
+        if board:
+            total += bin(int(board)).count("1") + 3 * bin(int(board & promotion)).count("1")
+    return total
+
+
+def perft(chess: Chess, depth: int):
+    """
+    Counts the leaf nodes of the legal move tree of the given depth. Draw rules are not applied, as is customary for perft.
+
+    :param Chess chess: Position to start from. It is restored before returning.
+    :param int depth: Plies to look ahead.
+    :return int: Number of move paths of the given length.
+    """
+    if depth == 0:
+        return 1
+    legal_moves, promotions = chess.legal_moves()
+    if depth == 1:
+        return count_moves(legal_moves, promotions)
+    nodes = 0
+    for (i, j), (dx, dy), promotion in piece_matrix_to_legal_moves(legal_moves, promotions):
+        undo = chess.make_move(i, j, dx, dy, promotion)
+        nodes += perft(chess, depth - 1)
+        chess.unmake_move(undo)
+    return nodes
+
+
+def divide(chess: Chess, depth: int):
+    """
+    Perft split per root move, for tracking down which move a node count difference comes from.
+
+    :return dict: Node count of the subtree below every legal move, keyed by the move in UCI.
+    """
+    result = {}
+    for move in piece_matrix_to_legal_moves(*chess.legal_moves()):
+        (i, j), (dx, dy), promotion = move
+        undo = chess.make_move(i, j, dx, dy, promotion)
+        result[chess_move_to_uci(move, chess.dims)] = perft(chess, depth - 1)
+        chess.unmake_move(undo)
+    return result
+
+
+def benchmark(variants=None, depth=None):
+    """
+    Runs perft on the benchmark positions and measures the node rate. Node counts are checked against PERFT_REFERENCE
+    where it has the depth, so a faster move generator can't go unnoticed if it is also a wrong one.
+
+    :param list variants: Only use positions of these variants, defaults to all of them.
+    :param int depth: Perft depth, defaults to DEFAULT_DEPTHS for the variant.
+    :return dict: Node counts, timings and nodes/sec per position, and in total.
+    :raises AssertionError: If a node count differs from its reference, after all positions have been run.
+    """
+    results = []
+    for name, variant, fen in BENCHMARK_POSITIONS:
+        if variants is not None and variant not in variants:
+            continue
+        chess = Chess.from_fen(fen, variant)
+        d = depth if depth is not None else DEFAULT_DEPTHS[variant]
+        # Make sure compilation isn't part of the measurement
+        perft(chess.copy(), 1)
+
+        start = time.perf_counter()
+        nodes = perft(chess, d)
+        seconds = time.perf_counter() - start
+        reference = PERFT_REFERENCE.get(name, [])
+        results.append({
+            "name": name,
+            "variant": variant,
+            "fen": fen,
+            "depth": d,
+            "nodes": nodes,
+            "expected": reference[d - 1] if d <= len(reference) else None,
+            "seconds": seconds,
+            "nodes_per_second": nodes / seconds if seconds > 0 else 0.0,
+        })
+        expected = results[-1]["expected"]
+        check = "" if expected is None else " ok" if nodes == expected else f" WRONG, expected {expected}"
+        print(f"{name:<16} depth {d}: {nodes:>10} nodes in {seconds:8.3f} s ({results[-1]['nodes_per_second']:,.0f} nodes/s){check}")
+
+    wrong = [r for r in results if r["expected"] is not None and r["nodes"] != r["expected"]]
+    if wrong:
+        raise AssertionError("Wrong perft node counts: " + ", ".join(
+            f"{r['name']} depth {r['depth']}: {r['nodes']} instead of {r['expected']}" for r in wrong))
+
+    total_nodes = sum(r["nodes"] for r in results)
+    total_seconds = sum(r["seconds"] for r in results)
+    return {
+        "positions": results,
+        "total_nodes": total_nodes,
+        "total_seconds": total_seconds,
+        "nodes_per_second": total_nodes / total_seconds if total_seconds > 0 else 0.0,
+    }
+
+
+def _play_batch(variant: str, games: int, plies: int, seed: int):
+    """Random games in lockstep on a BatchChess, returns the number of moves made."""
+    batch = BatchChess.initial(variant, games)
+    rng = np.random.default_rng(seed)
+    moves_made = 0
+    for _ in range(plies):
+        ongoing = batch.game_result() == ONGOING
+        if not ongoing.any():
+            break
+        moves_made += int(ongoing.sum())
+        batch.make_move(batch.random_moves(rng))
+    return moves_made
+
+
+def _play_single(variant: str, games: int, plies: int, seed: int):
+    """The same as _play_batch, with every game on its own Chess object and stepped one at a time."""
+    boards = [get_initial_chess_object(variant) for _ in range(games)]
+    rng = np.random.default_rng(seed)
+    moves_made = 0
+    for _ in range(plies):
+        ongoing = [chess for chess in boards if chess.game_result() is None]
+        if not ongoing:
+            break
+        moves_made += len(ongoing)
+        for chess in ongoing:
+            moves = chess.legal_move_array()
+            (i, j), (dx, dy), promotion = unpack_move(int(moves[rng.integers(len(moves))]))
+            chess.make_move(i, j, dx, dy, promotion)
+    return moves_made
+
+
+def batch_benchmark(variant: str = "5x4microchess", games: int = 1000, plies: int = 200, seed: int = 0):
+    """
+    Plays random games from the initial position with BatchChess, and the same number of games on separate Chess objects,
+    and compares how many moves per second each makes. A move includes the move generation and result check before it.
+
+    :param int games: Number of games played at once.
+    :param int plies: Most plies played per game.
+    :return dict: Moves made, timings and moves/sec of both, and the speedup of the batch.
+    """
+    # Make sure compilation isn't part of the measurement
+    _play_batch(variant, 2, 2, seed)
+    _play_single(variant, 2, 2, seed)
+
+    result = {"variant": variant, "games": games, "plies": plies}
+    for name, play in (("batch", _play_batch), ("single", _play_single)):
+        start = time.perf_counter()
+        moves_made = play(variant, games, plies, seed)
+        seconds = time.perf_counter() - start
+        result[name] = {"moves": moves_made, "seconds": seconds, "moves_per_second": moves_made / seconds if seconds > 0 else 0.0}
+    result["speedup"] = result["batch"]["moves_per_second"] / result["single"]["moves_per_second"]
+    for name, label in (("batch", "BatchChess"), ("single", "Chess")):
+        r = result[name]
+        print(f"{label:<10} {games} games of {variant}: {r['moves']:>9} moves in {r['seconds']:8.3f} s ({r['moves_per_second']:,.0f} moves/s)")
+    print(f"BatchChess speedup: {result['speedup']:.1f}x")
+    return result
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--variants", nargs="*", default=None, help="Variants to benchmark, e.g. 5x4microchess. Default all.")
+    parser.add_argument("--depth", type=int, default=None, help="Perft depth. Default depends on the variant.")
+    parser.add_argument("--batch_games", type=int, default=1000, help="Games BatchChess is benchmarked with on 5x4microchess, 0 to skip it. Default 1000.")
+    parser.add_argument("--output", default="results/perft_benchmark.json", help="Where to write the JSON report.")
+    args = parser.parse_args()
+
+    report = benchmark(args.variants, args.depth)
+    print(f"Total: {report['total_nodes']} nodes in {report['total_seconds']:.3f} s ({report['nodes_per_second']:,.0f} nodes/s)")
+    if args.batch_games > 0 and (args.variants is None or "5x4microchess" in args.variants):
+        report["batch"] = batch_benchmark("5x4microchess", args.batch_games)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
@@ -0,0 +1,483 @@
+"""
+Endgame tablebase for 5x4 microchess: the exact result of every position with both kings and at most a few other pieces.
+
+Because of the draw rule in Chess.game_result (a draw once ply_count_without_adv exceeds 20), whether a position is won
+depends on the counter, which resets on every capture and pawn move. The table therefore stores, per position with the
+side to move, one signed byte v:
+
+    v > 0   won for the side to move if ply_count_without_adv < v, drawn otherwise
+    v < 0   lost for the side to move if ply_count_without_adv < -v, drawn otherwise
+    v = 0   drawn whatever the counter
+
+Equivalently, 21 - |v| is the number of plies with best play until the game is decided: the mate itself, or a capture
+or pawn move into a position that is won for the side making it.
+
+The values are computed by retrograde analysis per material signature (the non-king pieces on the board), from the
+fewest pieces up. Captures and promotions lead to signatures that are already done, and pawn moves to positions of
+the same signature with a pawn further up the board, so those are computed first.
+
+Build the table once, from the repository root:
+
+    python -m minichess.chess.tablebase --pieces 2
+
+The shipped table covers up to 2 pieces besides the kings, which is less than all endings of the variant. Every signature
+gets a dense table of one byte per (side to move, squares) index, so 3 pieces would take 1.4 GB while being built and loaded.
+Packing the values wouldn't change that much, as v takes 43 values (6 bits). Going further needs a smaller index instead,
+e.g. one that skips illegal placements and identical pieces out of order, which build_tablebase doesn't have.
+"""
+import os
+import time
+from argparse import ArgumentParser
+from itertools import combinations_with_replacement
+
+import numpy as np
+from numba import njit
+
+from .chess_helpers import get_initial_chess_object
+from .fastchess import Chess
+from .fastchess_utils import unpack_move
+from .movegen import U_0, bit, checkers_of, lowest_bit_index, packed_moves_kernel
+
+# The draw rule of Chess.game_result: the game is drawn once more than this many plies passed without a capture or pawn move
+MAX_PLIES_WITHOUT_ADV = 20
+
+DEFAULT_PATH = "minichess/tablebases/5x4microchess.npz"
+
+# Tablebases loaded by Tablebase.load_default, by path
+_LOADED = {}
+
+# Cost of a position that isn't decided within the draw rule
+_UNDECIDED = 127
+
+# Per-position flags used while building
+_EXIT_WIN = 1
+_ESCAPE = 2
+_MATED = 4
+_HAS_MOVES = 8
+
+
+def piece_code(color, piece_type):
+    """Code of a non-king piece in a material signature: 1-5 for black pawn to queen, 6-10 for white."""
+    return 1 + 5 * color + piece_type
+
+
+def signature_key(codes):
+    """Key of a material signature, given as piece codes in ascending order. Different signatures have different keys."""
+    key = 0
+    for k, code in enumerate(codes):
+        key += code * 11 ** k
+    return key
+
+
+def is_insufficient(codes):
+    """Same as Chess.insufficient_material, for a material signature."""
+    for color in [0, 1]:
+        types = [(code - 1) % 5 for code in codes if (code - 1) // 5 == color]
+        if any(t in (0, 3, 4) for t in types) or len(types) > 1:
+            return False
+    return True
+
+
+@njit(cache=True)
+def _setup(codes, squares, rows, cols, bitboards, piece_lookup):
+    """
+    Puts the kings (squares[0] white, squares[1] black) and the pieces of the signature on the board.
+    Returns False for positions that can't occur, or that are stored under another index (identical pieces out of order).
+    """
+    bitboards[:, :] = U_0
+    piece_lookup[:, :, :] = -1
+    for k in range(len(codes) + 2):
+        if k < 2:
+            color, piece_type = 1 - k, 5
+        else:
+            color, piece_type = (codes[k - 2] - 1) // 5, (codes[k - 2] - 1) % 5
+            if k > 2 and codes[k - 3] == codes[k - 2] and squares[k - 1] >= squares[k]:
+                return False
+        i, j = squares[k] // cols, squares[k] % cols
+        if piece_lookup[0, i, j] != -1 or piece_lookup[1, i, j] != -1:
+            return False
+        if piece_type == 0 and (i == 0 or i == rows - 1):
+            return False
+        bitboards[color, piece_type] |= bit(i, j)
+        piece_lookup[color, i, j] = piece_type
+    return True
+
+
+@njit(cache=True)
+def _decode(index, n, size_squares, squares):
+    """Splits a table index into the side to move (returned) and the squares of the kings and pieces."""
+    turn = index % 2
+    index //= 2
+    for k in range(n + 2):
+        squares[k] = index % size_squares
+        index //= size_squares
+    return turn
+
+
+@njit(cache=True)
+def _encode(turn, n, size_squares, squares):
+    index = 0
+    for k in range(n + 1, -1, -1):
+        index = index * size_squares + squares[k]
+    return 2 * index + turn
+
+
+@njit(cache=True)
+def _canonical_index(turn, codes, squares, n, size_squares, sig_of_key):
+    """
+    Sorts the pieces of a position (kings first in squares, then the pieces with their codes) into the order the
+    tables use, and gives the signature id and index of the position.
+    """
+    # Insertion sort on (code, square), there are only a few pieces
+    for a in range(1, n):
+        b = a
+        while b > 0 and (codes[b - 1] > codes[b] or (codes[b - 1] == codes[b] and squares[b + 1] > squares[b + 2])):
+            codes[b - 1], codes[b] = codes[b], codes[b - 1]
+            squares[b + 1], squares[b + 2] = squares[b + 2], squares[b + 1]
+            b -= 1
+    key = 0
+    power = 1
+    for k in range(n):
+        key += codes[k] * power
+        power *= 11
+    if key >= len(sig_of_key):
+        return -1, 0
+    return sig_of_key[key], _encode(turn, n, size_squares, squares)
+
+
+@njit(cache=True)
+def _level(codes, squares, rows, cols):
+    """How far the pawns have advanced in total. Every pawn move raises this by one."""
+    level = 0
+    for k in range(len(codes)):
+        if (codes[k] - 1) % 5 == 0:
+            i = squares[k + 2] // cols
+            level += rows - 1 - i if codes[k] > 5 else i
+    return level
+
+
+@njit(cache=True)
+def _child(turn, codes, squares, n, move, rows, cols, size_squares, sig_of_key, child_codes, child_squares):
+    """Signature id and index of the position after a packed move, and whether the move resets the draw counter."""
+    f_from, f_to = move & 63, (move >> 6) & 63
+    promotion = ((move >> 12) & 7) - 1
+    captured = ((move >> 15) & 7) - 1
+    s_from = (f_from // 8) * cols + f_from % 8
+    s_to = (f_to // 8) * cols + f_to % 8
+
+    child_squares[0], child_squares[1] = squares[0], squares[1]
+    zeroing = captured != -1
+    m = 0
+    for k in range(n):
+        color = (codes[k] - 1) // 5
+        if color != turn and squares[k + 2] == s_to:
+            # Captured
+            continue
+        code = codes[k]
+        square = squares[k + 2]
+        if color == turn and square == s_from:
+            square = s_to
+            if (code - 1) % 5 == 0:
+                zeroing = True
+                if promotion != -1:
+                    code = 1 + 5 * turn + promotion
+        child_codes[m] = code
+        child_squares[m + 2] = square
+        m += 1
+    if squares[1 - turn] == s_from:
+        child_squares[1 - turn] = s_to
+    sig, index = _canonical_index(1 - turn, child_codes, child_squares, m, size_squares, sig_of_key)
+    return sig, index, zeroing
+
+
+@njit(cache=True)
+def _build_signature(values, offsets, sig_of_key, sig, codes, rows, cols, tables):
+    """Fills in the table of one material signature, all signatures its captures and promotions lead to must be done."""
+    n = len(codes)
+    size_squares = rows * cols
+    size = 2 * size_squares ** (n + 2)
+    base = offsets[sig]
+
+    squares = np.zeros(n + 2, dtype=np.int64)
+    child_codes = np.zeros(max(n, 1), dtype=np.int64)
+    child_squares = np.zeros(n + 2, dtype=np.int64)
+    bitboards = np.zeros((2, 6), dtype=np.uint64)
+    piece_lookup = np.full((2, rows, cols), -1, dtype=np.int8)
+    castling_rights = np.zeros((2, 2), dtype=np.uint8)
+    king_moves = tables[10]
+
+    win_cost = np.full(size, _UNDECIDED, dtype=np.int8)
+    loss_cost = np.full(size, _UNDECIDED, dtype=np.int8)
+
+    max_level = 0
+    for k in range(n):
+        if (codes[k] - 1) % 5 == 0:
+            max_level += rows - 2
+
+    for level in range(max_level, -1, -1):
+        # Legal positions of this level, with their flags and the positions their other moves lead to
+        members = np.empty(16, dtype=np.int64)
+        flags = np.empty(16, dtype=np.int8)
+        child_start = np.zeros(17, dtype=np.int64)
+        children = np.empty(256, dtype=np.int64)
+        m = 0
+        c = 0
+        for index in range(size):
+            turn = _decode(index, n, size_squares, squares)
+            if not _setup(codes, squares, rows, cols, bitboards, piece_lookup):
+                continue
+            if _level(codes, squares, rows, cols) != level:
+                continue
+            # The side that just moved can't be in check
+            wk_i, wk_j = squares[0] // cols, squares[0] % cols
+            bk_i, bk_j = squares[1] // cols, squares[1] % cols
+            if king_moves[wk_i, wk_j] & bit(bk_i, bk_j):
+                continue
+            all_pieces = U_0
+            for color in range(2):
+                for piece_type in range(6):
+                    all_pieces |= bitboards[color, piece_type]
+            # squares[0] is the white king, so squares[turn] is the king of the side that just moved
+            enemy_king = squares[turn]
+            if checkers_of(bitboards, 1 - turn, all_pieces, enemy_king // cols, enemy_king % cols, tables):
+                continue
+
+            packed, _, _, _, any_checkers = packed_moves_kernel(bitboards, piece_lookup, turn, castling_rights, False, 0, 0, tables)
+            flag = 0
+            if len(packed) > 0:
+                flag |= _HAS_MOVES
+            elif any_checkers:
+                flag |= _MATED
+
+            if m == len(members):
+                members = np.concatenate((members, np.empty(m, dtype=np.int64)))
+                flags = np.concatenate((flags, np.empty(m, dtype=np.int8)))
+                child_start = np.concatenate((child_start, np.zeros(m, dtype=np.int64)))
+            for move in packed:
+                child_sig, child_index, zeroing = _child(turn, codes, squares, n, move, rows, cols, size_squares, sig_of_key, child_codes, child_squares)
+                if zeroing:
+                    # The counter starts over, so the child's value with a counter of 0 is final
+                    v = values[offsets[child_sig] + child_index]
+                    if v < 0:
+                        flag |= _EXIT_WIN
+                    if v <= 0:
+                        flag |= _ESCAPE
+                else:
+                    if c == len(children):
+                        children = np.concatenate((children, np.empty(c, dtype=np.int64)))
+                    children[c] = child_index
+                    c += 1
+            members[m] = index
+            flags[m] = flag
+            m += 1
+            child_start[m] = c
+
+        # Retrograde analysis on the cost, the number of plies the draw counter has to allow for the win
+        for d in range(MAX_PLIES_WITHOUT_ADV + 1):
+            for k in range(m):
+                index = members[k]
+                flag = flags[k]
+                if d == 0:
+                    if flag & _EXIT_WIN:
+                        win_cost[index] = 0
+                    elif flag & _MATED or (flag & _HAS_MOVES and not flag & _ESCAPE and child_start[k + 1] == child_start[k]):
+                        loss_cost[index] = 0
+                    continue
+                if win_cost[index] == _UNDECIDED:
+                    for x in range(child_start[k], child_start[k + 1]):
+                        if loss_cost[children[x]] == d - 1:
+                            win_cost[index] = d
+                            break
+                if loss_cost[index] == _UNDECIDED and flag & _HAS_MOVES and not flag & _ESCAPE:
+                    worst = 0
+                    for x in range(child_start[k], child_start[k + 1]):
+                        worst = max(worst, win_cost[children[x]] + 1)
+                    if worst <= d:
+                        loss_cost[index] = d
+
+        for k in range(m):
+            index = members[k]
+            if win_cost[index] <= MAX_PLIES_WITHOUT_ADV:
+                values[base + index] = MAX_PLIES_WITHOUT_ADV + 1 - win_cost[index]
+            elif loss_cost[index] <= MAX_PLIES_WITHOUT_ADV:
+                values[base + index] = -(MAX_PLIES_WITHOUT_ADV + 1 - loss_cost[index])
+
+
+@njit(cache=True)
+def probe_value(values, offsets, sig_of_key, bitboards, turn, rows, cols, max_pieces):
+    """
+    Table value (see the module docstring) of a position, or -128 if the table doesn't cover it.
+
+    :param NDArray[uint64] bitboards: (2, 6) bitboards of the position.
+    """
+    size_squares = rows * cols
+    codes = np.zeros(max_pieces + 1, dtype=np.int64)
+    squares = np.zeros(max_pieces + 3, dtype=np.int64)
+    n = 0
+    for color in range(2):
+        for piece_type in range(6):
+            bb = bitboards[color, piece_type]
+            while bb:
+                f = lowest_bit_index(bb)
+                bb &= bb - np.uint64(1)
+                square = (f // 8) * cols + f % 8
+                if piece_type == 5:
+                    squares[1 - color] = square
+                else:
+                    if n == max_pieces:
+                        return -128
+                    codes[n] = 1 + 5 * color + piece_type
+                    squares[n + 2] = square
+                    n += 1
+    sig, index = _canonical_index(turn, codes, squares, n, size_squares, sig_of_key)
+    if sig == -1:
+        return -128
+    return values[offsets[sig] + index]
+
+
+def outcome(value, ply_count_without_adv):
+    """Result for the side to move (1 win, 0 draw, -1 loss) of a position with the given table value and draw counter."""
+    if value > ply_count_without_adv:
+        return 1
+    if -value > ply_count_without_adv:
+        return -1
+    return 0
+
+
+class Tablebase:
+    """
+    Loaded tablebase, probed with Chess objects of the variant it was built for.
+    Positions with castling rights or an en-passant square aren't covered (they can't occur in 5x4 microchess anyway).
+    """
+
+    def __init__(self, values, offsets, sig_of_key, dims, max_pieces):
+        self.values = values
+        self.offsets = offsets
+        self.sig_of_key = sig_of_key
+        self.dims = tuple(dims)
+        self.max_pieces = int(max_pieces)
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH):
+        data = np.load(path)
+        return cls(data["values"], data["offsets"], data["sig_of_key"], data["dims"], data["max_pieces"])
+
+    @classmethod
+    def load_default(cls):
+        """The tablebase at DEFAULT_PATH, loaded once per process. None if it hasn't been built."""
+        if DEFAULT_PATH not in _LOADED:
+            _LOADED[DEFAULT_PATH] = cls.load(DEFAULT_PATH) if os.path.exists(DEFAULT_PATH) else None
+        return _LOADED[DEFAULT_PATH]
+
+    def save(self, path=DEFAULT_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(path, values=self.values, offsets=self.offsets, sig_of_key=self.sig_of_key, dims=np.array(self.dims), max_pieces=self.max_pieces)
+
+    def value(self, chess: Chess):
+        """Table value of the position (see the module docstring), None if it isn't covered."""
+        rows, cols = self.dims
+        if chess.dims[0] != rows or chess.dims[1] != cols:
+            return None
+        v = probe_value(self.values, self.offsets, self.sig_of_key, chess.bitboards, chess.turn, rows, cols, self.max_pieces)
+        # Checked only for covered positions, the search probes far more positions with too many pieces
+        if v == -128 or chess.has_en_passant or chess.castling_rights.any():
+            return None
+        return int(v)
+
+    def probe(self, chess: Chess):
+        """
+        Exact result of the position for the side to move, taking its draw counter into account.
+
+        :return: (result, plies): 1 for a win, 0 for a draw, -1 for a loss, and for wins and losses the number of plies until the game is
+            decided with best play (mate, or a winning capture or pawn move). None if the position isn't covered.
+        """
+        v = self.value(chess)
+        if v is None:
+            return None
+        result = outcome(v, chess.ply_count_without_adv) if chess.ply_count_without_adv <= MAX_PLIES_WITHOUT_ADV else 0
+        return result, (MAX_PLIES_WITHOUT_ADV + 1 - abs(v) if result != 0 else None)
+
+    def best_move(self, chess: Chess):
+        """
+        A move keeping the best result: the quickest win, the longest defence, or any move keeping a draw.
+
+        :return: The move in the ((i, j), (dx, dy), promotion) format of the agents, None if the position isn't covered or has no moves.
+        """
+        if self.probe(chess) is None:
+            return None
+        best, best_score = None, None
+        for packed in chess.legal_move_array().tolist():
+            move = unpack_move(packed)
+            (i, j), (dx, dy), promotion = move
+            undo = chess.make_move(i, j, dx, dy, promotion)
+            result, plies = self.probe(chess)
+            chess.unmake_move(undo)
+            # Our result is the opposite of the child's, win quickly and lose slowly
+            if result == -1:
+                score = 1000 - plies
+            elif result == 1:
+                score = -1000 + plies
+            else:
+                score = 0
+            if best_score is None or score > best_score:
+                best, best_score = move, score
+        return best
+
+
+def material_signatures(max_pieces: int):
+    """All material signatures with up to max_pieces non-king pieces, in the order they have to be built."""
+    signatures = []
+    for n in range(max_pieces + 1):
+        signatures.extend(combinations_with_replacement(range(1, 11), n))
+    # Captures lead to fewer pieces, promotions to fewer pawns
+    return sorted(signatures, key=lambda codes: (len(codes), sum((code - 1) % 5 == 0 for code in codes)))
+
+
+def build_tablebase(max_pieces: int = 2, variant: str = "5x4microchess", verbose: bool = True):
+    """
+    Computes the tablebase of all positions with both kings and up to max_pieces other pieces.
+    The tables take 2 * 20^(2 + n) bytes for a signature of n pieces: about 18 MB in total for 2 pieces, and 1.4 GB for 3.
+
+    :return Tablebase:
+    """
+    chess = get_initial_chess_object(variant)
+    rows, cols = chess.dims
+    size_squares = rows * cols
+    signatures = material_signatures(max_pieces)
+
+    sig_of_key = np.full(signature_key([10] * max_pieces) + 1, -1, dtype=np.int64)
+    offsets = np.zeros(len(signatures), dtype=np.int64)
+    total = 0
+    for sig, codes in enumerate(signatures):
+        sig_of_key[signature_key(codes)] = sig
+        offsets[sig] = total
+        total += 2 * size_squares ** (len(codes) + 2)
+    values = np.zeros(total, dtype=np.int8)
+
+    start = time.perf_counter()
+    for sig, codes in enumerate(signatures):
+        if is_insufficient(codes):
+            continue
+        _build_signature(values, offsets, sig_of_key, sig, np.array(codes, dtype=np.int64), rows, cols, chess.move_tables)
+        if verbose:
+            print("{:>3}/{}: {:<24} {:8.1f} s".format(sig + 1, len(signatures), signature_name(codes), time.perf_counter() - start))
+    return Tablebase(values, offsets, sig_of_key, chess.dims, max_pieces)
+
+
+def signature_name(codes):
+    """E.g. KRvKP for a white rook against a black pawn."""
+    letters = "PNBRQ"
+    white = "".join(letters[(code - 1) % 5] for code in sorted(codes, reverse=True) if code > 5)
+    black = "".join(letters[(code - 1) % 5] for code in sorted(codes, reverse=True) if code <= 5)
+    return "K{}vK{}".format(white, black)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pieces", type=int, default=2, help="Most non-king pieces on the board. Default 2.")
+    parser.add_argument("--output", default=DEFAULT_PATH, help="Where to save the tablebase.")
+    args = parser.parse_args()
+
+    tablebase = build_tablebase(args.pieces)
+    tablebase.save(args.output)
+    print("Saved to {}".format(args.output))
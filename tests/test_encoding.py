@@ -0,0 +1,28 @@
+import numpy as np
+
+from minichess.chess.chess_helpers import get_initial_chess_object
+from minichess.chess.encoding import encode_positions
+from minichess.chess.fastchess_utils import unpack_move
+
+
+def _positions(count, seed=0):
+    rng = np.random.default_rng(seed)
+    chess = get_initial_chess_object("5x4microchess")
+    boards = [chess.copy()]
+    while len(boards) < count and chess.game_result() is None:
+        moves = chess.legal_move_array()
+        (i, j), (dx, dy), promotion = unpack_move(int(moves[rng.integers(len(moves))]))
+        chess.make_move(i, j, dx, dy, promotion)
+        boards.append(chess.copy())
+    return boards
+
+
+def test_encode_positions_into_oversized_buffer():
+    boards = _positions(6)
+    out = np.full((len(boards) + 10, 5, 4, 19), -1, dtype=np.float32)
+    result = encode_positions(boards, out)
+    assert result is out
+    for n, chess in enumerate(boards):
+        np.testing.assert_array_equal(out[n], chess.agent_board_state())
+    # Rows past the positions are left alone
+    assert (out[len(boards):] == -1).all()